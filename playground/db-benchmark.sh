@@ -0,0 +1,6 @@
+#!/bin/sh
+
+PLAYGROUND_PATH=$(dirname "$(realpath "$0")")
+. $PLAYGROUND_PATH/env.sh
+
+exec $PYTHON $PLAYGROUND_PATH/db_benchmark.py "$@"
@@ -0,0 +1,119 @@
+"""Syslog database benchmark
+
+Fills new database with generated messages using selected sqlite settings
+and reports insert throughput, query durations and database size.
+
+"""
+
+from pathlib import Path
+import argparse
+import random
+import sys
+import tempfile
+import time
+
+from hat import aio
+
+from hat.syslog.server import common
+from hat.syslog.server import database
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=int(1e7))
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--commit-delay', type=float, default=0)
+    parser.add_argument('--db-path', type=Path, default=None)
+    parser.add_argument('--journal-mode', type=str.upper, default=None,
+                        choices=[i.value for i in database.JournalMode])
+    parser.add_argument('--synchronous', type=str.upper, default=None,
+                        choices=[i.value for i in database.Synchronous])
+    parser.add_argument('--cache-size', type=int, default=None)
+    parser.add_argument('--mmap-size', type=int, default=None)
+    parser.add_argument('--page-size', type=int, default=None)
+    parser.add_argument('--temp-store', type=str.upper, default=None,
+                        choices=[i.value for i in database.TempStore])
+    parser.add_argument('--wal-autocheckpoint', type=int, default=None)
+    parser.add_argument('--fts-column', default=[], action='append',
+                        choices=database.fts_column_names)
+    return parser
+
+
+def main():
+    args = create_argument_parser().parse_args()
+    settings = database.Settings(
+        page_size=args.page_size,
+        journal_mode=(database.JournalMode(args.journal_mode)
+                      if args.journal_mode else None),
+        synchronous=(database.Synchronous(args.synchronous)
+                     if args.synchronous else None),
+        cache_size=args.cache_size,
+        mmap_size=args.mmap_size,
+        temp_store=(database.TempStore(args.temp_store)
+                    if args.temp_store else None),
+        wal_autocheckpoint=args.wal_autocheckpoint)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = args.db_path or Path(tmp_dir) / 'syslog.db'
+        aio.run_asyncio(async_main(db_path, settings, args.rows,
+                                   args.batch_size, args.commit_delay,
+                                   args.fts_column))
+
+
+async def async_main(db_path, settings, rows, batch_size, commit_delay,
+                     fts_columns):
+    db = await database.create_database(db_path, False, commit_delay,
+                                        settings, 0, fts_columns)
+
+    try:
+        start = time.monotonic()
+        for i in range(0, rows, batch_size):
+            count = min(batch_size, rows - i)
+            await db.add_msgs([_create_msg(i + j) for j in range(count)])
+        await db.wait_committed()
+        duration = time.monotonic() - start
+
+        print(f'insert: {rows} rows in {duration:.2f}s '
+              f'({rows / duration:.0f} rows/s)')
+
+        queries = {
+            'latest': common.Filter(max_results=100),
+            'severity': common.Filter(max_results=100,
+                                      severity=common.Severity.ERROR),
+            'hostname': common.Filter(max_results=100,
+                                      hostname='host7'),
+            'msg': common.Filter(max_results=100,
+                                 msg='no such message'),
+            'msg fulltext': common.Filter(
+                max_results=100,
+                msg='no such message',
+                match_type=common.MatchType.FULLTEXT)}
+        for name, query_filter in queries.items():
+            start = time.monotonic()
+            await db.query(query_filter)
+            duration = time.monotonic() - start
+            print(f'query {name}: {duration * 1000:.1f}ms')
+
+    finally:
+        await aio.uncancellable(db.async_close())
+
+    print(f'size: {db_path.stat().st_size / 2**20:.1f}MiB')
+
+
+def _create_msg(i):
+    msg = common.Msg(
+        facility=common.Facility.USER,
+        severity=random.choice(list(common.Severity)),
+        version=1,
+        timestamp=time.time(),
+        hostname=f'host{i % 100}',
+        app_name=f'app{i % 10}',
+        procid=str(i % 1000),
+        msgid='benchmark',
+        data=None,
+        msg=f'benchmark message number {i}')
+    return time.time(), msg
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -136,6 +136,8 @@ export type RemoteState = {
     entries: Entry[];
     first_id: number | null;
     last_id: number | null;
+    cleanup_running?: boolean;
+    query_timeout?: boolean;
 };
 
 export type State = {
@@ -0,0 +1,126 @@
+"""Syslog archive merging tool"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import contextlib
+import logging.config
+import sys
+
+from hat import aio
+
+from hat.syslog.server import archive
+from hat.syslog.server.database import index_column_names
+from hat.syslog.server.main import default_db_path
+
+
+mlog: logging.Logger = logging.getLogger('hat.syslog.archive')
+"""Module logger"""
+
+default_max_entries: int = int(1e7)
+"""Default maximum number of entries in merged archive"""
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    """Create argument parser"""
+    parser = argparse.ArgumentParser(
+        description="Merge adjacent Syslog Server archive files into larger "
+                    "archive files. Merging can be executed while Syslog "
+                    "Server is running.")
+    parser.add_argument(
+        '--log-level', metavar='LEVEL', default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+        help="console log level (default INFO)")
+    parser.add_argument(
+        '--db-path', metavar='PATH', type=Path, default=default_db_path,
+        help="sqlite database file path used by Syslog Server - archive "
+             "files are located next to database file "
+             "(default $XDG_DATA_HOME/hat/syslog.db)")
+    parser.add_argument(
+        '--max-entries', metavar='N', type=int, default=default_max_entries,
+        help=f"maximum number of messages in merged archive file "
+             f"(default {default_max_entries})")
+    parser.add_argument(
+        '--compression', choices=[i.value for i in archive.Compression],
+        default=archive.Compression.NONE.value,
+        help="compression applied to merged archive files (default none)")
+    parser.add_argument(
+        '--indexes', metavar='NAMES', type=_parse_indexes, default=[],
+        help=f"comma separated list of columns with secondary index "
+             f"created in merged archive files - any of "
+             f"{', '.join(index_column_names)} (by default secondary "
+             f"indexes are not created)")
+    parser.add_argument(
+        '--vacuum', action='store_true',
+        help="vacuum merged archive files")
+    return parser
+
+
+def main():
+    """Syslog archive merging tool"""
+    parser = create_argument_parser()
+    args = parser.parse_args()
+
+    logging.config.dictConfig({
+        'version': 1,
+        'formatters': {
+            'console_formater': {
+                'format': '[%(asctime)s %(levelname)s %(name)s] %(message)s'}},
+        'handlers': {
+            'console_handler': {
+                'class': 'logging.StreamHandler',
+                'formatter': 'console_formater',
+                'level': args.log_level}},
+        'root': {
+            'level': args.log_level,
+            'handlers': ['console_handler']},
+        'disable_existing_loggers': False})
+
+    aio.init_asyncio()
+    with contextlib.suppress(asyncio.CancelledError):
+        aio.run_asyncio(async_main(
+            db_path=args.db_path,
+            max_entries=args.max_entries,
+            compression=archive.Compression(args.compression),
+            indexes=args.indexes,
+            vacuum=args.vacuum))
+
+
+async def async_main(db_path: Path,
+                     max_entries: int,
+                     compression: archive.Compression,
+                     indexes: list[str],
+                     vacuum: bool):
+    """Async main"""
+    executor = aio.create_executor(1)
+    catalog = await executor(archive.update_catalog, db_path)
+    groups = archive.get_merge_groups(catalog, max_entries)
+
+    mlog.info("merging %s archives into %s archives",
+              sum(len(group) for group in groups), len(groups))
+
+    for group in groups:
+        paths = [db_path.with_name(catalog_entry.name)
+                 for catalog_entry in group]
+
+        mlog.info("merging %s...", ', '.join(path.name for path in paths))
+        path = await archive.merge_archives(db_path=db_path,
+                                            paths=paths,
+                                            compression=compression,
+                                            indexes=indexes,
+                                            vacuum=vacuum)
+        mlog.info("merged archive %s created", path.name)
+
+
+def _parse_indexes(indexes_str):
+    indexes = [i.strip() for i in indexes_str.split(',') if i.strip()]
+    for i in indexes:
+        if i not in index_column_names:
+            raise ValueError(f'invalid index column {i}')
+
+    return indexes
+
+
+if __name__ == '__main__':
+    sys.argv[0] = 'hat-syslog-archive'
+    sys.exit(main())
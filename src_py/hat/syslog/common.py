@@ -9,6 +9,7 @@ class CommType(enum.Enum):
     UDP = 0
     TCP = 1
     TLS = 2
+    RELP = 3
 
 
 class Facility(enum.Enum):
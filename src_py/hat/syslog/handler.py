@@ -7,8 +7,11 @@ Implementation of `logging.Handler` for syslog logging protocol.
 import collections
 import contextlib
 import datetime
+import itertools
 import logging
 import os
+import re
+import select
 import socket
 import ssl
 import sys
@@ -33,6 +36,12 @@ class SyslogHandler(logging.Handler):
         queue_size: message queue size
         reconnect_delay: delay in seconds before retrying connection with
             remote syslog server
+        relp_window_size: maximum number of unacknowledged messages in case
+            of RELP communication
+
+    In case of RELP communication, messages which are not acknowledged by
+    remote syslog server prior to connection loss are resent once new
+    connection is established.
 
     """
 
@@ -41,7 +50,8 @@ class SyslogHandler(logging.Handler):
                  port: int,
                  comm_type: common.CommType | str,
                  queue_size: int = 1024,
-                 reconnect_delay: float = 5):
+                 reconnect_delay: float = 5,
+                 relp_window_size: int = 128):
         super().__init__()
 
         self.__state = _ThreadState(
@@ -53,6 +63,7 @@ class SyslogHandler(logging.Handler):
             queue=collections.deque(),
             queue_size=queue_size,
             reconnect_delay=reconnect_delay,
+            relp_window_size=relp_window_size,
             cv=threading.Condition(),
             closed=threading.Event(),
             dropped=[0])
@@ -115,6 +126,8 @@ class _ThreadState(typing.NamedTuple):
     """Message queue size"""
     reconnect_delay: float
     """Reconnect delay"""
+    relp_window_size: int
+    """RELP window size"""
     cv: threading.Condition
     """Conditional variable"""
     closed: threading.Event
@@ -135,7 +148,8 @@ def _logging_handler_thread(state):
                 s = socket.socket(type=socket.SOCK_DGRAM)
                 s.connect((state.host, state.port))
 
-            elif state.comm_type == common.CommType.TCP:
+            elif state.comm_type in (common.CommType.TCP,
+                                     common.CommType.RELP):
                 s = socket.create_connection((state.host, state.port))
                 s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
 
@@ -152,6 +166,10 @@ def _logging_handler_thread(state):
             continue
 
         try:
+            if state.comm_type == common.CommType.RELP:
+                _relp_session(state, s)
+                return
+
             while True:
                 with state.cv:
                     state.cv.wait_for(lambda: (state.closed.is_set() or
@@ -184,6 +202,128 @@ def _logging_handler_thread(state):
                 s.close()
 
 
+def _relp_session(state, s):
+    txnrs = itertools.count(1)
+    window = collections.OrderedDict()
+    buff = bytearray()
+
+    try:
+        open_txnr = next(txnrs)
+        s.sendall(_encode_relp_frame(open_txnr, b'open', _relp_open_data))
+
+        while True:
+            if state.closed.is_set():
+                return
+
+            frames = _receive_relp_frames(s, buff, _relp_poll_delay)
+            if any(txnr == open_txnr for txnr, _, _ in frames):
+                break
+
+        while True:
+            with state.cv:
+                state.cv.wait_for(lambda: (state.closed.is_set() or
+                                           len(state.queue) or
+                                           state.dropped[0]),
+                                  _relp_poll_delay if window else None)
+                if state.closed.is_set():
+                    return
+
+                msg = None
+                if len(window) < state.relp_window_size:
+                    if state.dropped[0]:
+                        msg = _create_dropped_msg(
+                            state.dropped[0], '_relp_session', 0)
+                        state.dropped[0] = 0
+
+                    elif state.queue:
+                        msg = state.queue.popleft()
+
+            if msg:
+                txnr = next(txnrs)
+                window[txnr] = msg
+                msg_bytes = encoder.msg_to_str(msg).encode()
+                s.sendall(_encode_relp_frame(txnr, b'syslog', msg_bytes))
+
+            timeout = (0 if len(window) < state.relp_window_size
+                       else _relp_poll_delay)
+            for txnr, command, _ in _receive_relp_frames(s, buff, timeout):
+                if command == b'serverclose':
+                    raise ConnectionError()
+
+                if command == b'rsp':
+                    window.pop(txnr, None)
+
+    finally:
+        if window:
+            with state.cv:
+                state.queue.extendleft(reversed(window.values()))
+                while len(state.queue) > state.queue_size:
+                    state.queue.popleft()
+                    state.dropped[0] += 1
+
+
+def _receive_relp_frames(s, buff, timeout):
+    readable, _, _ = select.select([s], [], [], timeout)
+    if not readable:
+        return []
+
+    data = s.recv(4096)
+    if not data:
+        raise ConnectionError()
+
+    buff.extend(data)
+    frames = []
+
+    while buff:
+        match = _relp_header_pattern.match(buff)
+        if not match:
+            if len(buff) > 64:
+                raise Exception('invalid relp frame')
+            break
+
+        txnr = int(match['txnr'])
+        command = bytes(match['command'])
+        datalen = int(match['datalen'])
+
+        if match['sep'] == b'\n':
+            if datalen:
+                raise Exception('invalid relp frame')
+
+            del buff[:match.end()]
+            frames.append((txnr, command, b''))
+            continue
+
+        frame_end = match.end() + datalen + 1
+        if len(buff) < frame_end:
+            break
+
+        if buff[frame_end - 1:frame_end] != b'\n':
+            raise Exception('invalid relp frame')
+
+        frames.append((txnr, command, bytes(buff[match.end():frame_end - 1])))
+        del buff[:frame_end]
+
+    return frames
+
+
+def _encode_relp_frame(txnr, command, data):
+    header = b'%d %s %d' % (txnr, command, len(data))
+    if not data:
+        return header + b'\n'
+
+    return header + b' ' + data + b'\n'
+
+
+_relp_poll_delay = 0.1
+
+_relp_open_data = (b'relp_version=0\n'
+                   b'relp_software=hat-syslog\n'
+                   b'commands=syslog')
+
+_relp_header_pattern = re.compile(
+    rb'(?P<txnr>\d+) (?P<command>[a-z]+) (?P<datalen>\d+)(?P<sep>[ \n])')
+
+
 def _record_to_msg(record):
     hat_data = {'name': str(record.name),
                 'thread': str(record.thread),
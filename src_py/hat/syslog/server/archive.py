@@ -0,0 +1,587 @@
+"""Archive databases
+
+Archive database has same structure as main database. Archive databases can
+be compressed as whole files - compressed archive file name is extended with
+compression specific suffix (``.gz`` or ``.xz``). Compressed archives are
+queried by decompressing them into temporary database file. Archive files
+are never modified - archives created by previous versions, which require
+migration, are migrated as temporary copies.
+
+Archive files of database ``<name>`` are named ``<name>.<index>`` (with
+optional compression suffix). Archive catalog, stored as JSON file
+``<name>.catalog.json`` next to database, contains entry id and entry
+timestamp range of each archive. Archive files are authoritative - catalog
+is updated (entries of missing archives are removed and entries of new or
+changed archives are added) each time it is loaded with `update_catalog`.
+
+"""
+
+from collections.abc import AsyncIterator, Collection
+from pathlib import Path
+import asyncio
+import collections
+import contextlib
+import enum
+import gzip
+import itertools
+import logging
+import lzma
+import os
+import shutil
+import sqlite3
+import tempfile
+import typing
+
+from hat import aio
+from hat import json
+
+from hat.syslog.server import database
+
+
+mlog: logging.Logger = logging.getLogger(__name__)
+"""Module logger"""
+
+copy_chunk_size: int = 1024 * 1024
+"""Number of bytes read at once during compression and decompression"""
+
+
+class Compression(enum.Enum):
+    NONE = 'none'
+    GZIP = 'gzip'
+    LZMA = 'lzma'
+
+
+compression_suffixes: dict[Compression, str] = {Compression.NONE: '',
+                                                Compression.GZIP: '.gz',
+                                                Compression.LZMA: '.xz'}
+"""Archive file name suffixes"""
+
+
+class CatalogEntry(typing.NamedTuple):
+    name: str
+    """Archive file name"""
+    first_id: int
+    last_id: int
+    first_timestamp: float
+    """Minimal entry timestamp"""
+    last_timestamp: float
+    """Maximal entry timestamp"""
+    size: int
+    """Archive file size in bytes"""
+
+
+def get_compression(path: Path) -> Compression:
+    """Get compression based on archive file name"""
+    for compression, suffix in compression_suffixes.items():
+        if suffix and path.name.endswith(suffix):
+            return compression
+
+    return Compression.NONE
+
+
+def get_uncompressed_name(path: Path) -> str:
+    """Get archive file name without compression suffix"""
+    suffix = compression_suffixes[get_compression(path)]
+    return path.name[:-len(suffix)] if suffix else path.name
+
+
+def get_archive_index(db_path: Path,
+                      path: Path
+                      ) -> int | None:
+    """Get index of archive file `path` (``None`` if `path` is not archive
+    of database `db_path`)"""
+    prefix = f'{db_path.name}.'
+    name = get_uncompressed_name(path)
+    if path.parent != db_path.parent or not name.startswith(prefix):
+        return
+
+    with contextlib.suppress(ValueError):
+        return int(name[len(prefix):])
+
+
+def get_archive_paths(db_path: Path) -> list[Path]:
+    """Get paths of archive files of database `db_path` ordered by index
+
+    This function is blocking - it should be called in executor.
+
+    """
+    paths = []
+
+    for path in db_path.parent.glob(f'{db_path.name}.*'):
+        index = get_archive_index(db_path, path)
+        if index is not None:
+            paths.append((index, path))
+
+    return [path for _, path in sorted(paths)]
+
+
+def get_catalog_path(db_path: Path) -> Path:
+    """Get archive catalog path of database `db_path`"""
+    return db_path.with_name(f'{db_path.name}.catalog.json')
+
+
+def read_catalog_entry(path: Path) -> CatalogEntry | None:
+    """Read catalog entry of archive file (``None`` if archive is empty)
+
+    This function is blocking - it should be called in executor.
+
+    """
+    size = path.stat().st_size
+
+    if get_compression(path) == Compression.NONE:
+        return _read_catalog_entry(path, path.name, size)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir) / get_uncompressed_name(path)
+        decompress_file(path, tmp_path)
+        return _read_catalog_entry(tmp_path, path.name, size)
+
+
+def update_catalog(db_path: Path) -> list[CatalogEntry]:
+    """Update and get archive catalog of database `db_path`
+
+    Catalog entries are ordered by entry ids. Catalog entries of missing
+    archive files are removed and catalog entries of new archive files (or
+    archive files with changed size) are read from archive files. This
+    function is blocking - it should be called in executor.
+
+    """
+    catalog_path = get_catalog_path(db_path)
+    entries = {}
+
+    with contextlib.suppress(Exception):
+        catalog_json = json.decode_file(catalog_path, json.Format.JSON)
+        for entry_json in catalog_json['archives']:
+            entry = CatalogEntry(**entry_json)
+            entries[entry.name] = entry
+
+    names = set()
+    changed = False
+
+    for path in get_archive_paths(db_path):
+        # archive can be concurrently removed by other process
+        try:
+            size = path.stat().st_size
+
+        except FileNotFoundError:
+            continue
+
+        names.add(path.name)
+        entry = entries.pop(path.name, None)
+        if entry and entry.size == size:
+            entries[path.name] = entry
+            continue
+
+        changed = True
+
+        try:
+            entry = read_catalog_entry(path)
+
+        except Exception as e:
+            mlog.warning("error reading archive %s: %s", path, e, exc_info=e)
+            continue
+
+        if entry:
+            entries[path.name] = entry
+
+    for name in list(entries.keys()):
+        if name not in names:
+            del entries[name]
+            changed = True
+
+    result = sorted(entries.values(), key=lambda i: i.first_id)
+
+    if changed or not catalog_path.exists():
+        _write_catalog(catalog_path, result)
+
+    return result
+
+
+def compress_file(path: Path,
+                  compression: Compression
+                  ) -> Path:
+    """Compress archive file
+
+    Compressed file is written next to `path` (with compression specific
+    suffix) and `path` is removed once compressed file is complete.
+    Resulting path is returned. This function is blocking - it should be
+    called in executor.
+
+    """
+    if compression == Compression.NONE:
+        return path
+
+    compressed_path = path.with_name(
+        path.name + compression_suffixes[compression])
+    tmp_path = compressed_path.with_name(compressed_path.name + '.tmp')
+
+    try:
+        with open(path, 'rb') as src:
+            with _open(tmp_path, 'wb', compression) as dst:
+                shutil.copyfileobj(src, dst, copy_chunk_size)
+
+        tmp_path.rename(compressed_path)
+
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    path.unlink()
+
+    mlog.debug("archive %s compressed to %s", path, compressed_path)
+    return compressed_path
+
+
+def decompress_file(path: Path,
+                    dst_path: Path):
+    """Decompress archive file `path` into `dst_path`
+
+    Compression is determined based on `path` file name. This function is
+    blocking - it should be called in executor.
+
+    """
+    with _open(path, 'rb', get_compression(path)) as src:
+        with open(dst_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, copy_chunk_size)
+
+
+def create_archive_cache(max_size: int) -> 'ArchiveCache':
+    """Create cache of decompressed archives
+
+    Decompressed archives (and migrated copies of archives which require
+    migration) are kept in temporary directory as long as their total size
+    does not exceed `max_size` bytes - least recently used archives are
+    removed first. Temporary directory is removed once cache is closed.
+
+    """
+    cache = ArchiveCache()
+    cache._max_size = max_size
+    cache._async_group = aio.Group()
+    cache._executor = aio.create_executor(1)
+    cache._tmp_dir = tempfile.TemporaryDirectory()
+    cache._lock = asyncio.Lock()
+    cache._entries = collections.OrderedDict()
+    cache._size = 0
+    cache._counter = itertools.count(1)
+
+    cache._async_group.spawn(aio.call_on_cancel, cache._tmp_dir.cleanup)
+
+    return cache
+
+
+class ArchiveCache(aio.Resource):
+    """Cache of decompressed and migrated archives (see
+    `create_archive_cache`)"""
+
+    @property
+    def async_group(self) -> aio.Group:
+        """Async group"""
+        return self._async_group
+
+    @property
+    def size(self) -> int:
+        """Total size of decompressed archives in bytes"""
+        return self._size
+
+    @contextlib.asynccontextmanager
+    async def uncompress(self, path: Path) -> AsyncIterator[Path]:
+        """Get path of decompressed and migrated archive
+
+        Archive is decompressed (or copied, if it requires migration) and
+        migrated only if it is not already available in cache (or if
+        archive file is changed after it was prepared). Uncompressed archive
+        which doesn't require migration is used as is. Prepared archive is
+        not removed from cache until context exits.
+
+        Raises:
+            FileNotFoundError
+
+        """
+        async with self._lock:
+            if not await self._executor(path.exists):
+                raise FileNotFoundError(f'archive {path} not found')
+
+            stat = await self._executor(path.stat)
+            key = path, stat.st_mtime_ns, stat.st_size
+            entry = self._entries.get(key)
+
+            if entry is None:
+                tmp_path = (Path(self._tmp_dir.name) /
+                            f'{next(self._counter)}.db')
+
+                try:
+                    prepared = await _prepare_archive(self._executor, path,
+                                                      tmp_path)
+                    size = (await self._executor(_ext_get_size, tmp_path)
+                            if prepared else 0)
+
+                except BaseException:
+                    await aio.uncancellable(
+                        self._executor(_ext_remove_database_files, tmp_path))
+                    raise
+
+                if prepared:
+                    entry = _ArchiveCacheEntry(tmp_path, size)
+                    self._entries[key] = entry
+                    self._size += size
+                    mlog.debug("archive %s prepared in cache", path)
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.refs += 1
+
+        if entry is None:
+            yield path
+            return
+
+        try:
+            yield entry.path
+
+        finally:
+            entry.refs -= 1
+            self._evict()
+
+    def _evict(self):
+        for key, entry in list(self._entries.items()):
+            if self._size <= self._max_size:
+                break
+
+            if entry.refs > 0:
+                continue
+
+            del self._entries[key]
+            self._size -= entry.size
+            _ext_remove_database_files(entry.path)
+
+
+class _ArchiveCacheEntry:
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.refs = 0
+
+
+@contextlib.asynccontextmanager
+async def open_archive(path: Path,
+                       cache: ArchiveCache | None = None
+                       ) -> AsyncIterator[database.Database]:
+    """Open archive database
+
+    Compressed archive is decompressed into temporary file which is removed
+    once archive database is closed. Archives created by previous versions,
+    which require migration, are copied (or decompressed) into temporary
+    file which is migrated (existing indexes are kept). If `cache` is
+    provided, decompressed and migrated archive is obtained from cache
+    instead (and is kept in cache after archive database is closed).
+    Archive database is opened read-only, with its existing indexes.
+
+    Raises:
+        FileNotFoundError
+
+    """
+    uncompress = cache.uncompress(path) if cache else _uncompress(path)
+
+    async with uncompress as db_path:
+        db = await database.create_database(db_path, False, read_only=True)
+
+        try:
+            yield db
+
+        finally:
+            await aio.uncancellable(db.async_close())
+
+
+def install_archive(path: Path,
+                    archive_path: Path,
+                    compression: Compression
+                    ) -> Path:
+    """Compress complete archive database `path` and move it to
+    `archive_path` (extended with compression suffix)
+
+    Archive becomes visible (as file with archive name) only after it is
+    complete. Resulting path is returned. This function is blocking - it
+    should be called in executor.
+
+    """
+    compressed_path = compress_file(path, compression)
+    result = archive_path.with_name(
+        archive_path.name + compression_suffixes[compression])
+    compressed_path.replace(result)
+    return result
+
+
+def get_merge_groups(catalog: list[CatalogEntry],
+                     max_entries: int
+                     ) -> list[list[CatalogEntry]]:
+    """Get groups of adjacent catalog entries which should be merged
+
+    Each group contains at least two catalog entries with up to
+    `max_entries` entries in total.
+
+    """
+    groups = []
+    group = []
+    group_entries = 0
+
+    for catalog_entry in catalog:
+        entries = catalog_entry.last_id - catalog_entry.first_id + 1
+
+        if group and group_entries + entries > max_entries:
+            groups.append(group)
+            group = []
+            group_entries = 0
+
+        group.append(catalog_entry)
+        group_entries += entries
+
+    groups.append(group)
+    return [group for group in groups if len(group) > 1]
+
+
+async def merge_archives(db_path: Path,
+                         paths: list[Path],
+                         compression: Compression = Compression.NONE,
+                         indexes: Collection[str] = (),
+                         vacuum: bool = False
+                         ) -> Path:
+    """Merge archive files into single archive
+
+    Entries from all `paths` are copied into new archive database (with
+    secondary `indexes`), without loading them into memory. Archives
+    created by previous versions are migrated as temporary copies (`paths`
+    are not modified until they are removed). If `vacuum`
+    is set, new archive database is vacuumed. New archive, compressed with
+    `compression`, replaces first of `paths` (with updated compression
+    suffix) and all other `paths` are removed. Archive catalog is updated
+    once merged archive is installed. Path of merged archive is returned.
+
+    """
+    executor = aio.create_executor(1)
+    name = get_uncompressed_name(paths[0])
+    tmp_path = db_path.with_name(f'{name}.merge')
+    await executor(_ext_remove_database_files, tmp_path)
+
+    try:
+        db = await database.create_database(tmp_path, True,
+                                            indexes=indexes)
+
+        try:
+            for path in paths:
+                async with _uncompress(path) as src_path:
+                    await db.merge(src_path)
+
+            if vacuum:
+                await db.vacuum()
+
+        finally:
+            await aio.uncancellable(db.async_close())
+
+        result = await executor(install_archive, tmp_path,
+                                db_path.with_name(name), compression)
+
+    except BaseException:
+        await aio.uncancellable(
+            executor(_ext_remove_database_files, tmp_path))
+        raise
+
+    for path in paths:
+        if path != result:
+            await executor(path.unlink, True)
+
+    await executor(update_catalog, db_path)
+
+    mlog.debug("merged %s archives into %s", len(paths), result)
+    return result
+
+
+@contextlib.asynccontextmanager
+async def _uncompress(path):
+    executor = aio.create_executor(1)
+
+    if not await executor(path.exists):
+        raise FileNotFoundError(f'archive {path} not found')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir) / get_uncompressed_name(path)
+        prepared = await _prepare_archive(executor, path, tmp_path)
+        yield tmp_path if prepared else path
+
+
+async def _prepare_archive(executor, path, tmp_path):
+    # archive is decompressed or copied into tmp_path only if it is
+    # compressed or if it requires migration (archive files are not
+    # modified) - returns whether tmp_path is used
+    if get_compression(path) != Compression.NONE:
+        await executor(decompress_file, path, tmp_path)
+
+    elif await executor(database.is_migration_required, path):
+        await executor(shutil.copyfile, path, tmp_path)
+
+    else:
+        return False
+
+    if not await executor(database.is_migration_required, tmp_path):
+        return True
+
+    mlog.info("migrating copy of archive %s", path)
+    fts_columns, indexes = await executor(database.get_indexes, tmp_path)
+    db = await database.create_database(tmp_path, True,
+                                        fts_columns=fts_columns,
+                                        indexes=indexes)
+    await db.async_close()
+    return True
+
+
+def _ext_get_size(path):
+    return path.stat().st_size
+
+
+def _ext_remove_database_files(path):
+    for suffix in ['', '-journal', '-wal', '-shm']:
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+
+def _read_catalog_entry(path, name, size):
+    # archives are not modified so shared memory locking is not required
+    # (even in case of WAL journal mode)
+    conn = sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True)
+
+    try:
+        c = conn.execute("SELECT (SELECT MIN(rowid) FROM log), "
+                         "(SELECT MAX(rowid) FROM log), "
+                         "(SELECT MIN(entry_timestamp) FROM log), "
+                         "(SELECT MAX(entry_timestamp) FROM log)")
+        first_id, last_id, first_timestamp, last_timestamp = c.fetchone()
+
+    finally:
+        conn.close()
+
+    if first_id is None:
+        return
+
+    return CatalogEntry(name=name,
+                        first_id=first_id,
+                        last_id=last_id,
+                        first_timestamp=first_timestamp,
+                        last_timestamp=last_timestamp,
+                        size=size)
+
+
+def _write_catalog(catalog_path, entries):
+    # catalog can be concurrently written by other process
+    tmp_path = catalog_path.with_name(
+        f'{catalog_path.name}.{os.getpid()}.tmp')
+    json.encode_file({'archives': [entry._asdict() for entry in entries]},
+                     tmp_path, json.Format.JSON)
+    tmp_path.replace(catalog_path)
+
+
+def _open(path, mode, compression):
+    if compression == Compression.GZIP:
+        return gzip.open(path, mode)
+
+    if compression == Compression.LZMA:
+        return lzma.open(path, mode)
+
+    return open(path, mode)
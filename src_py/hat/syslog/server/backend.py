@@ -1,43 +1,180 @@
 """Backend implementation"""
 
-from collections.abc import Callable
+from collections.abc import AsyncIterator, Callable, Collection
 from pathlib import Path
 import asyncio
-import contextlib
+import collections
+import functools
 import itertools
 import logging
+import math
+import time
+import typing
 
 from hat import aio
 from hat import util
 
+from hat.syslog.server import archive
 from hat.syslog.server import common
 from hat.syslog.server import database
+from hat.syslog.server import segments
 
 
 mlog: logging.Logger = logging.getLogger(__name__)
 """Module logger"""
 
-register_delay: float = 0.1
-"""Registration delay in seconds"""
+register_queue_high_watermark: float = 0.8
+"""Registration queue high watermark
 
-register_queue_size: int = 50
-"""Registration queue size"""
+Backend becomes congested once number of messages in registration queue
+reaches this fraction of registration queue size.
 
-register_queue_treshold: int = 10
-"""Registration queue threshold"""
+"""
+
+register_queue_low_watermark: float = 0.2
+"""Registration queue low watermark
+
+Congested backend stops being congested once number of messages in
+registration queue drops to this fraction of registration queue size.
+
+"""
+
+commit_latency_weight: float = 0.2
+"""Weight of latest database commit duration in commit latency estimate"""
+
+
+cleanup_chunk_size: int = 1024 * 16
+"""Number of entries deleted at once during database cleanup
+
+Database cleanup is executed in background - message registration continues
+in between deletion of each chunk.
+
+"""
+
+archive_chunk_size: int = 1024 * 16
+"""Number of entries copied to archive database at once"""
+
+archive_cache_size: int = 256 * 1024 * 1024
+"""Maximum size in bytes of decompressed archives kept in cache for
+querying archives"""
+
+retention_check_period: float = 10
+"""Period in seconds of checking age and size retention policies"""
+
+retention_size_low_watermark: float = 0.9
+"""Retention size low watermark
+
+Once database size exceeds maximum size, database cleanup removes
+estimated number of oldest entries required for reducing database size to
+this fraction of maximum size.
+
+"""
+
+vacuum_check_period: float = 10
+"""Period in seconds of checking for free database pages"""
+
+vacuum_chunk_pages: int = 256
+"""Number of free pages returned to file system at once
+
+Incremental vacuum is executed only while registration queue is empty and
+database cleanup is not running - message registration continues in between
+vacuuming of each chunk.
+
+"""
+
+
+class RegisterConf(typing.NamedTuple):
+    max_delay: float = 0.1
+    """Maximum registration delay in seconds"""
+    queue_size: int = 1024
+    """Registration queue size"""
+    max_batch_size: int = 1024
+    """Maximum number of messages in single batch
+
+    Batch is closed before delay expires once number of queued messages
+    reaches this size. Messages queued beyond this size remain in
+    registration queue and are included in following batches.
+
+    """
+    commit_delay: float = 0
+    """Group commit delay in seconds (``0`` disables group commit)"""
+
+
+class RetentionConf(typing.NamedTuple):
+    max_age: float = 0
+    """Maximum entry age in seconds (``0`` represents unlimited age)"""
+    max_size: int = 0
+    """Maximum database size in bytes (``0`` represents unlimited size)"""
+    severity_max_ages: dict[common.Severity, float] = {}
+    """Maximum age in seconds of entries with specific severity"""
+    summarize: bool = False
+    """Should entries removed by severity max age be summarized"""
 
 
 async def create_backend(path: Path,
                          low_size: int,
                          high_size: int,
                          enable_archive: bool,
-                         disable_journal: bool
+                         disable_journal: bool,
+                         register_conf: RegisterConf = RegisterConf(),
+                         db_settings: database.Settings = database.Settings(),
+                         db_read_pool_size: int = 0,
+                         db_fts_columns: Collection[str] = (),
+                         db_indexes: Collection[str] = (),
+                         db_segments: segments.SegmentConf | None = None,
+                         retention_conf: RetentionConf = RetentionConf(),
+                         archive_compression: archive.Compression = archive.Compression.NONE,  # NOQA
+                         query_archives: bool = False
                          ) -> 'Backend':
-    """Create backend"""
-    db = await database.create_database(path, disable_journal)
+    """Create backend
+
+    Database cleanup is triggered once number of entries exceeds
+    `high_size` (if `high_size` is greater than ``0``), once oldest entry
+    is older than `retention_conf.max_age` or once database size exceeds
+    `retention_conf.max_size`. Cleanup removes oldest entries so that all
+    of these retention policies are satisfied - number of entries is
+    reduced to `low_size` only if cleanup is triggered by number of
+    entries.
+
+    Additionally, cleanup removes entries older than maximum age configured
+    for their severity (`retention_conf.severity_max_ages`). These entries
+    are not archived - if `retention_conf.summarize` is set, they are
+    counted in per minute summaries (see `Backend.query_summaries`).
+
+    If `enable_archive` is set, archive databases are compressed with
+    `archive_compression` once they are complete. Archive catalog (see
+    `archive.update_catalog`) is updated after each archive is created.
+    If `query_archives` is set, queries which are not satisfied by entries
+    available in database continue with archives overlapping query's entry
+    id and entry timestamp range. Decompressed compressed archives are kept
+    in cache limited by `archive_cache_size` (see
+    `archive.create_archive_cache`).
+
+    If `db_segments` is provided, entries are stored in segmented database
+    (see `segments.SegmentedDatabase`) and database cleanup removes (or
+    archives) whole segments.
+
+    While backend is idle, free database pages left by database cleanup are
+    returned to file system in chunks of `vacuum_chunk_pages` pages (see
+    `database.Database.incremental_vacuum`).
+
+    """
+    if db_segments:
+        db = await segments.create_segmented_database(
+            path, db_segments, disable_journal, register_conf.commit_delay,
+            db_settings, db_read_pool_size, db_fts_columns, db_indexes)
+
+    else:
+        db = await database.create_database(path, disable_journal,
+                                            register_conf.commit_delay,
+                                            db_settings, db_read_pool_size,
+                                            db_fts_columns, db_indexes)
+    executor = aio.create_executor()
     try:
         first_id = await db.get_first_id()
         last_id = await db.get_last_id()
+        catalog = (await executor(archive.update_catalog, path)
+                   if enable_archive or query_archives else [])
     except BaseException:
         await aio.uncancellable(db.async_close())
         raise
@@ -47,17 +184,47 @@ async def create_backend(path: Path,
     backend._low_size = low_size
     backend._high_size = high_size
     backend._enable_archive = enable_archive
+    backend._archive_compression = archive_compression
+    backend._query_archives = query_archives
+    backend._catalog = catalog
+    backend._catalog_mtime = None
     backend._disable_journal = disable_journal
+    backend._db_segments = db_segments
     backend._db = db
     backend._first_id = first_id
     backend._last_id = last_id
     backend._async_group = aio.Group()
     backend._change_cbs = util.CallbackRegistry()
-    backend._msg_queue = aio.Queue(register_queue_size)
-    backend._executor = aio.create_executor()
+    backend._congestion_cbs = util.CallbackRegistry()
+    backend._congested = False
+    backend._cleanup_running = False
+    backend._register_conf = register_conf
+    backend._retention_conf = retention_conf
+    backend._severity_first_ids = {}
+    backend._msg_queue = aio.Queue(register_conf.queue_size)
+    backend._batch_future = None
+    backend._batch_remaining = 0
+    backend._commit_latency = register_conf.max_delay
+    backend._register_count = 0
+    backend._commit_count = 0
+    backend._sync_futures = collections.deque()
+    backend._committed_queue = aio.Queue()
+    backend._executor = executor
+    backend._archive_cache = (archive.create_archive_cache(archive_cache_size)
+                              if query_archives else None)
 
     backend._async_group.spawn(aio.call_on_cancel, db.async_close)
+    if backend._archive_cache:
+        backend._async_group.spawn(aio.call_on_cancel,
+                                   backend._archive_cache.async_close)
     backend._async_group.spawn(backend._loop)
+    if register_conf.commit_delay > 0:
+        backend._async_group.spawn(backend._committed_loop)
+    backend._async_group.spawn(backend._vacuum_loop)
+
+    if (retention_conf.max_age > 0 or retention_conf.max_size > 0 or
+            retention_conf.severity_max_ages):
+        backend._async_group.spawn(backend._retention_loop)
 
     mlog.debug('created backend with database %s', path)
     return backend
@@ -80,18 +247,48 @@ class Backend(aio.Resource):
         """Last entry id"""
         return self._last_id
 
+    @property
+    def is_congested(self) -> bool:
+        """Is registration queue above high watermark"""
+        return self._congested
+
+    @property
+    def is_cleanup_running(self) -> bool:
+        """Is database cleanup running"""
+        return self._cleanup_running
+
+    @property
+    def fts_columns(self) -> list[str]:
+        """Names of columns included in database full-text index"""
+        return self._db.fts_columns
+
     def register_change_cb(self,
                            cb: Callable[[list[common.Entry]], None]
                            ) -> util.RegisterCallbackHandle:
         """Register change callback
 
         Callback is called if `first_id` changes and/or `last_id` changes
-        and/or new entries are available (passed as argument to registered
-        callback).
+        and/or `is_cleanup_running` changes and/or new entries are available
+        (passed as argument to registered callback). If group commit is
+        enabled, new entries are passed to callback only after they are
+        committed.
 
         """
         return self._change_cbs.register(cb)
 
+    def register_congestion_cb(self,
+                               cb: Callable[[bool], None]
+                               ) -> util.RegisterCallbackHandle:
+        """Register congestion callback
+
+        Callback is called with new `is_congested` value each time it
+        changes. Congestion is signaled once registration queue reaches
+        high watermark and cleared once registration queue drops to low
+        watermark.
+
+        """
+        return self._congestion_cbs.register(cb)
+
     async def register(self,
                        timestamp: float,
                        msg: common.Msg):
@@ -100,19 +297,199 @@ class Backend(aio.Resource):
         Registration adds msg to registration queue. If queue is full, wait
         until message can be successfully added.
 
-        When message is added to empty queue, registration delay timer is
-        started. Once delay timer expires or if number of messages in queue
-        is greater than threshold, all messages are removed from queue and
-        inserted into sqlite database.
+        Messages are removed from queue and inserted into sqlite database in
+        batches. When message is added to empty queue, batch delay timer is
+        started. Batch delay is estimated database commit latency (limited
+        by maximum registration delay) - while previous commit is expected
+        to take longer, it is worth waiting for more messages. Until first
+        commit latency is measured, maximum registration delay is used.
+        Once delay timer expires or number of queued messages reaches
+        `RegisterConf.max_batch_size`, queued messages (up to
+        `RegisterConf.max_batch_size`) are inserted into database as single
+        batch.
 
         """
         await self._msg_queue.put((timestamp, msg))
+        self._register_count += 1
+        self._update_congestion()
+
+        if (self._batch_future and
+                self._msg_queue.qsize() >= self._batch_remaining and
+                not self._batch_future.done()):
+            self._batch_future.set_result(None)
+
+    async def sync(self):
+        """Wait until all previously registered messages are stored
+
+        If group commit is enabled, this includes waiting for database
+        transaction commit.
+
+        Raises:
+            ConnectionError
+
+        """
+        if self._commit_count < self._register_count:
+            if not self.is_open:
+                raise ConnectionError()
+
+            future = asyncio.get_running_loop().create_future()
+            self._sync_futures.append((self._register_count, future))
+            await future
+
+        await self._db.wait_committed()
+
+    @property
+    def catalog(self) -> list[archive.CatalogEntry]:
+        """Archive catalog"""
+        return self._catalog
+
+    async def get_page_stats(self) -> database.PageStats:
+        """Get database page statistics"""
+        return await self._db.get_page_stats()
+
+    @property
+    def query_stats(self) -> dict[tuple[str, ...], database.QueryStats]:
+        """Database query statistics aggregated by filter shape"""
+        return self._db.query_stats.get()
 
     async def query(self,
-                    filter: common.Filter
+                    filter: common.Filter,
+                    timeout: float | None = None
                     ) -> list[common.Entry]:
-        """Query entries"""
-        return await self._db.query(filter)
+        """Query entries
+
+        If archive querying is enabled and database does not contain
+        `filter.max_results` entries, query continues with archives.
+
+        If query execution (including archives) exceeds `timeout` seconds,
+        `database.QueryTimeoutError` containing entries found prior to
+        timeout is raised. Cancellation of this coroutine interrupts query
+        execution.
+
+        Raises:
+            database.QueryTimeoutError
+
+        """
+        deadline = (time.monotonic() + timeout if timeout is not None
+                    else None)
+        first_id = self._first_id
+        entries = await self._db.query(filter, timeout)
+
+        if not self._query_archives:
+            return entries
+
+        archive_filter = self._get_archive_filter(
+            filter, first_id, entries[-1] if entries else None, len(entries))
+        if archive_filter is None:
+            return entries
+
+        async def query_archives():
+            async for entry in self._iter_archives_query(archive_filter):
+                entries.append(entry)
+
+        archives_timeout = (max(deadline - time.monotonic(), 0)
+                            if deadline is not None else None)
+
+        try:
+            await asyncio.wait_for(query_archives(), archives_timeout)
+
+        except asyncio.TimeoutError:
+            raise database.QueryTimeoutError(entries)
+
+        return entries
+
+    async def query_summaries(self,
+                              entry_timestamp_from: float | None = None,
+                              entry_timestamp_to: float | None = None
+                              ) -> list[common.Summary]:
+        """Query summaries of entries removed by severity max age"""
+        return await self._db.query_summaries(entry_timestamp_from,
+                                              entry_timestamp_to)
+
+    async def iter_query(self,
+                         filter: common.Filter,
+                         chunk_size: int = 1024
+                         ) -> AsyncIterator[common.Entry]:
+        """Iterate over entries fetched in chunks
+
+        See `database.Database.iter_query`.
+
+        """
+        first_id = self._first_id
+        last_entry = None
+        count = 0
+
+        async for entry in self._db.iter_query(filter, chunk_size):
+            yield entry
+            last_entry = entry
+            count += 1
+
+        if not self._query_archives:
+            return
+
+        archive_filter = self._get_archive_filter(filter, first_id,
+                                                  last_entry, count)
+        if archive_filter is None:
+            return
+
+        async for entry in self._iter_archives_query(archive_filter,
+                                                     chunk_size):
+            yield entry
+
+    def _get_archive_filter(self, filter, first_id, last_entry, count):
+        if filter.max_results is not None:
+            if count >= filter.max_results:
+                return
+
+            filter = filter._replace(max_results=filter.max_results - count)
+
+        # entries which are both archived and not yet deleted from database
+        # (during cleanup) are skipped
+        last_ids = [filter.last_id,
+                    first_id - 1 if first_id is not None else None,
+                    last_entry.id - 1 if last_entry else None]
+        last_ids = [i for i in last_ids if i is not None]
+
+        return filter._replace(last_id=min(last_ids) if last_ids else None)
+
+    async def _iter_archives_query(self, filter, chunk_size=1024):
+        remaining = filter.max_results
+        await self._refresh_catalog()
+
+        for catalog_entry in reversed(self._catalog):
+            if remaining is not None and remaining < 1:
+                break
+
+            if (filter.last_id is not None and
+                    catalog_entry.first_id > filter.last_id):
+                continue
+
+            if (filter.entry_timestamp_from is not None and
+                    catalog_entry.last_timestamp <
+                    filter.entry_timestamp_from):
+                continue
+
+            if (filter.entry_timestamp_to is not None and
+                    catalog_entry.first_timestamp >
+                    filter.entry_timestamp_to):
+                continue
+
+            path = self._path.parent / catalog_entry.name
+            mlog.debug("querying archive %s", path)
+
+            try:
+                async with archive.open_archive(
+                        path, self._archive_cache) as db:
+                    async for entry in db.iter_query(
+                            filter._replace(max_results=remaining),
+                            chunk_size):
+                        yield entry
+
+                        if remaining is not None:
+                            remaining -= 1
+
+            except FileNotFoundError:
+                mlog.debug("archive %s not found", path)
 
     async def _loop(self):
         try:
@@ -126,43 +503,97 @@ class Backend(aio.Resource):
         finally:
             self.close()
             self._msg_queue.close()
+
+            for _, future in self._sync_futures:
+                if not future.done():
+                    future.set_exception(ConnectionError())
+            self._sync_futures.clear()
+
             mlog.debug('backend loop closed')
 
+    async def _committed_loop(self):
+        try:
+            while True:
+                entries_list = [await self._committed_queue.get()]
+                while not self._committed_queue.empty():
+                    entries_list.append(self._committed_queue.get_nowait())
+
+                # all queued entries are added to database prior to
+                # waiting for commit
+                await self._db.wait_committed()
+
+                for entries in entries_list:
+                    self._change_cbs.notify(entries)
+
+        except Exception as e:
+            mlog.warning("committed loop error: %s", e, exc_info=e)
+
+        finally:
+            self.close()
+            self._committed_queue.close()
+
     async def _get_msgs(self):
         loop = asyncio.get_running_loop()
-        msgs = []
+        max_batch_size = max(self._register_conf.max_batch_size, 1)
+        msgs = [await self._msg_queue.get()]
 
-        msg = await self._msg_queue.get()
-        msgs.append(msg)
+        delay = min(self._register_conf.max_delay, self._commit_latency)
+        if delay > 0 and self._msg_queue.qsize() < max_batch_size - 1:
+            self._batch_future = loop.create_future()
+            self._batch_remaining = max_batch_size - 1
+            handle = loop.call_later(delay, _set_future_result,
+                                     self._batch_future)
 
-        start = loop.time()
-        while True:
-            while not self._msg_queue.empty():
-                msgs.append(self._msg_queue.get_nowait())
-            timeout = register_delay - (loop.time() - start)
-            if timeout <= 0:
-                break
-            if len(msgs) >= register_queue_treshold:
-                break
-            async_group = aio.Group()
             try:
-                f = async_group.spawn(self._msg_queue.get)
-                await aio.wait_for(asyncio.shield(f), timeout)
-            except asyncio.TimeoutError:
-                break
+                await self._batch_future
+
             finally:
-                await aio.uncancellable(async_group.async_close())
-                if not f.cancelled():
-                    msgs.append(f.result())
+                handle.cancel()
+                self._batch_future = None
 
-        while not self._msg_queue.empty():
+        # batch size follows queue depth - once messages are accumulated in
+        # queue (database inserts are slower than message reception), each
+        # batch contains max batch size messages
+        while len(msgs) < max_batch_size and not self._msg_queue.empty():
             msgs.append(self._msg_queue.get_nowait())
+
+        self._update_congestion()
         return msgs
 
+    def _update_congestion(self):
+        size = self._msg_queue.qsize()
+        maxsize = self._msg_queue.maxsize
+        if maxsize <= 0:
+            return
+
+        if self._congested:
+            if size > maxsize * register_queue_low_watermark:
+                return
+
+        else:
+            if size < maxsize * register_queue_high_watermark:
+                return
+
+        self._congested = not self._congested
+        mlog.debug("backend congestion changed (congested: %s; "
+                   "queue size: %s)", self._congested, size)
+        self._congestion_cbs.notify(self._congested)
+
     async def _process_msgs(self, msgs):
         mlog.debug("registering new messages (message count: %s)...",
                    len(msgs))
+        start = time.monotonic()
         entries = await self._db.add_msgs(msgs)
+        self._commit_latency += commit_latency_weight * (
+            time.monotonic() - start - self._commit_latency)
+
+        self._commit_count += len(msgs)
+        while (self._sync_futures and
+                self._sync_futures[0][0] <= self._commit_count):
+            _, future = self._sync_futures.popleft()
+            if not future.done():
+                future.set_result(None)
+
         if not entries:
             return
         entries = list(reversed(entries))
@@ -173,32 +604,214 @@ class Backend(aio.Resource):
 
         mlog.debug("backend state changed (first_id: %s; last_id: %s)",
                    self._first_id, self._last_id)
-        self._change_cbs.notify(entries)
 
-        if self._high_size <= 0:
+        # with group commit, entries are notified once they are committed
+        # (same as sync)
+        if self._register_conf.commit_delay > 0:
+            self._committed_queue.put_nowait(entries)
+
+        else:
+            self._change_cbs.notify(entries)
+
+        if self._high_size <= 0 or self._cleanup_running:
             return
         if self._last_id - self._first_id + 1 <= self._high_size:
             return
 
-        mlog.debug("database cleanup starting...")
-        await self._db_cleanup()
+        self._start_cleanup()
+
+    async def _retention_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(retention_check_period)
+
+                if self._cleanup_running or self._first_id is None:
+                    continue
+
+                if (await self._get_cleanup_first_id() > self._first_id or
+                        await self._get_severity_end_ids()):
+                    self._start_cleanup()
+
+        except Exception as e:
+            mlog.error("retention loop error: %s", e, exc_info=e)
+
+        finally:
+            self.close()
+
+    async def _vacuum_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(vacuum_check_period)
+
+                while self._is_idle():
+                    page_count = await self._db.incremental_vacuum(
+                        vacuum_chunk_pages)
+                    if page_count < vacuum_chunk_pages:
+                        break
+
+        except Exception as e:
+            mlog.error("vacuum loop error: %s", e, exc_info=e)
+
+        finally:
+            self.close()
+
+    def _is_idle(self):
+        return self._msg_queue.empty() and not self._cleanup_running
+
+    def _start_cleanup(self):
+        self._set_cleanup_running(True)
+        self._async_group.spawn(self._cleanup_loop)
+
+    async def _cleanup_loop(self):
+        try:
+            mlog.debug("database cleanup starting...")
+            await self._db_cleanup()
+            mlog.debug("database cleanup finished")
+
+        except Exception as e:
+            mlog.error("database cleanup error: %s", e, exc_info=e)
+            self.close()
+
+        finally:
+            self._set_cleanup_running(False)
+
+    async def _get_cleanup_first_id(self):
+        first_id = self._first_id
+        count = self._last_id - self._first_id + 1
+
+        if self._high_size > 0 and count > self._high_size:
+            first_id = max(first_id, self._last_id - self._low_size + 1)
+
+        if self._retention_conf.max_age > 0:
+            last_id = await self._db.get_last_id_before(
+                time.time() - self._retention_conf.max_age)
+            if last_id is not None:
+                first_id = max(first_id, last_id + 1)
+
+        if self._retention_conf.max_size > 0:
+            size = await self._db.get_size()
+            if size > self._retention_conf.max_size:
+                # number of removed entries is estimated based on average
+                # entry size
+                low_size = (self._retention_conf.max_size *
+                            retention_size_low_watermark)
+                first_id = max(first_id, self._first_id + math.ceil(
+                    count * (1 - low_size / size)))
+
+        return min(first_id, self._last_id + 1)
+
+    async def _get_severity_end_ids(self):
+        end_ids = {}
+        now = time.time()
+        max_ages = self._retention_conf.severity_max_ages
+
+        for severity, max_age in max_ages.items():
+            last_id = await self._db.get_last_id_before(now - max_age)
+            if last_id is None:
+                continue
+
+            start_id = max(self._severity_first_ids.get(severity, 0),
+                           self._first_id)
+            if last_id >= start_id:
+                end_ids[severity] = last_id + 1
+
+        return end_ids
 
     async def _db_cleanup(self):
-        first_id = self._last_id - self._low_size + 1
-        if first_id > self._last_id:
-            first_id = None
-        if first_id <= self._first_id:
+        if self._first_id is None:
+            return
+
+        first_id = await self._get_cleanup_first_id()
+        if first_id > self._first_id:
+            await self._remove_entries(first_id)
+
+        if self._first_id is not None:
+            end_ids = await self._get_severity_end_ids()
+            for severity, end_id in end_ids.items():
+                await self._remove_severity_entries(severity, end_id)
+
+        # interned values referenced only by deleted entries
+        await self._db.delete_unused_values(cleanup_chunk_size)
+
+    async def _remove_severity_entries(self, severity, end_id):
+        start_id = max(self._severity_first_ids.get(severity, 0),
+                       self._first_id)
+        entry_count = 0
+
+        # same as other cleanup, entries are deleted in chunks
+        while start_id < end_id:
+            chunk_end_id = min(start_id + cleanup_chunk_size, end_id)
+            entry_count += await self._db.delete_severity(
+                severity, start_id, chunk_end_id,
+                self._retention_conf.summarize)
+            start_id = chunk_end_id
+            self._severity_first_ids[severity] = start_id
+
+        mlog.debug("database cleanup removed %s entries with severity %s",
+                   entry_count, severity.name)
+
+    async def _remove_entries(self, first_id):
+        if self._db_segments:
+            await self._remove_segments(first_id)
             return
 
         if self._enable_archive:
             mlog.debug("archiving database entries...")
             await self._archive_db(first_id)
 
-        await self._db.delete(first_id)
-        self._first_id = first_id
+        # entries are deleted in chunks so that message registration
+        # (executed by same database connection) is not blocked until
+        # all entries are deleted
+        while self._first_id < first_id:
+            chunk_first_id = min(self._first_id + cleanup_chunk_size,
+                                 first_id)
+            await self._db.delete(chunk_first_id)
+            self._first_id = chunk_first_id
+
+            mlog.debug("database cleanup progress (deleted until: %s; "
+                       "remaining: %s)",
+                       chunk_first_id, first_id - chunk_first_id)
+
+            if self._first_id > self._last_id:
+                self._first_id = None
+                self._last_id = None
+
+            mlog.debug("backend state changed (first_id: %s; last_id: %s)",
+                       self._first_id, self._last_id)
+            self._change_cbs.notify([])
+
+            if self._first_id is None:
+                break
+
+    def _set_cleanup_running(self, cleanup_running):
+        if self._cleanup_running == cleanup_running:
+            return
+
+        self._cleanup_running = cleanup_running
+        mlog.debug("backend cleanup state changed (running: %s)",
+                   cleanup_running)
+        self._change_cbs.notify([])
+
+    async def _remove_segments(self, first_id):
+        # only segments containing entries prior to first_id are removed -
+        # database can contain more than low_size entries after cleanup
+        archive_segment = (
+            functools.partial(_ext_archive_segment, self._path,
+                              self._archive_compression)
+            if self._enable_archive else None)
+
+        count = await self._db.remove_segments(first_id, archive_segment)
+        if not count:
+            return
+
+        if self._enable_archive:
+            await self._update_catalog()
+
+        self._first_id = await self._db.get_first_id()
         if self._first_id is None:
             self._last_id = None
 
+        mlog.debug("database cleanup removed %s segments", count)
         mlog.debug("backend state changed (first_id: %s; last_id: %s)",
                    self._first_id, self._last_id)
         self._change_cbs.notify([])
@@ -206,27 +819,61 @@ class Backend(aio.Resource):
     async def _archive_db(self, first_id):
         archive_path = await self._async_group.spawn(
             self._executor, _ext_get_new_archive_path, self._path)
-        archive = await database.create_database(
-            archive_path, self._disable_journal)
-        try:
-            entries = await self._db.query(common.Filter(
-                last_id=first_id - 1 if first_id is not None else None))
-            await archive.add_entries(entries)
-        finally:
-            await aio.uncancellable(archive.async_close())
 
+        # incomplete archive is not visible as archive file
+        tmp_path = archive_path.with_name(f'{archive_path.name}.tmp')
+        await self._async_group.spawn(self._executor, tmp_path.unlink, True)
+        await self._db.archive(tmp_path, first_id - 1, archive_chunk_size)
 
-def _ext_get_new_archive_path(db_path):
-    last_index = 0
+        mlog.debug("installing archive %s...", archive_path)
+        await self._async_group.spawn(
+            self._executor, archive.install_archive, tmp_path, archive_path,
+            self._archive_compression)
+
+        await self._update_catalog()
+
+    async def _update_catalog(self):
+        self._catalog = await self._async_group.spawn(
+            self._executor, archive.update_catalog, self._path)
+        self._catalog_mtime = await self._async_group.spawn(
+            self._executor, _ext_get_mtime,
+            archive.get_catalog_path(self._path))
+
+    async def _refresh_catalog(self):
+        # catalog can be changed by other processes (e.g. archive merging)
+        mtime = await self._async_group.spawn(
+            self._executor, _ext_get_mtime,
+            archive.get_catalog_path(self._path))
+        if mtime != self._catalog_mtime:
+            await self._update_catalog()
 
-    for i in db_path.parent.glob(db_path.name + '.*'):
-        with contextlib.suppress(ValueError):
-            index = int(i.name.split('.')[-1])
-            if index > last_index:
-                last_index = index
+
+def _set_future_result(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _ext_archive_segment(db_path, compression, segment_path):
+    archive_path = _ext_get_new_archive_path(db_path)
+    return archive.install_archive(segment_path, archive_path, compression)
+
+
+def _ext_get_mtime(path):
+    try:
+        return path.stat().st_mtime_ns
+
+    except FileNotFoundError:
+        return
+
+
+def _ext_get_new_archive_path(db_path):
+    archive_paths = archive.get_archive_paths(db_path)
+    last_index = (archive.get_archive_index(db_path, archive_paths[-1])
+                  if archive_paths else 0)
 
     for i in itertools.count(last_index + 1):
         new_path = db_path.parent / f"{db_path.name}.{i}"
-        if new_path.exists():
+        if any(new_path.with_name(new_path.name + suffix).exists()
+               for suffix in archive.compression_suffixes.values()):
             continue
         return new_path
@@ -2,6 +2,7 @@
 
 from hat.syslog.common import *  # NOQA
 
+import enum
 import typing
 
 from hat.syslog.common import (Facility,
@@ -9,6 +10,18 @@ from hat.syslog.common import (Facility,
                                Severity)
 
 
+class MatchType(enum.Enum):
+    CONTAINS = 0
+    """Value contains filter string"""
+    FULLTEXT = 1
+    """Value contains all words from filter string (word ending with ``*``
+    is matched as word prefix)"""
+    EXACT = 2
+    """Value is equal to filter string"""
+    PREFIX = 3
+    """Value starts with filter string"""
+
+
 class Entry(typing.NamedTuple):
     id: int
     timestamp: float
@@ -27,3 +40,16 @@ class Filter(typing.NamedTuple):
     procid: str | None = None
     msgid: str | None = None
     msg: str | None = None
+    match_type: MatchType = MatchType.CONTAINS
+    """Match type applied to hostname, app_name, procid, msgid and msg"""
+
+
+class Summary(typing.NamedTuple):
+    """Number of removed entries with same severity, hostname and app_name
+    received during single minute"""
+    timestamp: float
+    """Beginning of minute as entry timestamp"""
+    severity: Severity
+    hostname: str | None
+    app_name: str | None
+    count: int
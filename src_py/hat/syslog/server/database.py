@@ -1,8 +1,21 @@
 """Interface to SQLite database"""
 
+from collections.abc import AsyncIterator, Collection
 from pathlib import Path
+import asyncio
+import bisect
+import collections
+import contextlib
+import enum
+import itertools
 import logging
+import math
+import re
 import sqlite3
+import threading
+import time
+import typing
+import unicodedata
 
 from hat import aio
 
@@ -12,31 +25,417 @@ from hat.syslog.server import common
 mlog: logging.Logger = logging.getLogger(__name__)
 """Module logger"""
 
+query_interrupt_steps: int = 10000
+"""Number of SQLite virtual machine instructions between query interruption
+checks"""
+
+query_fetch_size: int = 256
+"""Number of result rows fetched at once"""
+
+slow_query_duration: float = 1
+"""Query duration in seconds above which query is logged as slow query"""
+
+dictionary_cache_size: int = 16 * 1024
+"""Maximum number of cached interned values (least recently used values are
+removed from cache)"""
+
+
+class JournalMode(enum.Enum):
+    DELETE = 'DELETE'
+    TRUNCATE = 'TRUNCATE'
+    PERSIST = 'PERSIST'
+    MEMORY = 'MEMORY'
+    WAL = 'WAL'
+    OFF = 'OFF'
+
+
+class Synchronous(enum.Enum):
+    OFF = 'OFF'
+    NORMAL = 'NORMAL'
+    FULL = 'FULL'
+    EXTRA = 'EXTRA'
+
+
+class TempStore(enum.Enum):
+    DEFAULT = 'DEFAULT'
+    FILE = 'FILE'
+    MEMORY = 'MEMORY'
+
+
+class AutoVacuum(enum.Enum):
+    NONE = 'NONE'
+    FULL = 'FULL'
+    INCREMENTAL = 'INCREMENTAL'
+
+
+class Settings(typing.NamedTuple):
+    """SQLite settings
+
+    Each setting is applied as SQLite pragma with the same name. Settings
+    with ``None`` value are not applied (SQLite defaults are used).
+
+    """
+    page_size: int | None = None
+    """Page size in bytes (applicable only to newly created databases)"""
+    journal_mode: JournalMode | None = None
+    synchronous: Synchronous | None = None
+    cache_size: int | None = None
+    """Positive value is number of pages, negative value is size in KiB"""
+    mmap_size: int | None = None
+    """Maximum number of bytes used for memory-mapped I/O"""
+    temp_store: TempStore | None = None
+    wal_autocheckpoint: int | None = None
+    """WAL size in pages which triggers automatic checkpoint"""
+    auto_vacuum: AutoVacuum | None = None
+    """Auto vacuum mode
+
+    New databases use `AutoVacuum.INCREMENTAL` if auto vacuum mode is not
+    set. Existing databases are migrated to configured auto vacuum mode
+    (which requires rebuilding of whole database file if auto vacuum is
+    enabled or disabled).
+
+    """
+
+
+class MigrationRequiredError(Exception):
+    """Database created by previous version can not be opened read-only"""
+
+
+class QueryTimeoutError(TimeoutError):
+    """Query execution time exceeded query timeout"""
+
+    def __init__(self, entries: list[common.Entry]):
+        super().__init__('query timeout')
+        self.entries = entries
+        """Entries found prior to timeout (partial result)"""
+
+
+class QueryStats(typing.NamedTuple):
+    """Aggregated statistics of queries with the same filter shape"""
+    count: int
+    """Number of queries"""
+    slow_count: int
+    """Number of queries with duration above `slow_query_duration`"""
+    timeout_count: int
+    """Number of interrupted queries (query timeout)"""
+    total_duration: float
+    """Sum of query durations in seconds"""
+    max_duration: float
+    """Maximal query duration in seconds"""
+    total_steps: int
+    """Sum of SQLite virtual machine instructions executed by queries
+
+    Number of instructions is measured in multiples of
+    `query_interrupt_steps` and is proportional to number of examined rows.
+
+    """
+    total_rows: int
+    """Sum of number of resulting entries"""
+    plan: list[str]
+    """Query plan (``EXPLAIN QUERY PLAN`` details) of most recent query"""
+
+
+class QueryStatsCollector:
+    """Query statistics aggregated by filter shape (see `get_filter_shape`)"""
+
+    def __init__(self):
+        self._stats = {}
+
+    def add(self,
+            shape: tuple[str, ...],
+            duration: float,
+            steps: int,
+            rows: int,
+            plan: list[str],
+            timeout: bool):
+        """Add statistics of single query"""
+        stats = self._stats.get(shape)
+        if stats is None:
+            stats = QueryStats(count=0,
+                               slow_count=0,
+                               timeout_count=0,
+                               total_duration=0,
+                               max_duration=0,
+                               total_steps=0,
+                               total_rows=0,
+                               plan=[])
+
+        self._stats[shape] = QueryStats(
+            count=stats.count + 1,
+            slow_count=stats.slow_count + (duration > slow_query_duration),
+            timeout_count=stats.timeout_count + timeout,
+            total_duration=stats.total_duration + duration,
+            max_duration=max(stats.max_duration, duration),
+            total_steps=stats.total_steps + steps,
+            total_rows=stats.total_rows + rows,
+            plan=plan)
+
+    def get(self) -> dict[tuple[str, ...], QueryStats]:
+        """Get statistics associated with filter shapes"""
+        return dict(self._stats)
+
+
+def get_filter_shape(filter: common.Filter) -> tuple[str, ...]:
+    """Get names of filter properties which are set
+
+    Properties `common.Filter.max_results` and `common.Filter.match_type`
+    are not included. Match type is appended to names of string properties
+    (e.g. ``hostname:EXACT``).
+
+    """
+    shape = []
+    for name, value in filter._asdict().items():
+        if name in ('max_results', 'match_type') or value is None:
+            continue
+
+        if name in _str_filter_names:
+            if not value:
+                continue
+
+            name = f'{name}:{filter.match_type.name}'
+
+        shape.append(name)
+
+    return tuple(shape)
+
+
+def match_str_filter(filter_value: str | None,
+                     value: str | None,
+                     match_type: common.MatchType,
+                     fts: bool = False
+                     ) -> bool:
+    """Check if value matches string filter property
+
+    Value is matched with the same rules as used by database query:
+    `common.MatchType.CONTAINS` and `common.MatchType.FULLTEXT` words are
+    matched as SQLite ``LIKE`` substrings (case insensitive only for ASCII
+    characters), while `common.MatchType.FULLTEXT` match of column included
+    in full-text index (`fts` is ``True``) follows tokenization of FTS5
+    ``unicode61`` tokenizer.
+
+    """
+    if not filter_value:
+        return True
+
+    if match_type == common.MatchType.FULLTEXT:
+        words = list(_get_words(filter_value))
+        if not words:
+            return True
+
+        if value is None:
+            return False
+
+        if not fts:
+            return all(_match_like(f'%{word}%', value) for word, _ in words)
+
+        tokens = list(_get_fts_tokens(value))
+        return all(_match_fts_phrase(tokens, list(_get_fts_tokens(word)),
+                                     prefix)
+                   for word, prefix in words)
+
+    if value is None:
+        return False
+
+    if match_type == common.MatchType.CONTAINS:
+        return _match_like(f'%{filter_value}%', value)
+
+    if match_type == common.MatchType.EXACT:
+        return value == filter_value
+
+    if match_type == common.MatchType.PREFIX:
+        return value.startswith(filter_value)
+
+    raise ValueError('unsupported match type')
+
+
+class PageStats(typing.NamedTuple):
+    page_size: int
+    """Page size in bytes"""
+    page_count: int
+    """Total number of pages"""
+    freelist_count: int
+    """Number of unused pages"""
+
 
 async def create_database(path: Path,
-                          disable_journal: bool
+                          disable_journal: bool,
+                          commit_delay: float = 0,
+                          settings: Settings = Settings(),
+                          read_pool_size: int = 0,
+                          fts_columns: Collection[str] = (),
+                          indexes: Collection[str] = (),
+                          query_stats: QueryStatsCollector | None = None,
+                          read_only: bool = False
                           ) -> 'Database':
-    """Create database"""
+    """Create database
+
+    If `disable_journal` is set, journal mode from `settings` is overridden
+    with `JournalMode.OFF`.
+
+    If `commit_delay` is greater than ``0``, group commit is enabled:
+    messages added to database are inserted into transaction which is kept
+    open for up to `commit_delay` seconds, so that multiple `add_msgs` calls
+    are committed together. `Database.wait_committed` can be used for
+    waiting until added messages are committed.
+
+    In WAL journal mode (configured with `settings` or retained by existing
+    database file), if `read_pool_size` is greater than ``0``, queries
+    are executed on pool of `read_pool_size` read-only connections, each
+    running in its own thread. This way, queries do not block message
+    insertion (and vice versa). Queries executed on read-only connections
+    see only committed messages.
 
-    async def close():
-        await executor(_ext_close, conn)
-        mlog.debug('database %s closed', path)
+    If `fts_columns` is not empty, FTS5 full-text index of provided columns
+    (any of `fts_column_names`) is maintained. This index is used for
+    queries with `common.MatchType.FULLTEXT` match type. Full-text index is
+    created (or recreated if indexed columns are changed) during database
+    opening.
+
+    For each column in `indexes` (any of `index_column_names`), secondary
+    index ``(<column>, rowid)`` is maintained. Secondary indexes which are
+    not configured are removed during database opening.
+
+    Free pages, left after entries are deleted, are returned to file
+    system with `Database.incremental_vacuum` (database has to use
+    `AutoVacuum.INCREMENTAL` auto vacuum mode).
+
+    Values of `dictionary_column_names` columns are interned - each distinct
+    value is stored once in lookup table and entries reference it by integer
+    id. Mapping between values and ids is cached in memory (up to
+    `dictionary_cache_size` values). Values which are no longer referenced
+    by any entry or summary are deleted with
+    `Database.delete_unused_values`. Databases created by previous
+    versions, which store these values in place, are migrated during
+    database opening.
+
+    Minimal and maximal entry timestamp of each block of consecutive entry
+    ids is stored in sparse timestamp index (loaded into memory during
+    database opening). Entry timestamp filters are translated into entry id
+    ranges with this index, so that queries limited by entry timestamps
+    are executed as range scans of entry ids. Entry timestamps are not
+    required to increase with entry ids (e.g. system clock can be set back)
+    - in that case, resulting entry id range is wider than required.
+
+    Duration, number of executed SQLite instructions, number of resulting
+    entries and query plan of each query are added to `query_stats`
+    (new collector is created if `query_stats` is not provided). Queries
+    with duration above `slow_query_duration` are logged.
+
+    If `read_only` is set, existing database is opened read-only as immutable
+    file (database must not be modified while it is opened) - database
+    structure is not changed and full-text and secondary indexes which
+    already exist are used (`fts_columns` and `indexes` are ignored). Read
+    pool is not used and databases which require migration (see
+    `is_migration_required`) can not be opened
+    read-only.
+
+    Raises:
+        MigrationRequiredError
+
+    """
+    fts_columns = [i for i in fts_column_names if i in fts_columns]
+    indexes = [i for i in index_column_names if i in indexes]
 
     executor = aio.create_executor(1)
-    conn = await executor(_ext_connect, path, disable_journal)
+    time_index = _TimeIndex()
+
+    if read_only:
+        conn, fts_columns, indexes = await executor(
+            _ext_connect_read_only, path, settings, time_index)
+
+    else:
+        conn = await executor(_ext_connect, path, disable_journal, settings,
+                              fts_columns, indexes, time_index)
+
     async_group = aio.Group()
-    async_group.spawn(aio.call_on_cancel, close)
+
+    readers = []
+    try:
+        # journal mode can be set by previous usage of database file
+        is_wal = (read_pool_size > 0 and not read_only and
+                  await executor(_ext_get_journal_mode, conn) ==
+                  JournalMode.WAL)
+
+    except BaseException:
+        await aio.uncancellable(executor(_ext_close, conn))
+        raise
+
+    if is_wal:
+        try:
+            for _ in range(read_pool_size):
+                reader_executor = aio.create_executor(1)
+                reader_conn = await reader_executor(_ext_connect_reader,
+                                                    path, settings)
+                readers.append((reader_executor, reader_conn))
+
+        except BaseException:
+            for reader_executor, reader_conn in readers:
+                await aio.uncancellable(
+                    reader_executor(_ext_close, reader_conn))
+            await aio.uncancellable(executor(_ext_close, conn))
+            raise
 
     db = Database()
     db._path = path
+    db._disable_journal = disable_journal
     db._conn = conn
     db._async_group = async_group
     db._executor = executor
+    db._commit_delay = commit_delay
+    db._commit_future = None
+    db._commit_futures = set()
+    db._last_commit_future = None
+    db._fts_columns = fts_columns
+    db._indexes = indexes
+    db._readers = readers
+    db._idle_readers = aio.Queue()
+    db._dictionary = _Dictionary()
+    db._unused_values = _UnusedValues(
+        [i for i in dictionary_column_names if i in indexes])
+    db._time_index = time_index
+    db._query_stats = (query_stats if query_stats is not None
+                       else QueryStatsCollector())
+
+    for reader in readers:
+        db._idle_readers.put_nowait(reader)
+
+    async_group.spawn(aio.call_on_cancel, db._close)
 
     mlog.debug('opened database %s', path)
     return db
 
 
+def is_migration_required(path: Path) -> bool:
+    """Check if existing database, created by previous version, requires
+    migration
+
+    Database is opened read-only as immutable file. This function is
+    blocking - it should be called in executor.
+
+    """
+    conn = sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True)
+    try:
+        return _ext_is_migration_required(conn)
+
+    finally:
+        conn.close()
+
+
+def get_indexes(path: Path) -> tuple[list[str], list[str]]:
+    """Get full-text index columns and secondary index columns of existing
+    database
+
+    This function is blocking - it should be called in executor.
+
+    """
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return _ext_get_indexes(conn)
+
+    finally:
+        conn.close()
+
+
 class Database(aio.Resource):
 
     @property
@@ -44,6 +443,30 @@ class Database(aio.Resource):
         """Async group"""
         return self._async_group
 
+    async def wait_committed(self):
+        """Wait until all previously added messages are committed
+
+        Raises:
+            ConnectionError
+
+        """
+        future = self._last_commit_future
+        if future is None:
+            return
+
+        if not await asyncio.shield(future):
+            raise ConnectionError()
+
+    @property
+    def query_stats(self) -> QueryStatsCollector:
+        """Query statistics"""
+        return self._query_stats
+
+    @property
+    def fts_columns(self) -> list[str]:
+        """Names of columns included in full-text index"""
+        return self._fts_columns
+
     async def get_first_id(self) -> int | None:
         """Get first entry id"""
         return await self._async_group.spawn(self._executor, _ext_fist_id,
@@ -54,6 +477,36 @@ class Database(aio.Resource):
         return await self._async_group.spawn(self._executor, _ext_last_id,
                                              self._conn)
 
+    async def get_last_id_before(self, timestamp: float) -> int | None:
+        """Get id of latest entry with entry timestamp prior to `timestamp`
+
+        Entry is found with single lookup of entry timestamp index.
+
+        """
+        return await self._async_group.spawn(
+            self._executor, _ext_last_id_before, self._conn, timestamp)
+
+    async def get_timestamp_range(self) -> tuple[float, float] | None:
+        """Get minimal and maximal entry timestamp (``None`` if database is
+        empty)
+
+        Both timestamps are found with single lookup of entry timestamp
+        index.
+
+        """
+        return await self._async_group.spawn(
+            self._executor, _ext_timestamp_range, self._conn)
+
+    async def get_size(self) -> int:
+        """Get size of database pages in use (excluding free pages)"""
+        return await self._async_group.spawn(self._executor, _ext_size,
+                                             self._conn)
+
+    async def get_page_stats(self) -> PageStats:
+        """Get database page statistics"""
+        return await self._async_group.spawn(self._executor,
+                                             _ext_page_stats, self._conn)
+
     async def add_msgs(self,
                        msgs: list[tuple[float, common.Msg]]
                        ) -> list[common.Entry]:
@@ -65,8 +518,10 @@ class Database(aio.Resource):
                    msg.version, msg.timestamp, msg.hostname, msg.app_name,
                    msg.procid, msg.msgid, msg.data, msg.msg)
                   for entry_timestamp, msg in msgs]
+        commit = self._get_commit_future() is None
         entry_ids = await self._async_group.spawn(
-            self._executor, _ext_insert, self._conn, columns, values)
+            self._executor, _ext_insert, self._conn, self._dictionary,
+            self._time_index, columns, values, commit)
 
         entries = [
             common.Entry(id=entry_id,
@@ -89,15 +544,293 @@ class Database(aio.Resource):
                    entry.msg.procid, entry.msg.msgid, entry.msg.data,
                    entry.msg.msg)
                   for entry in entries]
+        commit = self._get_commit_future() is None
         entry_ids = await self._async_group.spawn(
-            self._executor, _ext_insert, self._conn, columns, values)
+            self._executor, _ext_insert, self._conn, self._dictionary,
+            self._time_index, columns, values, commit)
         mlog.debug("entries added to database (entry count: %s)",
                    len(entry_ids))
 
+    async def delete_severity(self,
+                              severity: common.Severity,
+                              start_id: int,
+                              end_id: int,
+                              summarize: bool = False
+                              ) -> int:
+        """Delete entries with `severity` and ids in range [start_id, end_id)
+
+        If `summarize` is set, number of deleted entries is added to
+        summaries (see `query_summaries`). Number of deleted entries is
+        returned.
+
+        """
+        entry_count = await self._async_group.spawn(
+            self._executor, _ext_delete_severity, self._conn,
+            self._unused_values, severity.value, start_id, end_id, summarize,
+            self._commit_future is None)
+        mlog.debug("deleted %s entries with severity %s",
+                   entry_count, severity.name)
+        return entry_count
+
+    async def query_summaries(self,
+                              entry_timestamp_from: float | None = None,
+                              entry_timestamp_to: float | None = None
+                              ) -> list[common.Summary]:
+        """Query summaries of deleted entries ordered by timestamp"""
+        return await self._async_group.spawn(
+            self._read, _ext_query_summaries, self._dictionary,
+            entry_timestamp_from, entry_timestamp_to)
+
     async def query(self,
-                    filter: common.Filter
+                    filter: common.Filter,
+                    timeout: float | None = None
                     ) -> list[common.Entry]:
-        """Query entries that satisfy filter"""
+        """Query entries that satisfy filter
+
+        If query is cancelled, or if query execution exceeds `timeout`
+        seconds, query execution on connection thread is interrupted. In
+        case of timeout, `QueryTimeoutError` containing entries found prior
+        to interruption is raised.
+
+        Raises:
+            QueryTimeoutError
+
+        """
+        index, conditions, args = self._get_query(filter)
+        interrupt = _QueryInterrupt(timeout)
+        start = time.monotonic()
+
+        try:
+            entries, plan, interrupted = await self._async_group.spawn(
+                self._read, _ext_query, self._dictionary, index, conditions,
+                args, filter.max_results, interrupt)
+
+        except asyncio.CancelledError:
+            interrupt.cancel()
+            raise
+
+        if interrupted and not interrupt.is_timeout:
+            raise asyncio.CancelledError()
+
+        duration = time.monotonic() - start
+        self._query_stats.add(shape=get_filter_shape(filter),
+                              duration=duration,
+                              steps=interrupt.steps,
+                              rows=len(entries),
+                              plan=plan,
+                              timeout=interrupted)
+
+        if duration > slow_query_duration:
+            mlog.warning("slow query (duration: %.3fs, steps: %s, "
+                         "entries: %s, plan: %s, filter: %s)",
+                         duration, interrupt.steps, len(entries),
+                         '; '.join(plan), filter)
+
+        if interrupted:
+            raise QueryTimeoutError(entries)
+
+        mlog.debug("query resulted with %s entries", len(entries))
+        return entries
+
+    async def iter_query(self,
+                         filter: common.Filter,
+                         chunk_size: int = 1024
+                         ) -> AsyncIterator[common.Entry]:
+        """Iterate over entries that satisfy filter
+
+        Entries are fetched in chunks of up to `chunk_size` entries. Each
+        chunk is fetched with separate query which continues with entries
+        prior to last entry of previous chunk (keyset pagination on entry
+        id), so memory usage does not depend on number of resulting entries.
+        Entries added during iteration are not included in result.
+
+        """
+        chunk_size = max(chunk_size, 1)
+        remaining = filter.max_results
+        last_id = filter.last_id
+
+        while remaining is None or remaining > 0:
+            max_results = (chunk_size if remaining is None
+                           else min(chunk_size, remaining))
+            entries = await self.query(
+                filter._replace(last_id=last_id, max_results=max_results))
+
+            for entry in entries:
+                yield entry
+
+            if len(entries) < max_results:
+                break
+
+            last_id = entries[-1].id - 1
+            if remaining is not None:
+                remaining -= len(entries)
+
+    async def explain_query(self,
+                            filter: common.Filter
+                            ) -> list[str]:
+        """Get query plan used for query entries that satisfy filter
+
+        Result contains details of each ``EXPLAIN QUERY PLAN`` result row.
+
+        """
+        index, conditions, args = self._get_query(filter)
+
+        return await self._async_group.spawn(
+            self._read, _ext_explain_query, index, conditions, args,
+            filter.max_results)
+
+    async def archive(self,
+                      path: Path,
+                      last_id: int | None,
+                      chunk_size: int = 1024 * 16):
+        """Copy entries up to last_id (including) into new archive database
+
+        Archive database is created with same structure as this database.
+        Entries are copied by SQLite itself (archive database is attached to
+        this database's connection) in chunks of up to `chunk_size` entries,
+        so memory usage does not depend on number of archived entries and
+        messages can be added in between chunks.
+
+        """
+        archive = await create_database(path, self._disable_journal)
+        await archive.async_close()
+
+        first_id = await self.get_first_id()
+        if last_id is None:
+            last_id = await self.get_last_id()
+
+        if first_id is None or last_id is None or last_id < first_id:
+            return
+
+        await self._async_group.spawn(self._execute_committed,
+                                      _ext_attach_archive, path,
+                                      self._disable_journal)
+
+        try:
+            entry_count = 0
+            for start_id in range(first_id, last_id + 1, chunk_size):
+                end_id = min(start_id + chunk_size, last_id + 1)
+                entry_count += await self._async_group.spawn(
+                    self._executor, _ext_archive, self._conn, start_id,
+                    end_id, self._commit_future is None)
+
+        finally:
+            await aio.uncancellable(
+                self._execute_committed(_ext_detach_archive))
+
+        mlog.debug("archived %s entries to %s", entry_count, path)
+
+    async def merge(self,
+                    path: Path,
+                    chunk_size: int = 1024 * 16
+                    ) -> int:
+        """Copy all entries and summaries from archive database `path`
+
+        Archive database is attached to this database's connection and
+        entries are copied by SQLite itself in chunks of up to `chunk_size`
+        entries. Interned values are mapped to ids used by this database.
+        Entry ids are preserved - archive database can not contain entries
+        with ids already used by this database. Number of copied entries is
+        returned.
+
+        """
+        first_id, last_id = await self._async_group.spawn(
+            self._execute_committed, _ext_attach_merge, path)
+
+        try:
+            entry_count = 0
+            if first_id is not None:
+                for start_id in range(first_id, last_id + 1, chunk_size):
+                    end_id = min(start_id + chunk_size, last_id + 1)
+                    entry_count += await self._async_group.spawn(
+                        self._executor, _ext_merge, self._conn,
+                        self._time_index, start_id, end_id,
+                        self._commit_future is None)
+
+            await self._async_group.spawn(
+                self._executor, _ext_merge_summaries, self._conn,
+                self._commit_future is None)
+
+        finally:
+            await aio.uncancellable(
+                self._execute_committed(_ext_detach_merge))
+
+        mlog.debug("merged %s entries from %s", entry_count, path)
+        return entry_count
+
+    async def vacuum(self):
+        """Rebuild database file, repacking it into minimal amount of space"""
+        await self._async_group.spawn(self._execute_committed, _ext_vacuum)
+
+    async def incremental_vacuum(self, max_pages: int) -> int:
+        """Return up to `max_pages` free pages to file system
+
+        Free pages are moved to the end of database file which is truncated
+        afterwards. Single call modifies only small part of database file,
+        so messages can be added in between calls. Free pages are returned
+        only if database uses `AutoVacuum.INCREMENTAL` auto vacuum mode.
+        Number of returned pages is returned.
+
+        """
+        page_count = await self._async_group.spawn(
+            self._executor, _ext_incremental_vacuum, self._conn, max_pages,
+            self._commit_future is None)
+        mlog.debug("incremental vacuum returned %s pages", page_count)
+        return page_count
+
+    async def delete(self, first_id: int):
+        """Delete entries prior to first_id"""
+        entry_count = await self._async_group.spawn(
+            self._executor, _ext_delete, self._conn, self._time_index,
+            self._unused_values, first_id, self._commit_future is None)
+        mlog.debug("deleted %s entries", entry_count)
+
+    async def delete_unused_values(self, chunk_size: int = 16 * 1024
+                                   ) -> int:
+        """Delete interned values not referenced by any entry or summary
+
+        Values of columns with secondary index, which were referenced by
+        entries deleted with `delete` or `delete_severity`, are checked with
+        index lookups. Values of all columns are checked by scanning all
+        entries - scan is executed only once number of entries deleted
+        since previous scan reaches number of remaining entries. Entries are
+        scanned in chunks of up to `chunk_size` entries, so messages can be
+        added in between chunks. Number of deleted values is returned.
+
+        """
+        start_id = await self.get_first_id()
+        end_id = await self.get_last_id()
+        end_id = end_id + 1 if end_id is not None else 0
+        entry_count = end_id - start_id if start_id is not None else 0
+
+        deleted_count = self._unused_values.deleted_count
+        if not deleted_count or deleted_count < entry_count:
+            value_count = await self._async_group.spawn(
+                self._executor, _ext_delete_unused_candidates, self._conn,
+                self._dictionary, self._unused_values,
+                self._commit_future is None)
+            mlog.debug("deleted %s unused values", value_count)
+            return value_count
+
+        self._unused_values.deleted_count = 0
+        used = {name: set() for name in dictionary_column_names}
+
+        while start_id is not None and start_id < end_id:
+            chunk_end_id = min(start_id + chunk_size, end_id)
+            await self._async_group.spawn(
+                self._executor, _ext_get_used_values, self._conn, used,
+                start_id, chunk_end_id)
+            start_id = chunk_end_id
+
+        # entries added during scan are checked together with deletion
+        value_count = await self._async_group.spawn(
+            self._executor, _ext_delete_unused_values, self._conn,
+            self._dictionary, self._unused_values, used, end_id,
+            self._commit_future is None)
+        mlog.debug("deleted %s unused values", value_count)
+        return value_count
+
+    def _get_query(self, filter):
         conditions = []
         args = {}
         if filter.last_id is not None:
@@ -109,140 +842,1499 @@ class Database(aio.Resource):
         if filter.entry_timestamp_to is not None:
             conditions.append('entry_timestamp <= :entry_timestamp_to')
             args['entry_timestamp_to'] = filter.entry_timestamp_to
+
+        first_id, last_id = self._time_index.get_id_range(
+            filter.entry_timestamp_from, filter.entry_timestamp_to)
+        if first_id is not None:
+            conditions.append('rowid >= :timestamp_first_id')
+            args['timestamp_first_id'] = first_id
+        if last_id is not None:
+            conditions.append('rowid <= :timestamp_last_id')
+            args['timestamp_last_id'] = last_id
+
         if filter.facility:
             conditions.append('facility = :facility')
             args['facility'] = filter.facility.value
         if filter.severity:
             conditions.append('severity = :severity')
             args['severity'] = filter.severity.value
-        if filter.hostname:
-            conditions.append('hostname LIKE :hostname')
-            args['hostname'] = f'%{filter.hostname}%'
-        if filter.app_name:
-            conditions.append('app_name LIKE :app_name')
-            args['app_name'] = f'%{filter.app_name}%'
-        if filter.procid:
-            conditions.append('procid LIKE :procid')
-            args['procid'] = f'%{filter.procid}%'
-        if filter.msgid:
-            conditions.append('msgid LIKE :msgid')
-            args['msgid'] = f'%{filter.msgid}%'
-        if filter.msg:
-            conditions.append('msg LIKE :msg')
-            args['msg'] = f'%{filter.msg}%'
-
-        result = await self._async_group.spawn(
-            self._executor, _ext_query, self._conn, conditions, args,
-            filter.max_results)
 
-        entries = [common.Entry(
-                    id=row['rowid'],
-                    timestamp=row['entry_timestamp'],
-                    msg=common.Msg(facility=common.Facility(row['facility']),
-                                   severity=common.Severity(row['severity']),
-                                   version=row['version'],
-                                   timestamp=row['msg_timestamp'],
-                                   hostname=row['hostname'],
-                                   app_name=row['app_name'],
-                                   procid=row['procid'],
-                                   msgid=row['msgid'],
-                                   data=row['data'],
-                                   msg=row['msg']))
-                   for row in result]
+        fts_queries = []
+        for name in _str_filter_names:
+            value = getattr(filter, name)
+            if not value:
+                continue
 
-        mlog.debug("query resulted with %s entries", len(entries))
-        return entries
+            if (filter.match_type == common.MatchType.FULLTEXT and
+                    name in self._fts_columns):
+                fts_query = _get_fts_query(name, value)
+                if fts_query:
+                    fts_queries.append(fts_query)
+                continue
 
-    async def delete(self, first_id: int):
-        """Delete entries prior to first_id"""
-        entry_count = await self._async_group.spawn(
-            self._executor, _ext_delete, self._conn, first_id)
-        mlog.debug("deleted %s entries", entry_count)
+            # interned values are matched in lookup table
+            column = 'value' if name in dictionary_column_names else name
+            value_conditions = []
+
+            if filter.match_type == common.MatchType.CONTAINS:
+                value_conditions.append(f'{column} LIKE :{name}')
+                args[name] = f'%{value}%'
+
+            elif filter.match_type == common.MatchType.EXACT:
+                value_conditions.append(f'{column} = :{name}')
+                args[name] = value
+
+            elif filter.match_type == common.MatchType.PREFIX:
+                value_conditions.append(f'{column} >= :{name}')
+                args[name] = value
+
+                upper_bound = _get_prefix_upper_bound(value)
+                if upper_bound is not None:
+                    value_conditions.append(
+                        f'{column} < :{name}_upper_bound')
+                    args[f'{name}_upper_bound'] = upper_bound
 
+            else:
+                # fallback to substring match of each word
+                for i, (word, _) in enumerate(_get_words(value)):
+                    value_conditions.append(f'{column} LIKE :{name}_{i}')
+                    args[f'{name}_{i}'] = f'%{word}%'
+
+            if not value_conditions:
+                continue
+
+            if name not in dictionary_column_names:
+                conditions.extend(value_conditions)
+
+            elif filter.match_type == common.MatchType.EXACT:
+                conditions.append(f"{name}_id = "
+                                  f"(SELECT id FROM log_{name} "
+                                  f"WHERE {value_conditions[0]})")
+
+            else:
+                conditions.append(f"{name}_id IN "
+                                  f"(SELECT id FROM log_{name} "
+                                  f"WHERE {' AND '.join(value_conditions)})")
+
+        if fts_queries:
+            conditions.append('rowid IN (SELECT rowid FROM log_fts '
+                              'WHERE log_fts MATCH :fts_query)')
+            args['fts_query'] = ' AND '.join(fts_queries)
+
+        index = (None if fts_queries else
+                 _get_query_index(filter, self._indexes))
+
+        # without secondary index, entry timestamp index is not used in
+        # favor of entry id range scan
+        if index is None and (first_id is not None or last_id is not None):
+            index = 'rowid'
+
+        return index, conditions, args
+
+    def _get_commit_future(self):
+        if self._commit_delay <= 0:
+            return
+
+        if self._commit_future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._commit_future = future
+            self._commit_futures.add(future)
+            self._last_commit_future = future
+            self._async_group.spawn(self._commit_loop, future)
+
+        return self._commit_future
+
+    async def _commit_loop(self, future):
+        try:
+            await asyncio.sleep(self._commit_delay)
+
+            # group transaction already committed by _execute_committed
+            if self._commit_future is not future:
+                return
+
+            self._commit_future = None
+            await self._executor(_ext_commit, self._conn)
+
+            self._commit_futures.discard(future)
+            future.set_result(True)
+            mlog.debug("group transaction committed")
+
+        except Exception as e:
+            mlog.error("commit error: %s", e, exc_info=e)
+            self.close()
+
+    async def _execute_committed(self, fn, *args):
+        # group transaction is committed (resolving its commit future) and
+        # fn, which requires no open transaction, is executed afterwards -
+        # both are executed with single executor call so that new group
+        # transaction can not be started in between
+        future = self._commit_future
+        self._commit_future = None
+
+        try:
+            result, exception = await self._executor(
+                _ext_execute_committed, self._conn, fn, *args)
+
+        except Exception as e:
+            mlog.error("commit error: %s", e, exc_info=e)
+            self.close()
+            raise
+
+        if future:
+            self._commit_futures.discard(future)
+            future.set_result(True)
+            mlog.debug("group transaction committed")
+
+        if exception:
+            raise exception
+
+        return result
+
+    async def _read(self, fn, *args):
+        if not self._readers:
+            return await self._executor(fn, self._conn, *args)
+
+        executor, conn = await self._idle_readers.get()
+        try:
+            return await executor(fn, conn, *args)
+
+        finally:
+            self._idle_readers.put_nowait((executor, conn))
+
+    async def _close(self):
+        self._commit_future = None
+
+        for executor, conn in self._readers:
+            with contextlib.suppress(Exception):
+                await executor(_ext_close, conn)
+
+        try:
+            await self._executor(_ext_close, self._conn)
+            committed = True
+
+        except Exception as e:
+            mlog.error("close error: %s", e, exc_info=e)
+            committed = False
+
+        for future in self._commit_futures:
+            if not future.done():
+                future.set_result(committed)
+        self._commit_futures.clear()
+
+        mlog.debug('database %s closed', self._path)
+
+
+fts_column_names: list[str] = ['msg', 'app_name', 'hostname', 'data']
+"""Names of columns which can be included in full-text index"""
+
+index_column_names: list[str] = ['facility', 'severity', 'hostname',
+                                 'app_name', 'procid', 'msgid']
+"""Names of columns which can have secondary index"""
+
+dictionary_column_names: list[str] = ['hostname', 'app_name', 'procid',
+                                      'msgid']
+"""Names of columns with interned values"""
+
+_index_priority = ['procid', 'hostname', 'app_name', 'msgid', 'facility',
+                   'severity']
+
+_str_filter_names = ['hostname', 'app_name', 'procid', 'msgid', 'msg']
+
+_fts_token_categories = {'Lu', 'Ll', 'Lt', 'Lm', 'Lo', 'Nd', 'Nl', 'No', 'Co'}
+
+_connection_settings = ['cache_size', 'mmap_size', 'temp_store']
+
+_max_query_args = 999
 
 _db_columns = [['entry_timestamp', 'REAL'],
                ['facility', 'INTEGER'],
                ['severity', 'INTEGER'],
                ['version', 'INTEGER'],
                ['msg_timestamp', 'REAL'],
-               ['hostname', 'TEXT'],
-               ['app_name', 'TEXT'],
-               ['procid', 'TEXT'],
-               ['msgid', 'TEXT'],
+               ['hostname_id', 'INTEGER'],
+               ['app_name_id', 'INTEGER'],
+               ['procid_id', 'INTEGER'],
+               ['msgid_id', 'INTEGER'],
                ['data', 'TEXT'],
                ['msg', 'TEXT']]
 
+_time_block_size = 1024
+"""Number of consecutive entry ids in single sparse timestamp index block"""
+
 _db_query_columns = ['rowid'] + [name for name, _ in _db_columns]
 
-_db_structure = f"""
-    CREATE TABLE IF NOT EXISTS log (
-        {', '.join(col_name + ' ' + col_type
-                   for col_name, col_type in _db_columns)}
-    );
+_db_query_dictionary_columns = [
+    (name.removesuffix('_id')
+     if name.removesuffix('_id') in dictionary_column_names else None)
+    for name in _db_query_columns]
+"""Name of interned column for each query result column (or ``None``)"""
+
+_db_columns_sql = ', '.join(col_name + ' ' + col_type
+                            for col_name, col_type in _db_columns)
+
+_db_timestamp_index_sql = """
     CREATE INDEX IF NOT EXISTS log_entry_timestamp_index ON log (
         entry_timestamp DESC)
     """
 
+_db_structure = f"""
+    CREATE TABLE IF NOT EXISTS log ({_db_columns_sql});
+    {_db_timestamp_index_sql};
+    CREATE TABLE IF NOT EXISTS log_time_block (
+        block INTEGER PRIMARY KEY,
+        min_timestamp REAL,
+        max_timestamp REAL);
+    CREATE TABLE IF NOT EXISTS log_summary (
+        minute INTEGER,
+        severity INTEGER,
+        hostname_id INTEGER,
+        app_name_id INTEGER,
+        count INTEGER,
+        PRIMARY KEY (minute, severity, hostname_id, app_name_id));
+    """ + ''.join(f"""
+    CREATE TABLE IF NOT EXISTS log_{name} (
+        id INTEGER PRIMARY KEY,
+        value TEXT NOT NULL UNIQUE);
+    """ for name in dictionary_column_names)
 
-def _ext_connect(path, disable_journal):
-    path.parent.mkdir(exist_ok=True, parents=True)
-    conn = sqlite3.connect(f'file:{path}?nolock=1',
-                           uri=True,
-                           isolation_level=None,
-                           detect_types=sqlite3.PARSE_DECLTYPES)
-    try:
-        conn.executescript(
-            ('PRAGMA journal_mode = OFF;\n' if disable_journal else '') +
-            _db_structure)
-    except Exception:
-        conn.close()
-        raise
-    return conn
 
+class _Dictionary:
+    """Cache of interned values
 
-def _ext_close(conn):
-    conn.close()
+    Ids are resolved on writer connection thread, while values can be
+    resolved on any connection thread. Id assigned to value never changes
+    once it is committed. Each mapping contains up to
+    `dictionary_cache_size` least recently used items.
 
+    """
 
-def _ext_fist_id(conn):
-    c = conn.execute("SELECT MIN(rowid) FROM log")
-    result = c.fetchall()
-    return result[0][0] if result else None
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = collections.OrderedDict()
+        self._values = collections.OrderedDict()
 
+    def get_id(self, column: str, value: str) -> int | None:
+        with self._lock:
+            dictionary_id = self._ids.get((column, value))
+            if dictionary_id is not None:
+                self._ids.move_to_end((column, value))
+            return dictionary_id
 
-def _ext_last_id(conn):
-    c = conn.execute("SELECT MAX(rowid) FROM log")
-    result = c.fetchall()
-    return result[0][0] if result else None
+    def set_id(self, column: str, value: str, dictionary_id: int):
+        with self._lock:
+            self._ids[(column, value)] = dictionary_id
+            _limit_size(self._ids)
 
+    def get_values(self,
+                   keys: Collection[tuple[str, int]]
+                   ) -> dict[tuple[str, int], str]:
+        """Get cached values of (column name, id) keys"""
+        with self._lock:
+            values = {}
+            for key in keys:
+                value = self._values.get(key)
+                if value is None:
+                    continue
 
-def _ext_delete(conn, first_id):
+                self._values.move_to_end(key)
+                values[key] = value
+
+            return values
+
+    def set_values(self, values: dict[tuple[str, int], str]):
+        with self._lock:
+            self._values.update(values)
+            _limit_size(self._values)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._values.clear()
+
+
+def _limit_size(cache):
+    while len(cache) > dictionary_cache_size:
+        cache.popitem(last=False)
+
+
+class _UnusedValues:
+    """Candidates for unused interned values
+
+    Ids of indexed columns' values referenced by deleted entries are
+    collected as candidates, together with number of deleted entries.
+    Accessed only on writer connection thread.
+
+    """
+
+    def __init__(self, columns: list[str]):
+        self.candidates = {column: set() for column in columns}
+        """column name -> candidate ids"""
+        self.deleted_count = 0
+        """Number of deleted entries since previous full scan"""
+
+    def add(self, rows: typing.Iterable[tuple[int | None, ...]]):
+        """Add ids of deleted entries' values (ordered as candidates)"""
+        for row in rows:
+            self.deleted_count += 1
+            for ids, dictionary_id in zip(self.candidates.values(), row):
+                if dictionary_id is not None:
+                    ids.add(dictionary_id)
+
+    def clear(self):
+        for ids in self.candidates.values():
+            ids.clear()
+
+
+class _QueryInterrupt:
+    """Query interruption condition
+
+    Instance is called, as SQLite progress handler, on connection thread
+    executing query - nonzero result interrupts query execution.
+
+    """
+
+    def __init__(self, timeout: float | None):
+        self._cancelled = False
+        self._steps = 0
+        self._deadline = (time.monotonic() + timeout if timeout is not None
+                          else None)
+
+    @property
+    def is_timeout(self) -> bool:
+        return (self._deadline is not None and
+                time.monotonic() >= self._deadline)
+
+    @property
+    def is_interrupted(self) -> bool:
+        return self._cancelled or self.is_timeout
+
+    @property
+    def steps(self) -> int:
+        """Approximate number of executed SQLite instructions"""
+        return self._steps
+
+    def cancel(self):
+        self._cancelled = True
+
+    def __call__(self) -> int:
+        self._steps += query_interrupt_steps
+        return int(self.is_interrupted)
+
+
+class _TimeIndex:
+    """Sparse entry timestamp index
+
+    For each block of entry ids, minimal and maximal entry timestamp is
+    kept. Entry id range is found by binary search of running maximum of
+    blocks' maximal timestamps (non-decreasing from first block) and
+    running minimum of blocks' minimal timestamps (non-decreasing towards
+    first block) - blocks prior to resulting range contain only entries
+    with timestamps prior to lower timestamp bound and blocks following
+    resulting range contain only entries with timestamps following upper
+    timestamp bound. Timestamp ranges of blocks can only be extended, so
+    that index remains valid even if changes are not committed.
+
+    Index is updated on writer connection thread, while entry id ranges
+    can be calculated on any thread.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocks = []
+        self._min_timestamps = []
+        self._max_timestamps = []
+        self._prefix_max_timestamps = []
+        self._suffix_min_timestamps = []
+
+    def update(self, rows: typing.Iterable[tuple[int, float, float]]):
+        """Extend timestamp ranges of blocks"""
+        with self._lock:
+            start = len(self._blocks)
+
+            for block, min_timestamp, max_timestamp in rows:
+                i = bisect.bisect_left(self._blocks, block)
+                start = min(start, i)
+
+                if i < len(self._blocks) and self._blocks[i] == block:
+                    self._min_timestamps[i] = min(self._min_timestamps[i],
+                                                  min_timestamp)
+                    self._max_timestamps[i] = max(self._max_timestamps[i],
+                                                  max_timestamp)
+                    continue
+
+                self._blocks.insert(i, block)
+                self._min_timestamps.insert(i, min_timestamp)
+                self._max_timestamps.insert(i, max_timestamp)
+                self._prefix_max_timestamps.insert(i, max_timestamp)
+                self._suffix_min_timestamps.insert(i, min_timestamp)
+
+            self._update_bounds(start)
+
+    def remove(self, first_id: int | None):
+        """Remove blocks containing only entry ids prior to `first_id`"""
+        with self._lock:
+            i = (bisect.bisect_left(self._blocks, first_id // _time_block_size)
+                 if first_id is not None else len(self._blocks))
+            if not i:
+                return
+
+            for values in [self._blocks,
+                           self._min_timestamps,
+                           self._max_timestamps,
+                           self._prefix_max_timestamps,
+                           self._suffix_min_timestamps]:
+                del values[:i]
+
+            self._update_bounds(0)
+
+    def get_id_range(self,
+                     timestamp_from: float | None,
+                     timestamp_to: float | None
+                     ) -> tuple[int | None, int | None]:
+        """Get range of entry ids (including bounds) containing all entries
+        with entry timestamps in range [timestamp_from, timestamp_to]"""
+        with self._lock:
+            if not self._blocks:
+                return None, None
+
+            first_id = None
+            if timestamp_from is not None:
+                i = bisect.bisect_left(self._prefix_max_timestamps,
+                                       timestamp_from)
+                block = (self._blocks[i] if i < len(self._blocks)
+                         else self._blocks[-1] + 1)
+                first_id = block * _time_block_size
+
+            last_id = None
+            if timestamp_to is not None:
+                i = bisect.bisect_right(self._suffix_min_timestamps,
+                                        timestamp_to)
+                block = self._blocks[i - 1] + 1 if i else self._blocks[0]
+                last_id = block * _time_block_size - 1
+
+            return first_id, last_id
+
+    def _update_bounds(self, start):
+        count = len(self._blocks)
+
+        for i in range(start, count):
+            self._prefix_max_timestamps[i] = max(
+                self._max_timestamps[i],
+                self._prefix_max_timestamps[i - 1] if i else -math.inf)
+
+        for i in reversed(range(count)):
+            value = min(self._min_timestamps[i],
+                        (self._suffix_min_timestamps[i + 1]
+                         if i + 1 < count else math.inf))
+            if i < start and value == self._suffix_min_timestamps[i]:
+                break
+
+            self._suffix_min_timestamps[i] = value
+
+
+def _ext_connect(path, disable_journal, settings, fts_columns, indexes,
+                 time_index):
+    if disable_journal:
+        settings = settings._replace(journal_mode=JournalMode.OFF)
+
+    # WAL requires shared memory locking
+    if settings.journal_mode == JournalMode.WAL or _ext_is_wal(path):
+        uri = f'file:{path}'
+
+    else:
+        uri = f'file:{path}?nolock=1'
+
+    path.parent.mkdir(exist_ok=True, parents=True)
+    conn = sqlite3.connect(uri,
+                           uri=True,
+                           isolation_level=None,
+                           detect_types=sqlite3.PARSE_DECLTYPES)
+    try:
+        # page_size and auto_vacuum are applied first - new database in
+        # WAL journal mode can not change them
+        if settings.page_size is not None:
+            conn.execute(f'PRAGMA page_size = {settings.page_size}')
+
+        _ext_init_auto_vacuum(conn, settings.auto_vacuum)
+
+        for name, value in settings._asdict().items():
+            if value is None or name in ('page_size', 'auto_vacuum'):
+                continue
+
+            if isinstance(value, enum.Enum):
+                value = value.value
+
+            conn.execute(f'PRAGMA {name} = {value}')
+
+        conn.executescript(_db_structure)
+        _ext_migrate(conn)
+        _ext_init_time_index(conn, time_index)
+        _ext_init_fts(conn, fts_columns)
+        _ext_init_indexes(conn, indexes)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def _ext_init_auto_vacuum(conn, auto_vacuum):
+    # auto vacuum mode can be freely changed only prior to tables creation
+    c = conn.execute("SELECT COUNT(*) FROM sqlite_master")
+    if c.fetchone()[0] == 0:
+        auto_vacuum = auto_vacuum or AutoVacuum.INCREMENTAL
+        conn.execute(f"PRAGMA auto_vacuum = {auto_vacuum.value}")
+        return
+
+    if auto_vacuum is None:
+        return
+
+    c = conn.execute("PRAGMA auto_vacuum")
+    current = list(AutoVacuum)[c.fetchone()[0]]
+    if current == auto_vacuum:
+        return
+
+    conn.execute(f"PRAGMA auto_vacuum = {auto_vacuum.value}")
+
+    # changes between FULL and INCREMENTAL do not require rebuild
+    if AutoVacuum.NONE not in (current, auto_vacuum):
+        return
+
+    mlog.info("migrating database to auto vacuum mode %s",
+              auto_vacuum.value)
+    conn.execute("VACUUM")
+
+
+def _ext_migrate(conn):
+    c = conn.execute("PRAGMA table_info(log)")
+    if 'hostname' not in {row[1] for row in c.fetchall()}:
+        return
+
+    mlog.info("migrating database to interned column values")
+
+    with _ext_transaction(conn, True):
+        _ext_drop_fts(conn)
+
+        for name in dictionary_column_names:
+            conn.execute(f"INSERT OR IGNORE INTO log_{name} (value) "
+                         f"SELECT DISTINCT {name} FROM log "
+                         f"WHERE {name} IS NOT NULL")
+
+        columns = _db_query_columns
+        values = ['rowid'] + [
+            (f"(SELECT id FROM log_{column} "
+             f"WHERE log_{column}.value = log.{column})"
+             if column else name)
+            for name, column in zip(_db_query_columns[1:],
+                                    _db_query_dictionary_columns[1:])]
+
+        conn.execute(f"CREATE TABLE log_migration ({_db_columns_sql})")
+        conn.execute(f"INSERT INTO log_migration ({', '.join(columns)}) "
+                     f"SELECT {', '.join(values)} FROM log ORDER BY rowid")
+        conn.execute("DROP TABLE log")
+        conn.execute("ALTER TABLE log_migration RENAME TO log")
+        conn.execute(_db_timestamp_index_sql)
+
+
+def _ext_init_time_index(conn, time_index):
+    c = conn.execute("SELECT EXISTS (SELECT 1 FROM log_time_block), "
+                     "MIN(rowid), MAX(rowid) FROM log")
+    has_blocks, first_id, last_id = c.fetchone()
+
+    # databases created by previous versions don't have sparse index
+    if not has_blocks and first_id is not None:
+        mlog.info("creating sparse entry timestamp index")
+
+        with _ext_transaction(conn, True):
+            _ext_insert_time_blocks(conn, 'main', 'main', first_id,
+                                    last_id + 1)
+
+    c = conn.execute("SELECT block, min_timestamp, max_timestamp "
+                     "FROM log_time_block ORDER BY block")
+    time_index.update(c.fetchall())
+
+
+def _ext_connect_read_only(path, settings, time_index):
+    if not path.exists():
+        raise FileNotFoundError(f'database {path} not found')
+
+    conn = sqlite3.connect(f'file:{path}?mode=ro&immutable=1',
+                           uri=True,
+                           isolation_level=None,
+                           detect_types=sqlite3.PARSE_DECLTYPES)
+    try:
+        for name in _connection_settings:
+            value = getattr(settings, name)
+            if value is None:
+                continue
+
+            if isinstance(value, enum.Enum):
+                value = value.value
+
+            conn.execute(f'PRAGMA {name} = {value}')
+
+        if _ext_is_migration_required(conn):
+            raise MigrationRequiredError(f'database {path} requires '
+                                         f'migration')
+
+        fts_columns, indexes = _ext_get_indexes(conn)
+
+        c = conn.execute("SELECT block, min_timestamp, max_timestamp "
+                         "FROM log_time_block ORDER BY block")
+        time_index.update(c.fetchall())
+
+    except Exception:
+        conn.close()
+        raise
+
+    return conn, fts_columns, indexes
+
+
+def _ext_is_migration_required(conn):
+    c = conn.execute("SELECT type, name FROM sqlite_master")
+    existing = set(c.fetchall())
+
+    c = conn.execute("PRAGMA table_info(log)")
+    log_columns = {row[1] for row in c.fetchall()}
+
+    if (not log_columns or 'hostname' in log_columns or
+            any(('table', f'log_{name}') not in existing
+                for name in ['summary', 'time_block',
+                             *dictionary_column_names])):
+        return True
+
+    # databases created prior to sparse timestamp index
+    c = conn.execute("SELECT NOT EXISTS (SELECT 1 FROM log_time_block) AND "
+                     "EXISTS (SELECT 1 FROM log)")
+    return bool(c.fetchone()[0])
+
+
+def _ext_insert_time_blocks(conn, schema, src_schema, start_id, end_id):
+    conn.execute(f"INSERT INTO {schema}.log_time_block "
+                 f"(block, min_timestamp, max_timestamp) "
+                 f"SELECT rowid / {_time_block_size}, "
+                 f"MIN(entry_timestamp), MAX(entry_timestamp) "
+                 f"FROM {src_schema}.log "
+                 f"WHERE rowid >= ? AND rowid < ? GROUP BY 1 "
+                 f"ON CONFLICT (block) DO UPDATE "
+                 f"SET min_timestamp = MIN(min_timestamp, "
+                 f"excluded.min_timestamp), "
+                 f"max_timestamp = MAX(max_timestamp, "
+                 f"excluded.max_timestamp)",
+                 [start_id, end_id])
+
+
+def _ext_get_indexes(conn):
+    c = conn.execute("PRAGMA table_info(log_fts)")
+    fts_columns = [row[1] for row in c.fetchall()]
+
+    c = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing = {row[0] for row in c.fetchall()}
+    indexes = [column for column in index_column_names
+               if _get_index_name(column) in existing]
+
+    return fts_columns, indexes
+
+
+def _ext_init_fts(conn, columns):
+    c = conn.execute("PRAGMA table_info(log_fts)")
+    if [row[1] for row in c.fetchall()] == columns:
+        return
+
+    mlog.debug("creating full-text index (columns: %s)", columns)
+
+    with _ext_transaction(conn, True):
+        _ext_drop_fts(conn)
+
+        if not columns:
+            return
+
+        names = ', '.join(columns)
+        new_values = ', '.join(_get_fts_value('new', i) for i in columns)
+        old_values = ', '.join(_get_fts_value('old', i) for i in columns)
+
+        content_values = ', '.join(f"{_get_fts_value('log', i)} AS {i}"
+                                   for i in columns)
+
+        # indexed content is provided by view which resolves interned values
+        conn.execute(f"CREATE VIEW log_fts_content AS "
+                     f"SELECT rowid AS id, {content_values} FROM log")
+        conn.execute(f"CREATE VIRTUAL TABLE log_fts USING fts5("
+                     f"{names}, content='log_fts_content', "
+                     f"content_rowid='id')")
+        conn.execute(f"CREATE TRIGGER log_fts_insert AFTER INSERT ON log "
+                     f"BEGIN "
+                     f"INSERT INTO log_fts (rowid, {names}) "
+                     f"VALUES (new.rowid, {new_values}); "
+                     f"END")
+        conn.execute(f"CREATE TRIGGER log_fts_delete AFTER DELETE ON log "
+                     f"BEGIN "
+                     f"INSERT INTO log_fts (log_fts, rowid, {names}) "
+                     f"VALUES ('delete', old.rowid, {old_values}); "
+                     f"END")
+        conn.execute("INSERT INTO log_fts (log_fts) VALUES ('rebuild')")
+
+
+def _ext_drop_fts(conn):
+    conn.execute("DROP TRIGGER IF EXISTS log_fts_insert")
+    conn.execute("DROP TRIGGER IF EXISTS log_fts_delete")
+    conn.execute("DROP TABLE IF EXISTS log_fts")
+    conn.execute("DROP VIEW IF EXISTS log_fts_content")
+
+
+def _ext_init_indexes(conn, indexes):
+    c = conn.execute("SELECT name FROM sqlite_master "
+                     "WHERE type = 'index' AND tbl_name = 'log'")
+    existing = {row[0] for row in c.fetchall()}
+
+    for column in index_column_names:
+        name = _get_index_name(column)
+
+        if column in indexes and name not in existing:
+            mlog.debug("creating index %s", name)
+            # rowid is implicitly included as last index column
+            conn.execute(f"CREATE INDEX {name} ON log "
+                         f"({_get_db_column_name(column)})")
+
+        elif column not in indexes and name in existing:
+            mlog.debug("dropping index %s", name)
+            conn.execute(f"DROP INDEX {name}")
+
+
+def _ext_connect_reader(path, settings):
+    conn = sqlite3.connect(f'file:{path}?mode=ro',
+                           uri=True,
+                           isolation_level=None,
+                           detect_types=sqlite3.PARSE_DECLTYPES)
+    try:
+        for name in _connection_settings:
+            value = getattr(settings, name)
+            if value is None:
+                continue
+
+            if isinstance(value, enum.Enum):
+                value = value.value
+
+            conn.execute(f'PRAGMA {name} = {value}')
+
+    except Exception:
+        conn.close()
+        raise
+
+    return conn
+
+
+def _ext_get_journal_mode(conn):
+    c = conn.execute("PRAGMA journal_mode")
+    return JournalMode(c.fetchone()[0].upper())
+
+
+def _ext_is_wal(path):
+    if not path.exists():
+        return False
+
+    # file format version numbers in database header are set to 2 in case
+    # of WAL journal mode
+    with open(path, 'rb') as f:
+        header = f.read(20)
+
+    return header[18:20] == b'\x02\x02'
+
+
+def _ext_close(conn):
+    try:
+        if conn.in_transaction:
+            conn.execute('COMMIT')
+
+    finally:
+        conn.close()
+
+
+def _ext_commit(conn):
+    if conn.in_transaction:
+        conn.execute('COMMIT')
+
+
+def _ext_execute_committed(conn, fn, *args):
+    _ext_commit(conn)
+
+    try:
+        return fn(conn, *args), None
+
+    except Exception as e:
+        return None, e
+
+
+@contextlib.contextmanager
+def _ext_transaction(conn, commit):
+    if not conn.in_transaction:
+        conn.execute('BEGIN')
+
+    conn.execute('SAVEPOINT ext_transaction')
+    try:
+        yield
+
+    except BaseException:
+        conn.execute('ROLLBACK TO ext_transaction')
+        raise
+
+    finally:
+        conn.execute('RELEASE ext_transaction')
+        if commit:
+            conn.execute('COMMIT')
+
+
+def _ext_fist_id(conn):
+    c = conn.execute("SELECT MIN(rowid) FROM log")
+    result = c.fetchall()
+    return result[0][0] if result else None
+
+
+def _ext_last_id(conn):
+    c = conn.execute("SELECT MAX(rowid) FROM log")
+    result = c.fetchall()
+    return result[0][0] if result else None
+
+
+def _ext_last_id_before(conn, timestamp):
+    # entries with same timestamp are resolved by index range lookup
+    c = conn.execute("SELECT MAX(rowid) FROM log "
+                     "INDEXED BY log_entry_timestamp_index "
+                     "WHERE entry_timestamp = ("
+                     "SELECT MAX(entry_timestamp) FROM log "
+                     "WHERE entry_timestamp < ?)", [timestamp])
+    result = c.fetchall()
+    return result[0][0] if result else None
+
+
+def _ext_timestamp_range(conn):
+    c = conn.execute("SELECT (SELECT MIN(entry_timestamp) FROM log), "
+                     "(SELECT MAX(entry_timestamp) FROM log)")
+    min_timestamp, max_timestamp = c.fetchone()
+    if min_timestamp is None:
+        return
+
+    return min_timestamp, max_timestamp
+
+
+def _ext_size(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (page_count - freelist_count) * page_size
+
+
+def _ext_page_stats(conn):
+    return PageStats(
+        page_size=conn.execute("PRAGMA page_size").fetchone()[0],
+        page_count=conn.execute("PRAGMA page_count").fetchone()[0],
+        freelist_count=conn.execute("PRAGMA freelist_count").fetchone()[0])
+
+
+def _ext_incremental_vacuum(conn, max_pages, commit):
+    c = conn.execute("PRAGMA auto_vacuum")
+    if list(AutoVacuum)[c.fetchone()[0]] != AutoVacuum.INCREMENTAL:
+        return 0
+
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    page_count = min(freelist_count, max_pages)
+
+    with _ext_transaction(conn, commit):
+        # sqlite3 module executes single step of pragma statement which
+        # doesn't return rows - each step returns single page
+        for _ in range(page_count):
+            conn.execute("PRAGMA incremental_vacuum(1)")
+
+    return (freelist_count -
+            conn.execute("PRAGMA freelist_count").fetchone()[0])
+
+
+def _ext_delete(conn, time_index, unused_values, first_id, commit):
     cmd = "DELETE FROM log"
+    blocks_cmd = "DELETE FROM log_time_block"
     if first_id is not None:
         cmd += " WHERE rowid < :first_id"
-    c = conn.execute(cmd, {'first_id': first_id})
-    return c.rowcount
+        blocks_cmd += f" WHERE block < :first_id / {_time_block_size}"
+    with _ext_transaction(conn, commit):
+        rows = _ext_delete_returning(conn, unused_values, cmd,
+                                     {'first_id': first_id})
+        conn.execute(blocks_cmd, {'first_id': first_id})
+    time_index.remove(first_id)
+    return len(rows)
+
+
+def _ext_delete_returning(conn, unused_values, cmd, args):
+    columns = [f'{name}_id' for name in unused_values.candidates] or ['NULL']
+    c = conn.execute(f"{cmd} RETURNING {', '.join(columns)}", args)
+    rows = c.fetchall()
+    unused_values.add(rows)
+    return rows
+
+
+def _ext_delete_severity(conn, unused_values, severity, start_id, end_id,
+                         summarize, commit):
+    args = {'severity': severity,
+            'start_id': start_id,
+            'end_id': end_id}
+    condition = ("severity = :severity AND "
+                 "rowid >= :start_id AND rowid < :end_id")
+
+    with _ext_transaction(conn, commit):
+        if summarize:
+            # NULL values are not equal in primary key - missing hostname
+            # and app_name are summarized with id 0 (ids start from 1)
+            conn.execute(f"INSERT INTO log_summary "
+                         f"(minute, severity, hostname_id, app_name_id, "
+                         f"count) "
+                         f"SELECT CAST(entry_timestamp / 60 AS INTEGER), "
+                         f"severity, IFNULL(hostname_id, 0), "
+                         f"IFNULL(app_name_id, 0), COUNT(*) "
+                         f"FROM log WHERE {condition} "
+                         f"GROUP BY 1, 2, 3, 4 "
+                         f"ON CONFLICT (minute, severity, hostname_id, "
+                         f"app_name_id) DO UPDATE "
+                         f"SET count = count + excluded.count", args)
+
+        rows = _ext_delete_returning(conn, unused_values,
+                                     f"DELETE FROM log WHERE {condition}",
+                                     args)
+
+    return len(rows)
+
+
+def _ext_get_used_values(conn, used, start_id, end_id):
+    c = conn.execute(f"SELECT DISTINCT "
+                     f"{', '.join(f'{name}_id' for name in used)} "
+                     f"FROM log WHERE rowid >= ? AND rowid < ?",
+                     [start_id, end_id])
+    for row in c.fetchall():
+        for name, dictionary_id in zip(used, row):
+            used[name].add(dictionary_id)
+
+
+def _ext_delete_unused_values(conn, dictionary, unused_values, used,
+                              start_id, commit):
+    _ext_get_used_values(conn, used, start_id, math.inf)
+    _ext_get_summary_values(conn, used)
+    unused_values.clear()
 
+    with _ext_transaction(conn, commit):
+        value_count = 0
+        for name, ids in used.items():
+            c = conn.execute(f"SELECT id FROM log_{name}")
+            unused = [row[0] for row in c.fetchall() if row[0] not in ids]
+            value_count += _ext_delete_values(conn, name, unused)
 
-def _ext_insert(conn, columns, values):
-    c = conn.executemany(f"INSERT INTO log ({', '.join(columns)}) "
-                         f"VALUES ({', '.join('?' * len(columns))})", values)
-    rowcount = c.rowcount
-    if rowcount < 1:
-        return []
-    last_id = _ext_last_id(conn)
-    return range(last_id - rowcount + 1, last_id + 1)
+    if value_count:
+        dictionary.clear()
 
+    return value_count
+
+
+def _ext_delete_unused_candidates(conn, dictionary, unused_values, commit):
+    if not any(unused_values.candidates.values()):
+        return 0
+
+    used = {name: set() for name in dictionary_column_names}
+    _ext_get_summary_values(conn, used)
+
+    with _ext_transaction(conn, commit):
+        value_count = 0
+        for name, ids in unused_values.candidates.items():
+            cmd = (f"SELECT EXISTS (SELECT 1 FROM log "
+                   f"INDEXED BY {_get_index_name(name)} "
+                   f"WHERE {name}_id = ?)")
+            unused = [i for i in ids
+                      if i not in used[name] and
+                      not conn.execute(cmd, [i]).fetchone()[0]]
+            value_count += _ext_delete_values(conn, name, unused)
+
+    unused_values.clear()
+
+    if value_count:
+        dictionary.clear()
+
+    return value_count
+
+
+def _ext_get_summary_values(conn, used):
+    c = conn.execute("SELECT DISTINCT hostname_id, app_name_id "
+                     "FROM log_summary")
+    for hostname_id, app_name_id in c.fetchall():
+        used['hostname'].add(hostname_id)
+        used['app_name'].add(app_name_id)
+
+
+def _ext_delete_values(conn, name, ids):
+    # value with maximal id is kept so that ids of deleted values are not
+    # reassigned (values can be cached by readers)
+    c = conn.execute(f"SELECT MAX(id) FROM log_{name}")
+    max_id = c.fetchone()[0]
+    ids = [i for i in ids if i != max_id]
+
+    value_count = 0
+    for i in range(0, len(ids), _max_query_args):
+        chunk = ids[i:i+_max_query_args]
+        c = conn.execute(f"DELETE FROM log_{name} "
+                         f"WHERE id IN ({', '.join('?' * len(chunk))})",
+                         chunk)
+        value_count += c.rowcount
+
+    return value_count
+
+
+def _ext_query_summaries(conn, dictionary, entry_timestamp_from,
+                         entry_timestamp_to):
+    conditions = []
+    args = {}
+    if entry_timestamp_from is not None:
+        conditions.append('minute >= :minute_from')
+        args['minute_from'] = int(entry_timestamp_from // 60)
+    if entry_timestamp_to is not None:
+        conditions.append('minute <= :minute_to')
+        args['minute_to'] = int(entry_timestamp_to // 60)
 
-def _ext_query(conn, conditions, args, max_results):
     c = conn.execute(
-        ' '.join([
-            "SELECT rowid, *",
-            "FROM log",
-            ('WHERE ' + ' AND '.join(conditions) if conditions else ''),
-            "ORDER BY rowid DESC",
-            ("LIMIT :max_results" if max_results is not None else '')]),
-        dict(args, max_results=max_results))
+        "SELECT minute, severity, hostname_id, app_name_id, count "
+        "FROM log_summary " +
+        ('WHERE ' + ' AND '.join(conditions) + ' ' if conditions else '') +
+        "ORDER BY minute", args)
     result = c.fetchall()
-    return [{k: v for k, v in zip(_db_query_columns, i)}
-            for i in result]
+
+    values = _ext_get_dictionary_values(
+        conn, dictionary,
+        {(column, row[index])
+         for row in result
+         for column, index in [('hostname', 2), ('app_name', 3)]
+         if row[index]})
+
+    return [common.Summary(timestamp=minute * 60,
+                           severity=common.Severity(severity),
+                           hostname=values.get(('hostname', hostname_id)),
+                           app_name=values.get(('app_name', app_name_id)),
+                           count=count)
+            for minute, severity, hostname_id, app_name_id, count in result]
+
+
+def _ext_attach_archive(conn, path, disable_journal):
+    # attaching is not possible inside transaction (see _execute_committed)
+    conn.execute("ATTACH DATABASE ? AS archive", [f'file:{path}?nolock=1'])
+
+    try:
+        if disable_journal:
+            conn.execute("PRAGMA archive.journal_mode = OFF")
+
+        # archive database is empty so interned values keep same ids
+        with _ext_transaction(conn, True):
+            for name in dictionary_column_names:
+                conn.execute(f"INSERT INTO archive.log_{name} (id, value) "
+                             f"SELECT id, value FROM main.log_{name}")
+
+    except Exception:
+        conn.execute("DETACH DATABASE archive")
+        raise
+
+
+def _ext_detach_archive(conn):
+    conn.execute("DETACH DATABASE archive")
+
+
+def _ext_archive(conn, start_id, end_id, commit):
+    columns = ', '.join(_db_query_columns)
+    with _ext_transaction(conn, commit):
+        c = conn.execute(f"INSERT INTO archive.log ({columns}) "
+                         f"SELECT {columns} FROM main.log "
+                         f"WHERE rowid >= ? AND rowid < ? ORDER BY rowid",
+                         [start_id, end_id])
+        _ext_insert_time_blocks(conn, 'archive', 'main', start_id, end_id)
+    return c.rowcount
+
+
+def _ext_attach_merge(conn, path):
+    # attaching is not possible inside transaction (see _execute_committed)
+    conn.execute("ATTACH DATABASE ? AS merge",
+                 [f'file:{path}?mode=ro&immutable=1'])
+
+    try:
+        with _ext_transaction(conn, True):
+            for name in dictionary_column_names:
+                conn.execute(f"INSERT OR IGNORE INTO main.log_{name} (value) "
+                             f"SELECT value FROM merge.log_{name}")
+                conn.execute(f"CREATE TEMP TABLE merge_{name} ("
+                             f"src_id INTEGER PRIMARY KEY, dst_id INTEGER)")
+                conn.execute(f"INSERT INTO temp.merge_{name} "
+                             f"SELECT src.id, dst.id "
+                             f"FROM merge.log_{name} AS src "
+                             f"JOIN main.log_{name} AS dst "
+                             f"ON dst.value = src.value")
+
+        c = conn.execute("SELECT (SELECT MIN(rowid) FROM merge.log), "
+                         "(SELECT MAX(rowid) FROM merge.log)")
+        return c.fetchone()
+
+    except Exception:
+        _ext_detach_merge(conn)
+        raise
+
+
+def _ext_detach_merge(conn):
+    for name in dictionary_column_names:
+        conn.execute(f"DROP TABLE IF EXISTS temp.merge_{name}")
+    conn.execute("DETACH DATABASE merge")
+
+
+def _ext_merge(conn, time_index, start_id, end_id, commit):
+    columns = ', '.join(_db_query_columns)
+    values = ', '.join(
+        (f"(SELECT dst_id FROM temp.merge_{column} "
+         f"WHERE src_id = src.{column}_id)" if column else f"src.{name}")
+        for name, column in zip(_db_query_columns,
+                                _db_query_dictionary_columns))
+    with _ext_transaction(conn, commit):
+        c = conn.execute(f"INSERT INTO main.log ({columns}) "
+                         f"SELECT {values} FROM merge.log AS src "
+                         f"WHERE rowid >= ? AND rowid < ? ORDER BY rowid",
+                         [start_id, end_id])
+        entry_count = c.rowcount
+
+        _ext_insert_time_blocks(conn, 'main', 'merge', start_id, end_id)
+        c = conn.execute("SELECT block, min_timestamp, max_timestamp "
+                         "FROM main.log_time_block "
+                         "WHERE block >= ? AND block <= ?",
+                         [start_id // _time_block_size,
+                          (end_id - 1) // _time_block_size])
+        time_index.update(c.fetchall())
+
+    return entry_count
+
+
+def _ext_merge_summaries(conn, commit):
+    with _ext_transaction(conn, commit):
+        # summarized missing values (id 0) are not mapped
+        conn.execute("INSERT INTO main.log_summary "
+                     "(minute, severity, hostname_id, app_name_id, count) "
+                     "SELECT minute, severity, "
+                     "IFNULL((SELECT dst_id FROM temp.merge_hostname "
+                     "WHERE src_id = src.hostname_id), 0), "
+                     "IFNULL((SELECT dst_id FROM temp.merge_app_name "
+                     "WHERE src_id = src.app_name_id), 0), "
+                     "count FROM merge.log_summary AS src WHERE true "
+                     "ON CONFLICT (minute, severity, hostname_id, "
+                     "app_name_id) DO UPDATE "
+                     "SET count = count + excluded.count")
+
+
+def _ext_vacuum(conn):
+    conn.execute("VACUUM")
+
+
+def _ext_insert(conn, dictionary, time_index, columns, values, commit):
+    # explicit cast is required because some sqlite versions apply
+    # affinity of first column to returned rowid
+    cmd = (f"INSERT INTO log "
+           f"({', '.join(_get_db_column_name(i) for i in columns)}) "
+           f"VALUES ({', '.join('?' * len(columns))}) "
+           f"RETURNING CAST(rowid AS INTEGER)")
+    interned = [(i, column) for i, column in enumerate(columns)
+                if column in dictionary_column_names]
+    timestamp_index = columns.index('entry_timestamp')
+
+    try:
+        with _ext_transaction(conn, commit):
+            entry_ids = []
+            blocks = {}
+            for row in values:
+                row = list(row)
+                for i, column in interned:
+                    row[i] = _ext_get_dictionary_id(conn, dictionary, column,
+                                                    row[i])
+                entry_id = conn.execute(cmd, row).fetchone()[0]
+                entry_ids.append(entry_id)
+
+                timestamp = row[timestamp_index]
+                block = entry_id // _time_block_size
+                min_timestamp, max_timestamp = blocks.get(
+                    block, (timestamp, timestamp))
+                blocks[block] = (min(min_timestamp, timestamp),
+                                 max(max_timestamp, timestamp))
+
+            rows = [(block, *timestamps)
+                    for block, timestamps in blocks.items()]
+            conn.executemany("INSERT INTO log_time_block "
+                             "(block, min_timestamp, max_timestamp) "
+                             "VALUES (?, ?, ?) "
+                             "ON CONFLICT (block) DO UPDATE "
+                             "SET min_timestamp = MIN(min_timestamp, "
+                             "excluded.min_timestamp), "
+                             "max_timestamp = MAX(max_timestamp, "
+                             "excluded.max_timestamp)",
+                             rows)
+            time_index.update(rows)
+            return entry_ids
+
+    except Exception:
+        # ids assigned in rolled back transaction can be reassigned
+        dictionary.clear()
+        raise
+
+
+def _ext_get_dictionary_id(conn, dictionary, column, value):
+    if value is None:
+        return
+
+    dictionary_id = dictionary.get_id(column, value)
+    if dictionary_id is not None:
+        return dictionary_id
+
+    c = conn.execute(f"SELECT id FROM log_{column} WHERE value = ?", [value])
+    row = c.fetchone()
+    if row:
+        dictionary_id = row[0]
+
+    else:
+        c = conn.execute(f"INSERT INTO log_{column} (value) VALUES (?) "
+                         f"RETURNING id", [value])
+        dictionary_id = c.fetchone()[0]
+
+    dictionary.set_id(column, value, dictionary_id)
+    return dictionary_id
+
+
+def _ext_query(conn, dictionary, index, conditions, args, max_results,
+               interrupt):
+    result = []
+    interrupted = False
+    plan = _ext_explain_query(conn, index, conditions, args, max_results)
+
+    conn.set_progress_handler(interrupt, query_interrupt_steps)
+    try:
+        c = conn.execute(_get_query_sql(index, conditions, max_results),
+                         dict(args, max_results=max_results))
+
+        # rows are fetched in chunks so that rows found prior to
+        # interruption are available
+        while True:
+            rows = c.fetchmany(query_fetch_size)
+            if not rows:
+                break
+
+            result.extend(rows)
+
+    except sqlite3.OperationalError:
+        if not interrupt.is_interrupted:
+            raise
+
+        interrupted = True
+
+    finally:
+        conn.set_progress_handler(None, 0)
+
+    # cancelled query result is not used
+    if interrupted and not interrupt.is_timeout:
+        return [], plan, interrupted
+
+    return _ext_get_entries(conn, dictionary, result), plan, interrupted
+
+
+def _ext_get_entries(conn, dictionary, result):
+    values = _ext_get_dictionary_values(
+        conn, dictionary,
+        {(column, value)
+         for row in result
+         for column, value in zip(_db_query_dictionary_columns, row)
+         if column and value is not None})
+
+    return [common.Entry(
+                id=entry_id,
+                timestamp=entry_timestamp,
+                msg=common.Msg(
+                    facility=common.Facility(facility),
+                    severity=common.Severity(severity),
+                    version=version,
+                    timestamp=msg_timestamp,
+                    hostname=values.get(('hostname', hostname_id)),
+                    app_name=values.get(('app_name', app_name_id)),
+                    procid=values.get(('procid', procid_id)),
+                    msgid=values.get(('msgid', msgid_id)),
+                    data=data,
+                    msg=msg))
+            for (entry_id, entry_timestamp, facility, severity, version,
+                 msg_timestamp, hostname_id, app_name_id, procid_id, msgid_id,
+                 data, msg) in result]
+
+
+def _ext_get_dictionary_values(conn, dictionary, keys):
+    # values are returned independently of cache, which can be smaller than
+    # number of keys
+    values = dictionary.get_values(keys)
+
+    missing = collections.defaultdict(list)
+    for column, dictionary_id in keys:
+        if (column, dictionary_id) not in values:
+            missing[column].append(dictionary_id)
+
+    fetched = {}
+    for column, ids in missing.items():
+        for i in range(0, len(ids), _max_query_args):
+            chunk = ids[i:i+_max_query_args]
+            c = conn.execute(f"SELECT id, value FROM log_{column} "
+                             f"WHERE id IN ({', '.join('?' * len(chunk))})",
+                             chunk)
+            for dictionary_id, value in c.fetchall():
+                fetched[(column, dictionary_id)] = value
+
+    dictionary.set_values(fetched)
+    values.update(fetched)
+    return values
+
+
+def _ext_explain_query(conn, index, conditions, args, max_results):
+    c = conn.execute('EXPLAIN QUERY PLAN ' +
+                     _get_query_sql(index, conditions, max_results),
+                     dict(args, max_results=max_results))
+    return [row[-1] for row in c.fetchall()]
+
+
+def _get_query_sql(index, conditions, max_results):
+    return ' '.join([
+        f"SELECT {', '.join(_db_query_columns)}",
+        "FROM log",
+        ("NOT INDEXED" if index == 'rowid' else
+         f"INDEXED BY {_get_index_name(index)}" if index else ''),
+        ('WHERE ' + ' AND '.join(conditions) if conditions else ''),
+        "ORDER BY rowid DESC",
+        ("LIMIT :max_results" if max_results is not None else '')])
+
+
+def _get_db_column_name(column):
+    if column in dictionary_column_names:
+        return f'{column}_id'
+
+    return column
+
+
+def _get_fts_value(table, column):
+    if column in dictionary_column_names:
+        return (f"(SELECT value FROM log_{column} "
+                f"WHERE log_{column}.id = {table}.{column}_id)")
+
+    return f'{table}.{column}'
+
+
+def _get_index_name(column):
+    return f'log_{column}_index'
+
+
+def _get_query_index(filter, indexes):
+    """Choose secondary index used for query
+
+    Equality conditions are preferred because index ``(<column>, rowid)``
+    provides results ordered by rowid. Without table statistics,
+    selectivity of each column is estimated by `_index_priority`.
+
+    """
+    str_match_type = (filter.match_type
+                      if filter.match_type in (common.MatchType.EXACT,
+                                               common.MatchType.PREFIX)
+                      else None)
+
+    equality_columns = set()
+    prefix_columns = set()
+
+    if filter.facility:
+        equality_columns.add('facility')
+
+    if filter.severity:
+        equality_columns.add('severity')
+
+    for name in _str_filter_names:
+        if not getattr(filter, name):
+            continue
+
+        if str_match_type == common.MatchType.EXACT:
+            equality_columns.add(name)
+
+        elif str_match_type == common.MatchType.PREFIX:
+            prefix_columns.add(name)
+
+    for columns in [equality_columns, prefix_columns]:
+        for column in _index_priority:
+            if column in columns and column in indexes:
+                return column
+
+
+def _get_words(value):
+    for word in value.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            yield word, prefix
+
+
+def _get_fts_query(name, value):
+    terms = ['"' + word.replace('"', '""') + '"' + ('*' if prefix else '')
+             for word, prefix in _get_words(value)]
+    if not terms:
+        return
+
+    return f"{name} : ({' AND '.join(terms)})"
+
+
+def _match_like(pattern, value):
+    # SQLite LIKE without escape character - case folding is applied only
+    # to ASCII letters
+    regex = ''.join('.*' if i == '%' else
+                    '.' if i == '_' else
+                    f'[{i.lower()}{i.upper()}]' if i.isascii() and i.isalpha()
+                    else re.escape(i)
+                    for i in pattern)
+    return re.fullmatch(regex, value, re.DOTALL) is not None
+
+
+def _get_fts_tokens(value):
+    # FTS5 unicode61 tokenizer with default options - token characters are
+    # letters, numbers and private use characters, case is folded and
+    # diacritics are removed from latin letters
+    token = []
+    for i in itertools.chain(value, ' '):
+        if unicodedata.category(i) in _fts_token_categories:
+            token.append(_fold_fts_char(i))
+
+        elif token:
+            yield ''.join(token)
+            token = []
+
+
+def _fold_fts_char(char):
+    if unicodedata.name(char, '').startswith('LATIN '):
+        char = unicodedata.normalize('NFD', char)[0]
+
+    folded = char.lower()
+    return folded if len(folded) == 1 else char
+
+
+def _match_fts_phrase(tokens, phrase, prefix):
+    if not phrase:
+        return False
+
+    for i in range(len(tokens) - len(phrase) + 1):
+        candidate = tokens[i:i + len(phrase)]
+        if candidate[:-1] != phrase[:-1]:
+            continue
+
+        if (candidate[-1].startswith(phrase[-1]) if prefix
+                else candidate[-1] == phrase[-1]):
+            return True
+
+    return False
+
+
+def _get_prefix_upper_bound(value):
+    # smallest string greater than all strings starting with value
+    for i in reversed(range(len(value))):
+        code = ord(value[i]) + 1
+        if 0xD800 <= code <= 0xDFFF:
+            code = 0xE000
+
+        if code <= 0x10FFFF:
+            return value[:i] + chr(code)
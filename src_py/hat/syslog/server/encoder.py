@@ -13,7 +13,8 @@ def filter_to_json(filter: common.Filter) -> json.Data:
     """Convert filter to json data"""
     return dict(filter._asdict(),
                 facility=filter.facility.name if filter.facility else None,
-                severity=filter.severity.name if filter.severity else None)
+                severity=filter.severity.name if filter.severity else None,
+                match_type=filter.match_type.name)
 
 
 def filter_from_json(json_filter: json.Data) -> common.Filter:
@@ -23,7 +24,10 @@ def filter_from_json(json_filter: json.Data) -> common.Filter:
         facility=(common.Facility[json_filter['facility']]
                   if json_filter['facility'] else None),
         severity=(common.Severity[json_filter['severity']]
-                  if json_filter['severity'] else None)))
+                  if json_filter['severity'] else None),
+        match_type=(common.MatchType[json_filter['match_type']]
+                    if json_filter.get('match_type')
+                    else common.MatchType.CONTAINS)))
 
 
 def entry_to_json(entry: common.Entry) -> json.Data:
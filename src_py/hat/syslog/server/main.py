@@ -13,8 +13,29 @@ import appdirs
 from hat import aio
 from hat import json
 
-from hat.syslog.server.backend import create_backend
-from hat.syslog.server.syslog import create_syslog_server
+from hat.syslog.server.archive import Compression
+from hat.syslog.server.backend import (RegisterConf,
+                                       RetentionConf,
+                                       create_backend)
+from hat.syslog.server.database import (AutoVacuum,
+                                        JournalMode,
+                                        Settings,
+                                        Synchronous,
+                                        TempStore,
+                                        fts_column_names,
+                                        index_column_names)
+from hat.syslog.server import common
+from hat.syslog.server import rules
+from hat.syslog.server.segments import (SegmentConf,
+                                        parse_segment_conf)
+from hat.syslog.server.ratelimit import (Limit,
+                                         OverrideKey,
+                                         create_rate_limiter,
+                                         parse_limit,
+                                         parse_override)
+from hat.syslog.server.syslog import (FramePolicy,
+                                      Limits,
+                                      create_syslog_server)
 from hat.syslog.server.ui import create_web_server
 
 
@@ -30,6 +51,9 @@ default_log_level: str = 'INFO'
 default_ui_addr: str = 'http://0.0.0.0:23020'
 """Default UI listening address"""
 
+default_ui_query_timeout: float = 10
+"""Default UI query timeout in seconds"""
+
 default_db_path: Path = user_data_dir / 'syslog.db'
 """Default DB file path"""
 
@@ -39,10 +63,25 @@ default_db_low_size: int = int(1e6)
 default_db_high_size: int = int(1e7)
 """Default DB high size count"""
 
+default_db_read_pool_size: int = 2
+"""Default DB read connection pool size"""
+
+default_db_indexes: list[str] = ['severity', 'hostname', 'app_name']
+"""Default DB secondary indexes"""
+
+default_register_conf: RegisterConf = RegisterConf()
+"""Default message registration configuration"""
+
+default_retention_conf: RetentionConf = RetentionConf()
+"""Default retention configuration"""
+
 default_syslog_addrs: list[str] = ['tcp://0.0.0.0:6514',
                                    'udp://0.0.0.0:6514']
 """Default syslog listening addresses"""
 
+default_syslog_limits: Limits = Limits()
+"""Default syslog listening limits"""
+
 
 def create_argument_parser() -> argparse.ArgumentParser:
     """Create argument parser"""
@@ -65,6 +104,12 @@ def create_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         '--ui-addr', metavar='ADDR', default=default_ui_addr,
         help=f"UI listening address (default {default_ui_addr})")
+    parser.add_argument(
+        '--ui-query-timeout', metavar='T', type=float,
+        default=default_ui_query_timeout,
+        help=f"maximum duration in seconds of queries made by UI - partial "
+             f"result is provided once it is exceeded (0 represents "
+             f"unlimited duration; default {default_ui_query_timeout})")
     parser.add_argument(
         '--db-path', metavar='PATH', type=Path, default=default_db_path,
         help="sqlite database file path "
@@ -81,18 +126,182 @@ def create_argument_parser() -> argparse.ArgumentParser:
         '--db-enable-archive', action='store_true',
         help="should messages, deleted during database cleanup, be kept "
              "in archive files")
+    parser.add_argument(
+        '--db-archive-compression', choices=[i.value for i in Compression],
+        default=Compression.NONE.value,
+        help="compression applied to archive files (default none)")
+    parser.add_argument(
+        '--db-query-archives', action='store_true',
+        help="should queries not satisfied by messages in database continue "
+             "with archive files listed in archive catalog")
     parser.add_argument(
         '--db-disable-journal', action='store_true',
         help="disable sqlite journaling")
+    parser.add_argument(
+        '--db-journal-mode', choices=[i.value for i in JournalMode],
+        type=str.upper, default=None,
+        help="sqlite journal mode (WAL enables concurrent reading while "
+             "writing; by default sqlite default is used)")
+    parser.add_argument(
+        '--db-synchronous', choices=[i.value for i in Synchronous],
+        type=str.upper, default=None,
+        help="sqlite synchronous flag (NORMAL is durable in WAL journal "
+             "mode except in case of power loss; by default sqlite default "
+             "is used)")
+    parser.add_argument(
+        '--db-cache-size', metavar='N', type=int, default=None,
+        help="sqlite page cache size - positive value is number of pages, "
+             "negative value is size in KiB (by default sqlite default is "
+             "used)")
+    parser.add_argument(
+        '--db-mmap-size', metavar='N', type=int, default=None,
+        help="maximum number of bytes used by sqlite for memory-mapped I/O "
+             "(by default sqlite default is used)")
+    parser.add_argument(
+        '--db-page-size', metavar='N', type=int, default=None,
+        help="sqlite page size in bytes applied to newly created databases "
+             "(by default sqlite default is used)")
+    parser.add_argument(
+        '--db-temp-store', choices=[i.value for i in TempStore],
+        type=str.upper, default=None,
+        help="sqlite temporary storage location (by default sqlite default "
+             "is used)")
+    parser.add_argument(
+        '--db-wal-autocheckpoint', metavar='N', type=int, default=None,
+        help="number of WAL pages which trigger automatic checkpoint "
+             "(by default sqlite default is used)")
+    parser.add_argument(
+        '--db-auto-vacuum', choices=[i.value for i in AutoVacuum],
+        type=str.upper, default=None,
+        help="sqlite auto vacuum mode (existing databases are migrated - "
+             "enabling or disabling auto vacuum rebuilds whole database; "
+             "by default new databases use INCREMENTAL)")
+    parser.add_argument(
+        '--db-read-pool-size', metavar='N', type=int,
+        default=default_db_read_pool_size,
+        help=f"number of read-only database connections used for queries "
+             f"in WAL journal mode (default {default_db_read_pool_size})")
+    parser.add_argument(
+        '--db-fts-column', metavar='NAME', choices=fts_column_names,
+        default=[], action='append',
+        help=f"column included in full-text index used by full-text "
+             f"queries - one of {', '.join(fts_column_names)} (can be "
+             f"provided multiple times; by default full-text index is "
+             f"disabled)")
+    parser.add_argument(
+        '--db-indexes', metavar='NAMES', type=_parse_db_indexes,
+        default=default_db_indexes,
+        help=f"comma separated list of columns with secondary index - any "
+             f"of {', '.join(index_column_names)} "
+             f"(default {','.join(default_db_indexes)})")
+    parser.add_argument(
+        '--db-segments', metavar='PERIOD', type=parse_segment_conf,
+        default=None,
+        help="store messages in database segments - separate sqlite "
+             "files each containing messages received during one 'hour' "
+             "or 'day' or containing up to N messages (database cleanup "
+             "removes whole segments; by default single database file is "
+             "used)")
+    parser.add_argument(
+        '--register-max-delay', metavar='T', type=float,
+        default=default_register_conf.max_delay,
+        help=f"maximum delay in seconds used for collecting messages into "
+             f"single database insert batch "
+             f"(default {default_register_conf.max_delay})")
+    parser.add_argument(
+        '--register-queue-size', metavar='N', type=int,
+        default=default_register_conf.queue_size,
+        help=f"maximum number of received messages waiting for database "
+             f"insertion (default {default_register_conf.queue_size})")
+    parser.add_argument(
+        '--register-max-batch-size', metavar='N', type=int,
+        default=default_register_conf.max_batch_size,
+        help=f"maximum number of messages inserted into database at once "
+             f"(reaching this number of queued messages triggers insert "
+             f"prior to expiration of registration delay) "
+             f"(default {default_register_conf.max_batch_size})")
+    parser.add_argument(
+        '--register-commit-delay', metavar='T', type=float,
+        default=default_register_conf.commit_delay,
+        help="maximum delay in seconds of database transaction commit "
+             "used for committing multiple insert batches at once "
+             "(default 0 - each batch is committed separately)")
+    parser.add_argument(
+        '--retention-max-age', metavar='T', type=float,
+        default=default_retention_conf.max_age,
+        help="maximum age in seconds of messages kept in database - older "
+             "messages are removed during database cleanup "
+             "(default 0 - unlimited)")
+    parser.add_argument(
+        '--retention-max-bytes', metavar='N', type=int,
+        default=default_retention_conf.max_size,
+        help="maximum database size in bytes that will trigger database "
+             "cleanup (default 0 - unlimited)")
+    parser.add_argument(
+        '--retention-severity-max-age', metavar='SEVERITY=T',
+        type=_parse_severity_max_age, default=[], action='append',
+        help="maximum age in seconds of messages with specific severity "
+             "(e.g. DEBUG=86400) - older messages are removed during "
+             "database cleanup without archiving (can be provided multiple "
+             "times)")
+    parser.add_argument(
+        '--retention-summarize', action='store_true',
+        help="should number of messages removed because of severity "
+             "maximum age be kept in per minute, hostname, app_name and "
+             "severity summaries")
+    parser.add_argument(
+        '--rules-path', metavar='PATH', type=Path, default=None,
+        help="path to json/yaml/toml ingest rules configuration used for "
+             "dropping messages or routing them to secondary databases")
     parser.add_argument(
         '--syslog-pem-path', metavar='PATH', type=Path, default=None,
         help="certificate PEM path used in case of tls syslog")
+    parser.add_argument(
+        '--syslog-max-frame-size', metavar='N', type=int,
+        default=default_syslog_limits.max_frame_size,
+        help=f"maximum syslog frame size in bytes "
+             f"(default {default_syslog_limits.max_frame_size})")
+    parser.add_argument(
+        '--syslog-frame-policy', choices=[i.value for i in FramePolicy],
+        default=default_syslog_limits.frame_policy.value,
+        help=f"policy applied to syslog frames larger than maximum frame "
+             f"size: 'truncate' keeps beginning of frame, 'reject' drops "
+             f"frame and closes TCP connection "
+             f"(default {default_syslog_limits.frame_policy.value})")
+    parser.add_argument(
+        '--syslog-max-connections', metavar='N', type=int,
+        default=default_syslog_limits.max_connections,
+        help="maximum number of concurrent TCP connections per syslog "
+             "listening address (default 0 - unlimited)")
+    parser.add_argument(
+        '--syslog-max-host-connections', metavar='N', type=int,
+        default=default_syslog_limits.max_host_connections,
+        help="maximum number of concurrent TCP connections per syslog "
+             "listening address and source address (default 0 - unlimited)")
+    parser.add_argument(
+        '--syslog-idle-timeout', metavar='T', type=float,
+        default=default_syslog_limits.idle_timeout,
+        help="TCP connection idle read timeout in seconds "
+             "(default 0 - disabled)")
+    parser.add_argument(
+        '--syslog-rate-limit', metavar='LIMIT', type=parse_limit,
+        default=None,
+        help="default per source rate limit formated as <rate>[:<burst>] "
+             "where <rate> is number of messages per second and <burst> is "
+             "maximum number of messages received at once (by default "
+             "rate is not limited)")
+    parser.add_argument(
+        '--syslog-rate-limit-override', metavar='KIND:VALUE=LIMIT',
+        type=parse_override, default=[], action='append',
+        help="rate limit override formated as <kind>:<value>=<limit> where "
+             "<kind> is 'addr', 'hostname' or 'app_name' (can be provided "
+             "multiple times)")
     parser.add_argument(
         'syslog_addrs', metavar='ADDR', nargs='*',
         default=default_syslog_addrs,
         help="syslog listening address formated as <prot>://<host>:<port> "
-             "(<prot> is 'tcp', 'udp' or 'tls'; <host> is host name or IP "
-             "address; <port> is UDP/TCP port)")
+             "(<prot> is 'tcp', 'udp', 'tls' or 'relp'; <host> is host name "
+             "or IP address; <port> is UDP/TCP port)")
     return parser
 
 
@@ -138,31 +347,118 @@ def main():
                                     log_conf_path=args.log_conf)
     logging.config.dictConfig(logging_conf)
 
+    syslog_limits = Limits(
+        max_frame_size=args.syslog_max_frame_size,
+        frame_policy=FramePolicy(args.syslog_frame_policy),
+        max_connections=args.syslog_max_connections,
+        max_host_connections=args.syslog_max_host_connections,
+        idle_timeout=args.syslog_idle_timeout)
+
+    db_settings = Settings(
+        page_size=args.db_page_size,
+        journal_mode=(JournalMode(args.db_journal_mode)
+                      if args.db_journal_mode else None),
+        synchronous=(Synchronous(args.db_synchronous)
+                     if args.db_synchronous else None),
+        cache_size=args.db_cache_size,
+        mmap_size=args.db_mmap_size,
+        temp_store=(TempStore(args.db_temp_store)
+                    if args.db_temp_store else None),
+        wal_autocheckpoint=args.db_wal_autocheckpoint,
+        auto_vacuum=(AutoVacuum(args.db_auto_vacuum)
+                     if args.db_auto_vacuum else None))
+
+    register_conf = RegisterConf(
+        max_delay=args.register_max_delay,
+        queue_size=args.register_queue_size,
+        max_batch_size=args.register_max_batch_size,
+        commit_delay=args.register_commit_delay)
+
+    retention_conf = RetentionConf(
+        max_age=args.retention_max_age,
+        max_size=args.retention_max_bytes,
+        severity_max_ages=dict(args.retention_severity_max_age),
+        summarize=args.retention_summarize)
+
+    rules_conf = (rules.load_conf(args.rules_path) if args.rules_path
+                  else None)
+
     aio.init_asyncio()
     with contextlib.suppress(asyncio.CancelledError):
         aio.run_asyncio(async_main(ui_addr=args.ui_addr,
+                                   ui_query_timeout=args.ui_query_timeout,
                                    db_path=args.db_path,
                                    db_low_size=args.db_low_size,
                                    db_high_size=args.db_high_size,
                                    db_enable_archive=args.db_enable_archive,
+                                   db_archive_compression=Compression(
+                                       args.db_archive_compression),
+                                   db_query_archives=args.db_query_archives,
                                    db_disable_journal=args.db_disable_journal,
+                                   db_settings=db_settings,
+                                   db_read_pool_size=args.db_read_pool_size,
+                                   db_fts_columns=args.db_fts_column,
+                                   db_indexes=args.db_indexes,
+                                   db_segments=args.db_segments,
+                                   register_conf=register_conf,
+                                   retention_conf=retention_conf,
+                                   rules_conf=rules_conf,
                                    syslog_pem_path=args.syslog_pem_path,
+                                   syslog_limits=syslog_limits,
+                                   syslog_rate_limit=args.syslog_rate_limit,
+                                   syslog_rate_limit_overrides=dict(
+                                       args.syslog_rate_limit_override),
                                    syslog_addrs=args.syslog_addrs))
 
 
 async def async_main(ui_addr: str,
+                     ui_query_timeout: float,
                      db_path: Path,
                      db_low_size: int,
                      db_high_size: int,
                      db_enable_archive: bool,
+                     db_archive_compression: Compression,
+                     db_query_archives: bool,
                      db_disable_journal: bool,
+                     db_settings: Settings,
+                     db_read_pool_size: int,
+                     db_fts_columns: list[str],
+                     db_indexes: list[str],
+                     db_segments: SegmentConf | None,
+                     register_conf: RegisterConf,
+                     retention_conf: RetentionConf,
+                     rules_conf: rules.Conf | None,
                      syslog_pem_path: Path | None,
+                     syslog_limits: Limits,
+                     syslog_rate_limit: Limit | None,
+                     syslog_rate_limit_overrides: dict[OverrideKey, Limit],
                      syslog_addrs: list[str]):
     """Syslog Server async main"""
     async_group = aio.Group()
+    backends = {}
+    syslog_servers = []
+    route = (rules.compile_rules(rules_conf.rules) if rules_conf
+             else lambda _: rules.main_database)
 
     async def on_msg(msg):
-        await backend.register(time.time(), msg)
+        database = route(msg)
+        if database is None:
+            return
+
+        await backends[database].register(time.time(), msg)
+
+    async def on_sync():
+        await asyncio.gather(*(i.sync() for i in backends.values()))
+
+    def on_congestion(_):
+        congested = any(i.is_congested for i in backends.values())
+
+        for syslog_server in syslog_servers:
+            if congested:
+                syslog_server.pause_reading()
+
+            else:
+                syslog_server.resume_reading()
 
     async def async_close():
         await async_group.async_close()
@@ -172,16 +468,49 @@ async def async_main(ui_addr: str,
         mlog.debug("creating backend...")
         backend = await _create_resource(async_group, create_backend,
                                          db_path, db_low_size, db_high_size,
-                                         db_enable_archive, db_disable_journal)
+                                         db_enable_archive, db_disable_journal,
+                                         register_conf, db_settings,
+                                         db_read_pool_size, db_fts_columns,
+                                         db_indexes, db_segments,
+                                         retention_conf,
+                                         db_archive_compression,
+                                         db_query_archives)
+        backends[rules.main_database] = backend
+
+        for name, db_conf in (rules_conf.databases.items() if rules_conf
+                              else []):
+            mlog.debug("creating %s backend...", name)
+            backends[name] = await _create_resource(
+                async_group, create_backend, db_conf.path,
+                (db_conf.low_size if db_conf.low_size is not None
+                 else db_low_size),
+                (db_conf.high_size if db_conf.high_size is not None
+                 else db_high_size),
+                db_enable_archive, db_disable_journal, register_conf,
+                db_settings, db_read_pool_size, db_fts_columns, db_indexes,
+                db_segments, retention_conf, db_archive_compression,
+                db_query_archives)
+
+        for i in backends.values():
+            i.register_congestion_cb(on_congestion)
 
         mlog.debug("creating web server...")
         await _create_resource(async_group, create_web_server, ui_addr,
-                               backend)
+                               backend, ui_query_timeout)
+
+        limiter = None
+        if syslog_rate_limit or syslog_rate_limit_overrides:
+            mlog.debug("creating rate limiter...")
+            limiter = await _create_resource(
+                async_group, create_rate_limiter, syslog_rate_limit,
+                syslog_rate_limit_overrides, on_msg)
 
         mlog.debug("creating syslog servers...")
         for syslog_addr in syslog_addrs:
-            await _create_resource(async_group, create_syslog_server,
-                                   syslog_addr, on_msg, syslog_pem_path)
+            syslog_server = await _create_resource(
+                async_group, create_syslog_server, syslog_addr, on_msg,
+                syslog_pem_path, syslog_limits, limiter, on_sync)
+            syslog_servers.append(syslog_server)
 
         mlog.debug("initialization done")
         await async_group.wait_closing()
@@ -199,6 +528,23 @@ async def _create_resource(async_group, fn, *args):
     return resource
 
 
+def _parse_db_indexes(indexes_str):
+    indexes = [i.strip() for i in indexes_str.split(',') if i.strip()]
+    for i in indexes:
+        if i not in index_column_names:
+            raise ValueError(f'invalid index column {i}')
+
+    return indexes
+
+
+def _parse_severity_max_age(severity_max_age_str):
+    severity_str, sep, max_age_str = severity_max_age_str.partition('=')
+    if not sep or severity_str.upper() not in common.Severity.__members__:
+        raise ValueError('invalid severity max age')
+
+    return common.Severity[severity_str.upper()], float(max_age_str)
+
+
 if __name__ == '__main__':
     sys.argv[0] = 'hat-syslog-server'
     sys.exit(main())
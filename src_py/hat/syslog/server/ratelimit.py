@@ -0,0 +1,255 @@
+"""Ingest rate limiting
+
+Rate limiter maintains token bucket for each source address and for each
+hostname/app_name pair. Message is accepted only if both of its buckets
+contain at least one token. Number of buckets is limited to `max_buckets`
+(least recently used buckets are removed).
+
+"""
+
+import asyncio
+import collections
+import enum
+import logging
+import os
+import socket
+import time
+import typing
+
+from hat import aio
+from hat import json
+
+from hat.syslog.server import common
+
+
+mlog: logging.Logger = logging.getLogger(__name__)
+"""Module logger"""
+
+summary_interval: float = 60
+"""Dropped messages summary interval in seconds"""
+
+summary_max_sources: int = 100
+"""Maximum number of sources with separate dropped messages count in
+single summary (dropped messages of other sources are counted together)"""
+
+max_buckets: int = 64 * 1024
+"""Maximum number of token buckets"""
+
+MsgCb = aio.AsyncCallable[[common.Msg], None]
+
+
+class OverrideKind(enum.Enum):
+    ADDR = 'addr'
+    HOSTNAME = 'hostname'
+    APP_NAME = 'app_name'
+
+
+OverrideKey = tuple[OverrideKind, str]
+"""Limit override key (kind and matched value)"""
+
+
+class Limit(typing.NamedTuple):
+    rate: float
+    """Number of tokens added to bucket per second"""
+    burst: float
+    """Maximum number of tokens in bucket"""
+
+
+def parse_limit(limit_str: str) -> Limit:
+    """Parse limit formatted as ``<rate>[:<burst>]``
+
+    If burst is not provided, it is same as rate (with minimum of 1).
+
+    """
+    rate_str, _, burst_str = limit_str.partition(':')
+    rate = float(rate_str)
+    burst = float(burst_str) if burst_str else max(rate, 1)
+    if rate <= 0 or burst < 1:
+        raise ValueError('invalid limit')
+
+    return Limit(rate=rate,
+                 burst=burst)
+
+
+def parse_override(override_str: str) -> tuple[OverrideKey, Limit]:
+    """Parse limit override formatted as ``<kind>:<value>=<limit>``
+
+    Kind is one of `OverrideKind` values and limit is formatted as
+    described in `parse_limit`.
+
+    """
+    key_str, sep, limit_str = override_str.rpartition('=')
+    kind_str, kind_sep, value = key_str.partition(':')
+    if not sep or not kind_sep or not value:
+        raise ValueError('invalid limit override')
+
+    return (OverrideKind(kind_str), value), parse_limit(limit_str)
+
+
+async def create_rate_limiter(limit: Limit | None,
+                              overrides: dict[OverrideKey, Limit],
+                              msg_cb: MsgCb
+                              ) -> 'RateLimiter':
+    """Create rate limiter
+
+    `limit` is default limit applied to all buckets (``None`` represents
+    unlimited rate). Keys of `overrides` are matched against source
+    address (for source address buckets) and against app_name or hostname
+    (for hostname/app_name buckets, app_name override takes precedence).
+
+    Once per `summary_interval`, if any messages were dropped, summary
+    message is passed to `msg_cb`.
+
+    """
+    limiter = RateLimiter()
+    limiter._limit = limit
+    limiter._overrides = overrides
+    limiter._msg_cb = msg_cb
+    limiter._buckets = collections.OrderedDict()
+    limiter._dropped = collections.Counter()
+    limiter._async_group = aio.Group()
+
+    limiter._async_group.spawn(limiter._summary_loop)
+
+    return limiter
+
+
+class RateLimiter(aio.Resource):
+
+    @property
+    def async_group(self) -> aio.Group:
+        """Async group"""
+        return self._async_group
+
+    def check(self,
+              addr: str | None,
+              msg: common.Msg
+              ) -> bool:
+        """Check if message received from source address is allowed
+
+        If message is allowed, tokens are consumed from corresponding buckets.
+        Otherwise, message is counted as dropped.
+
+        """
+        now = time.monotonic()
+        keys = [('addr', addr),
+                ('app', msg.hostname, msg.app_name)]
+
+        buckets = []
+        for key in keys:
+            limit = self._get_limit(key)
+            if not limit:
+                continue
+
+            bucket = self._buckets.get(key)
+            if bucket is None or bucket.limit != limit:
+                bucket = _TokenBucket(limit, now)
+                self._buckets[key] = bucket
+
+                while len(self._buckets) > max_buckets:
+                    self._buckets.popitem(last=False)
+
+            else:
+                self._buckets.move_to_end(key)
+
+            bucket.refill(now)
+            if bucket.tokens < 1:
+                self._add_dropped(key)
+                return False
+
+            buckets.append(bucket)
+
+        for bucket in buckets:
+            bucket.tokens -= 1
+
+        return True
+
+    def _get_limit(self, key):
+        if key[0] == 'addr':
+            return self._overrides.get((OverrideKind.ADDR, key[1]),
+                                       self._limit)
+
+        _, hostname, app_name = key
+        if (OverrideKind.APP_NAME, app_name) in self._overrides:
+            return self._overrides[(OverrideKind.APP_NAME, app_name)]
+
+        return self._overrides.get((OverrideKind.HOSTNAME, hostname),
+                                   self._limit)
+
+    def _add_dropped(self, key):
+        if (key not in self._dropped and
+                len(self._dropped) >= summary_max_sources):
+            key = ('other', )
+
+        self._dropped[key] += 1
+
+    async def _summary_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(summary_interval)
+
+                self._prune_buckets()
+
+                if not self._dropped:
+                    continue
+
+                msg = _create_summary_msg(self._dropped)
+                self._dropped = collections.Counter()
+
+                mlog.debug('%s', msg.msg)
+                await aio.call(self._msg_cb, msg)
+
+        except Exception as e:
+            mlog.error('summary loop error: %s', e, exc_info=e)
+
+        finally:
+            self.close()
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.limit.burst:
+                del self._buckets[key]
+
+
+class _TokenBucket:
+
+    def __init__(self, limit, now):
+        self.limit = limit
+        self.tokens = limit.burst
+        self._last = now
+
+    def refill(self, now):
+        self.tokens = min(self.limit.burst,
+                          self.tokens + (now - self._last) * self.limit.rate)
+        self._last = now
+
+
+def _create_summary_msg(dropped):
+    sources = {}
+    for key, count in dropped.items():
+        if key[0] == 'addr':
+            source = f'addr:{key[1]}'
+
+        elif key[0] == 'other':
+            source = 'other'
+
+        else:
+            source = f'app:{key[1] or "-"}/{key[2] or "-"}'
+
+        sources[source] = str(count)
+
+    return common.Msg(
+        facility=common.Facility.INTERNAL,
+        severity=common.Severity.WARNING,
+        version=1,
+        timestamp=time.time(),
+        hostname=socket.gethostname(),
+        app_name='hat-syslog-server',
+        procid=str(os.getpid()),
+        msgid=__name__[:32],
+        data=json.encode({'ratelimit@hat': sources}),
+        msg=(f'rate limit dropped {sum(dropped.values())} messages '
+             f'from {len(sources)} sources'))
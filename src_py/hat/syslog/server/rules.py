@@ -0,0 +1,217 @@
+"""Ingest rules
+
+Rules configuration is JSON/YAML/TOML data structured as::
+
+    databases:
+        <name>:
+            path: <path>
+            low_size: <int>     # optional
+            high_size: <int>    # optional
+    rules:
+        - facility: <name or list of names>     # optional
+          severity: <name or list of names>     # optional
+          hostname: <substring>                 # optional
+          app_name: <substring>                 # optional
+          msgid: <substring>                    # optional
+          msg: <substring>                      # optional
+          action: keep | drop | route
+          database: <name>                      # required for route
+
+Rules are evaluated in order and first rule matching all of its conditions
+determines action applied to message. Messages not matched by any rule are
+kept in main database.
+
+"""
+
+from pathlib import Path
+import enum
+import operator
+import typing
+
+from hat import json
+
+from hat.syslog.server import common
+
+
+main_database: str = 'main'
+"""Name of main database (reserved)"""
+
+Router = typing.Callable[[common.Msg], str | None]
+"""Router returns name of target database or ``None`` if message should be
+dropped"""
+
+
+class Action(enum.Enum):
+    KEEP = 'keep'
+    DROP = 'drop'
+    ROUTE = 'route'
+
+
+class Rule(typing.NamedTuple):
+    action: Action
+    database: str | None = None
+    facilities: frozenset[common.Facility] | None = None
+    severities: frozenset[common.Severity] | None = None
+    hostname: str | None = None
+    app_name: str | None = None
+    msgid: str | None = None
+    msg: str | None = None
+
+
+class DatabaseConf(typing.NamedTuple):
+    path: Path
+    low_size: int | None = None
+    high_size: int | None = None
+
+
+class Conf(typing.NamedTuple):
+    databases: dict[str, DatabaseConf]
+    rules: list[Rule]
+
+
+def load_conf(path: Path) -> Conf:
+    """Load rules configuration from file"""
+    return parse_conf(json.decode_file(path))
+
+
+def parse_conf(data: json.Data) -> Conf:
+    """Parse rules configuration
+
+    Raises:
+        ValueError
+
+    """
+    if not isinstance(data, dict):
+        raise ValueError('invalid configuration')
+
+    databases = {}
+    for name, db_data in data.get('databases', {}).items():
+        if name == main_database:
+            raise ValueError(f'database name {name} is reserved')
+
+        databases[name] = DatabaseConf(
+            path=Path(_get(db_data, 'path', str, required=True)),
+            low_size=_get(db_data, 'low_size', int),
+            high_size=_get(db_data, 'high_size', int))
+
+    rules = []
+    for rule_data in data.get('rules', []):
+        try:
+            action = Action(_get(rule_data, 'action', str, required=True))
+
+        except ValueError:
+            raise ValueError('invalid rule action')
+
+        database = _get(rule_data, 'database', str)
+        if action == Action.ROUTE:
+            if database not in databases:
+                raise ValueError(f'unknown rule database {database}')
+
+        elif database is not None:
+            raise ValueError('database is allowed only for route action')
+
+        rules.append(Rule(
+            action=action,
+            database=database,
+            facilities=_get_enums(rule_data, 'facility', common.Facility),
+            severities=_get_enums(rule_data, 'severity', common.Severity),
+            hostname=_get(rule_data, 'hostname', str),
+            app_name=_get(rule_data, 'app_name', str),
+            msgid=_get(rule_data, 'msgid', str),
+            msg=_get(rule_data, 'msg', str)))
+
+    return Conf(databases=databases,
+                rules=rules)
+
+
+def compile_rules(rules: list[Rule]) -> Router:
+    """Compile rules into router
+
+    For each facility/severity combination, list of applicable rules is
+    precomputed together with their substring conditions. Rules following
+    rule without substring conditions are never reached and are omitted.
+
+    """
+    table = {}
+    for facility in common.Facility:
+        for severity in common.Severity:
+            candidates = []
+
+            for rule in rules:
+                if (rule.facilities is not None and
+                        facility not in rule.facilities):
+                    continue
+
+                if (rule.severities is not None and
+                        severity not in rule.severities):
+                    continue
+
+                checks = []
+                for name in _str_condition_names:
+                    value = getattr(rule, name)
+                    if value is not None:
+                        checks.append((operator.attrgetter(name), value))
+
+                candidates.append((tuple(checks), _get_target(rule)))
+
+                if not checks:
+                    break
+
+            else:
+                candidates.append(((), main_database))
+
+            table[facility, severity] = tuple(candidates)
+
+    def route(msg):
+        for checks, target in table[msg.facility, msg.severity]:
+            for getter, value in checks:
+                field = getter(msg)
+                if not field or value not in field:
+                    break
+
+            else:
+                return target
+
+    return route
+
+
+_str_condition_names = ['hostname', 'app_name', 'msgid', 'msg']
+
+
+def _get_target(rule):
+    if rule.action == Action.KEEP:
+        return main_database
+
+    if rule.action == Action.ROUTE:
+        return rule.database
+
+
+def _get(data, key, cls, required=False):
+    if not isinstance(data, dict):
+        raise ValueError('invalid configuration')
+
+    value = data.get(key)
+    if value is None:
+        if required:
+            raise ValueError(f'missing {key}')
+
+        return
+
+    if not isinstance(value, cls) or isinstance(value, bool):
+        raise ValueError(f'invalid {key}')
+
+    return value
+
+
+def _get_enums(data, key, cls):
+    value = data.get(key)
+    if value is None:
+        return
+
+    names = value if isinstance(value, list) else [value]
+
+    try:
+        return frozenset(cls[name] for name in names)
+
+    except (KeyError, TypeError):
+        raise ValueError(f'invalid {key}')
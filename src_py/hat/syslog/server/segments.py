@@ -0,0 +1,711 @@
+"""Time or size partitioned database segments
+
+Segmented database stores entries in multiple SQLite databases (segments),
+each containing contiguous range of entry ids. Segments are stored in
+directory ``<path>.segments`` with file name ``<first entry id>.db``.
+
+New entries are always added to newest (head) segment. Once head segment
+becomes full (its time period expires or it reaches configured number of
+entries), new head segment is created. Queries are executed on each segment,
+from newest to oldest, until requested number of entries is available.
+
+Oldest segments are removed (or renamed to archive databases) as a whole -
+removal of old entries does not require deletion of individual rows.
+
+Segments other than head segment are kept open (up to `segment_cache_size`
+least recently used segments). Entry timestamp range of each segment is
+remembered once segment is opened, so that queries limited by entry
+timestamps skip segments which don't overlap with query.
+
+"""
+
+from collections.abc import AsyncIterator, Callable, Collection
+from pathlib import Path
+import asyncio
+import collections
+import contextlib
+import enum
+import logging
+import time
+import typing
+
+from hat import aio
+
+from hat.syslog.server import common
+from hat.syslog.server import database
+
+
+mlog: logging.Logger = logging.getLogger(__name__)
+"""Module logger"""
+
+segment_cache_size: int = 8
+"""Maximum number of segments, other than head segment, kept open"""
+
+
+class SegmentPeriod(enum.Enum):
+    HOUR = 'hour'
+    DAY = 'day'
+    SIZE = 'size'
+
+
+class SegmentConf(typing.NamedTuple):
+    period: SegmentPeriod
+    size: int = 0
+    """Maximum number of entries in segment (applicable to size period)"""
+
+
+def parse_segment_conf(conf_str: str) -> SegmentConf:
+    """Parse segment configuration
+
+    Configuration is ``hour``, ``day`` or maximum number of entries in single
+    segment.
+
+    """
+    with contextlib.suppress(ValueError):
+        return SegmentConf(period=SegmentPeriod(conf_str))
+
+    size = int(conf_str)
+    if size < 1:
+        raise ValueError('invalid segment size')
+
+    return SegmentConf(period=SegmentPeriod.SIZE,
+                       size=size)
+
+
+async def create_segmented_database(path: Path,
+                                    conf: SegmentConf,
+                                    disable_journal: bool,
+                                    commit_delay: float = 0,
+                                    settings: database.Settings = database.Settings(),  # NOQA
+                                    read_pool_size: int = 0,
+                                    fts_columns: Collection[str] = (),
+                                    indexes: Collection[str] = ()
+                                    ) -> 'SegmentedDatabase':
+    """Create segmented database
+
+    Arguments other than `conf` have same meaning as arguments of
+    `database.create_database`. Group commit and read pool are used only
+    for head segment.
+
+    """
+    segments_dir = get_segments_dir(path)
+    executor = aio.create_executor(1)
+    segments = await executor(_ext_get_segments, segments_dir)
+
+    db = SegmentedDatabase()
+    db._path = path
+    db._conf = conf
+    db._dir = segments_dir
+    db._disable_journal = disable_journal
+    db._commit_delay = commit_delay
+    db._settings = settings
+    db._read_pool_size = read_pool_size
+    db._fts_columns = fts_columns
+    db._indexes = indexes
+    db._executor = executor
+    db._async_group = aio.Group()
+    db._segments = segments
+    db._segments_lock = asyncio.Lock()
+    db._vacuum_segments = set()
+    db._unused_values_segments = set()
+    db._opened = collections.OrderedDict()
+    db._timestamp_ranges = {}
+    db._query_stats = database.QueryStatsCollector()
+    db._head = None
+    db._head_period = None
+    db._last_id = None
+
+    db._async_group.spawn(aio.call_on_cancel, db._close)
+
+    try:
+        if segments:
+            await db._open_head()
+
+    except BaseException:
+        await aio.uncancellable(db.async_close())
+        raise
+
+    mlog.debug('opened segmented database %s (segments: %s)',
+               path, len(segments))
+    return db
+
+
+def get_segments_dir(path: Path) -> Path:
+    """Get directory containing segments of database `path`"""
+    return path.with_name(f'{path.name}.segments')
+
+
+class SegmentedDatabase(aio.Resource):
+
+    @property
+    def async_group(self) -> aio.Group:
+        """Async group"""
+        return self._async_group
+
+    @property
+    def query_stats(self) -> database.QueryStatsCollector:
+        """Query statistics
+
+        Query of each segment is added to statistics as separate query.
+
+        """
+        return self._query_stats
+
+    @property
+    def fts_columns(self) -> list[str]:
+        """Names of columns included in full-text index"""
+        return list(self._fts_columns)
+
+    @property
+    def segment_count(self) -> int:
+        """Number of segments"""
+        return len(self._segments)
+
+    async def wait_committed(self):
+        """Wait until all previously added messages are committed
+
+        Raises:
+            ConnectionError
+
+        """
+        if self._head:
+            await self._head.wait_committed()
+
+    async def get_first_id(self) -> int | None:
+        """Get first entry id"""
+        return self._segments[0] if self._segments else None
+
+    async def get_last_id(self) -> int | None:
+        """Get last entry id"""
+        return self._last_id
+
+    async def get_last_id_before(self, timestamp: float) -> int | None:
+        """Get id of latest entry with entry timestamp prior to `timestamp`
+
+        Segments are searched from oldest to newest - search stops at first
+        segment containing entries with entry timestamp not prior to
+        `timestamp`.
+
+        """
+        result = None
+        segments = list(self._segments)
+
+        for i, first_id in enumerate(segments):
+            async with self._open_segment(first_id) as db:
+                if db is None:
+                    continue
+
+                last_id = await db.get_last_id_before(timestamp)
+
+            if last_id is None:
+                break
+
+            result = last_id
+            segment_last_id = (segments[i + 1] - 1 if i + 1 < len(segments)
+                               else self._last_id)
+            if last_id != segment_last_id:
+                break
+
+        return result
+
+    async def get_size(self) -> int:
+        """Get size of all segment files"""
+        return await self._async_group.spawn(
+            self._executor, _ext_get_size, self._dir, list(self._segments))
+
+    async def add_msgs(self,
+                       msgs: list[tuple[float, common.Msg]]
+                       ) -> list[common.Entry]:
+        """Add timestamped messages
+
+        If messages belong to different segment periods, they are split
+        between multiple segments.
+
+        """
+        entries = []
+
+        while len(entries) < len(msgs):
+            period = self._get_period(msgs[len(entries)][0])
+            if self._head is None or self._is_head_full(period):
+                await self._create_head(period)
+
+            segment_entries = []
+            for timestamp, msg in msgs[len(entries):]:
+                if self._get_period(timestamp) != period:
+                    break
+
+                if (self._conf.period == SegmentPeriod.SIZE and
+                        (self._last_id - self._segments[-1] + 1 +
+                         len(segment_entries)) >= self._conf.size):
+                    break
+
+                segment_entries.append(common.Entry(
+                    id=self._last_id + 1 + len(segment_entries),
+                    timestamp=timestamp,
+                    msg=msg))
+
+            await self._head.add_entries(segment_entries)
+            self._last_id = segment_entries[-1].id
+            self._extend_timestamp_range(self._segments[-1],
+                                         segment_entries)
+            entries.extend(segment_entries)
+
+        return entries
+
+    async def delete_severity(self,
+                              severity: common.Severity,
+                              start_id: int,
+                              end_id: int,
+                              summarize: bool = False
+                              ) -> int:
+        """Delete entries with `severity` and ids in range [start_id, end_id)
+
+        See `database.Database.delete_severity`. Summaries are stored in
+        segment containing deleted entries.
+
+        """
+        entry_count = 0
+        segments = list(self._segments)
+
+        for i, first_id in enumerate(segments):
+            segment_end_id = (segments[i + 1] if i + 1 < len(segments)
+                              else None)
+            if segment_end_id is not None and segment_end_id <= start_id:
+                continue
+            if first_id >= end_id:
+                break
+
+            async with self._open_segment(first_id) as db:
+                if db is None:
+                    continue
+
+                segment_count = await db.delete_severity(
+                    severity, start_id, end_id, summarize)
+
+            if segment_count:
+                self._vacuum_segments.add(first_id)
+                self._unused_values_segments.add(first_id)
+            entry_count += segment_count
+
+        return entry_count
+
+    async def query_summaries(self,
+                              entry_timestamp_from: float | None = None,
+                              entry_timestamp_to: float | None = None
+                              ) -> list[common.Summary]:
+        """Query summaries of deleted entries ordered by timestamp
+
+        Summaries from all segments are merged.
+
+        """
+        counts = {}
+
+        for first_id in list(self._segments):
+            async with self._open_segment(first_id) as db:
+                if db is None:
+                    continue
+
+                summaries = await db.query_summaries(entry_timestamp_from,
+                                                     entry_timestamp_to)
+
+            for summary in summaries:
+                key = summary._replace(count=0)
+                counts[key] = counts.get(key, 0) + summary.count
+
+        return sorted((key._replace(count=count)
+                       for key, count in counts.items()),
+                      key=lambda i: i.timestamp)
+
+    async def query(self,
+                    filter: common.Filter,
+                    timeout: float | None = None
+                    ) -> list[common.Entry]:
+        """Query entries that satisfy filter
+
+        Segments are queried from newest to oldest until `filter.max_results`
+        entries are found. Timeout is applied to queries of all segments
+        together (see `database.Database.query`).
+
+        Raises:
+            database.QueryTimeoutError
+
+        """
+        deadline = (time.monotonic() + timeout if timeout is not None
+                    else None)
+        entries = []
+
+        for first_id in reversed(list(self._segments)):
+            remaining = (filter.max_results - len(entries)
+                         if filter.max_results is not None else None)
+            if remaining is not None and remaining < 1:
+                break
+
+            if not self._is_overlapping(first_id, filter):
+                continue
+
+            segment_filter = filter._replace(max_results=remaining)
+            segment_timeout = (max(deadline - time.monotonic(), 0)
+                               if deadline is not None else None)
+
+            async with self._open_segment(first_id) as db:
+                if db is None:
+                    continue
+
+                try:
+                    entries.extend(await db.query(segment_filter,
+                                                  segment_timeout))
+
+                except database.QueryTimeoutError as e:
+                    raise database.QueryTimeoutError(entries + e.entries)
+
+        return entries
+
+    async def iter_query(self,
+                         filter: common.Filter,
+                         chunk_size: int = 1024
+                         ) -> AsyncIterator[common.Entry]:
+        """Iterate over entries that satisfy filter
+
+        See `database.Database.iter_query`.
+
+        """
+        remaining = filter.max_results
+
+        for first_id in reversed(list(self._segments)):
+            if remaining is not None and remaining < 1:
+                break
+
+            if not self._is_overlapping(first_id, filter):
+                continue
+
+            segment_filter = filter._replace(max_results=remaining)
+
+            async with self._open_segment(first_id) as db:
+                if db is None:
+                    continue
+
+                async for entry in db.iter_query(segment_filter, chunk_size):
+                    yield entry
+
+                    if remaining is not None:
+                        remaining -= 1
+
+    async def explain_query(self,
+                            filter: common.Filter
+                            ) -> list[str]:
+        """Get query plan used for querying head segment"""
+        if self._head is None:
+            return []
+
+        return await self._head.explain_query(filter)
+
+    async def get_page_stats(self) -> database.PageStats:
+        """Get page statistics summed over all segments
+
+        Page size of first segment is used as resulting page size.
+
+        """
+        result = None
+
+        for first_id in list(self._segments):
+            async with self._open_segment(first_id) as db:
+                if db is None:
+                    continue
+
+                stats = await db.get_page_stats()
+
+            result = (result._replace(
+                page_count=result.page_count + stats.page_count,
+                freelist_count=result.freelist_count + stats.freelist_count)
+                if result else stats)
+
+        return result or database.PageStats(page_size=0,
+                                            page_count=0,
+                                            freelist_count=0)
+
+    async def incremental_vacuum(self, max_pages: int) -> int:
+        """Return up to `max_pages` free pages to file system
+
+        Free pages are created only by `delete_severity` (removed segment
+        files are deleted as a whole) - only segments with deleted entries
+        are vacuumed. Number of returned pages is returned.
+
+        """
+        page_count = 0
+
+        for first_id in sorted(self._vacuum_segments):
+            if page_count >= max_pages:
+                break
+
+            async with self._open_segment(first_id) as db:
+                if db is None:
+                    self._vacuum_segments.discard(first_id)
+                    continue
+
+                remaining = max_pages - page_count
+                segment_page_count = await db.incremental_vacuum(remaining)
+
+            if segment_page_count < remaining:
+                self._vacuum_segments.discard(first_id)
+            page_count += segment_page_count
+
+        return page_count
+
+    async def delete_unused_values(self, chunk_size: int = 16 * 1024
+                                   ) -> int:
+        """Delete interned values not referenced by any entry or summary
+
+        Values are deleted only in segments with entries deleted by
+        `delete_severity` (removed segment files are deleted as a whole).
+        Number of deleted values is returned.
+
+        """
+        value_count = 0
+
+        for first_id in sorted(self._unused_values_segments):
+            async with self._open_segment(first_id) as db:
+                if db is not None:
+                    value_count += await db.delete_unused_values(chunk_size)
+
+            self._unused_values_segments.discard(first_id)
+
+        return value_count
+
+    async def remove_segments(self,
+                              first_id: int,
+                              archive_segment: Callable[[Path], Path] | None = None  # NOQA
+                              ) -> int:
+        """Remove segments containing only entries prior to `first_id`
+
+        If `archive_segment` is provided, it is called (in executor thread)
+        with path of each removed segment file instead of deleting segment
+        file. It should move segment file into archive and return resulting
+        archive path. Resulting number of removed segments is returned.
+
+        """
+        count = 0
+
+        while self._segments:
+            segment_last_id = (self._segments[1] - 1
+                               if len(self._segments) > 1 else self._last_id)
+            if segment_last_id is None or segment_last_id >= first_id:
+                break
+
+            async with self._segments_lock:
+                segment_first_id = self._segments.pop(0)
+                self._timestamp_ranges.pop(segment_first_id, None)
+
+                if not self._segments and self._head:
+                    head, self._head = self._head, None
+                    self._head_period = None
+                    await aio.uncancellable(head.async_close())
+
+                # segment in use is closed once it is released
+                opened = self._opened.pop(segment_first_id, None)
+                if opened and not opened.refs:
+                    await aio.uncancellable(opened.db.async_close())
+
+                archive_path = await self._async_group.spawn(
+                    self._executor, _ext_remove_segment, self._dir,
+                    segment_first_id, archive_segment)
+
+            if archive_path:
+                mlog.debug("segment %s archived to %s", segment_first_id,
+                           archive_path)
+
+            else:
+                mlog.debug("segment %s removed", segment_first_id)
+
+            count += 1
+
+        return count
+
+    def _is_overlapping(self, first_id, filter):
+        if filter.last_id is not None and filter.last_id < first_id:
+            return False
+
+        if first_id not in self._timestamp_ranges:
+            return True
+
+        timestamp_range = self._timestamp_ranges[first_id]
+        if timestamp_range is None:
+            return False
+
+        min_timestamp, max_timestamp = timestamp_range
+
+        if (filter.entry_timestamp_from is not None and
+                max_timestamp < filter.entry_timestamp_from):
+            return False
+
+        if (filter.entry_timestamp_to is not None and
+                min_timestamp > filter.entry_timestamp_to):
+            return False
+
+        return True
+
+    def _extend_timestamp_range(self, first_id, entries):
+        timestamps = [entry.timestamp for entry in entries]
+        timestamp_range = self._timestamp_ranges.get(first_id)
+        if timestamp_range:
+            timestamps.extend(timestamp_range)
+
+        self._timestamp_ranges[first_id] = min(timestamps), max(timestamps)
+
+    def _get_period(self, timestamp):
+        if self._conf.period == SegmentPeriod.HOUR:
+            return int(timestamp // 3600)
+
+        if self._conf.period == SegmentPeriod.DAY:
+            return int(timestamp // (24 * 3600))
+
+    def _is_head_full(self, period):
+        if self._conf.period == SegmentPeriod.SIZE:
+            return (self._last_id - self._segments[-1] + 1 >=
+                    self._conf.size)
+
+        return period != self._head_period
+
+    async def _open_head(self):
+        first_id = self._segments[-1]
+        self._head = await self._create_database(first_id, True)
+
+        last_id = await self._head.get_last_id()
+        self._last_id = last_id if last_id is not None else first_id - 1
+        self._timestamp_ranges[first_id] = \
+            await self._head.get_timestamp_range()
+
+        entries = await self._head.query(common.Filter(max_results=1))
+        self._head_period = (self._get_period(entries[0].timestamp)
+                             if entries else None)
+
+    async def _create_head(self, period):
+        first_id = self._last_id + 1 if self._last_id is not None else 1
+
+        async with self._segments_lock:
+            if self._head:
+                head, self._head = self._head, None
+                await aio.uncancellable(head.async_close())
+
+            self._head = await self._create_database(first_id, True)
+            self._head_period = period
+            self._last_id = first_id - 1
+            self._timestamp_ranges[first_id] = None
+
+            if not self._segments or self._segments[-1] != first_id:
+                self._segments.append(first_id)
+
+        mlog.debug("created new head segment %s", first_id)
+
+    @contextlib.asynccontextmanager
+    async def _open_segment(self, first_id):
+        async with self._segments_lock:
+            if first_id not in self._segments:
+                db = None
+
+            elif self._head and first_id == self._segments[-1]:
+                db = self._head
+
+            else:
+                opened = self._opened.get(first_id)
+                if opened is None:
+                    opened = _OpenedSegment(
+                        await self._create_database(first_id, False))
+                    self._opened[first_id] = opened
+
+                if first_id not in self._timestamp_ranges:
+                    self._timestamp_ranges[first_id] = \
+                        await opened.db.get_timestamp_range()
+
+                self._opened.move_to_end(first_id)
+                opened.refs += 1
+                db = opened.db
+
+        if db is None or db is self._head:
+            yield db
+            return
+
+        try:
+            yield db
+
+        finally:
+            opened.refs -= 1
+            await aio.uncancellable(self._close_segments(first_id, opened))
+
+    async def _close_segments(self, first_id, opened):
+        async with self._segments_lock:
+            # segment removed while it was in use
+            if self._opened.get(first_id) is not opened and not opened.refs:
+                await opened.db.async_close()
+
+            for first_id, opened in list(self._opened.items()):
+                if len(self._opened) <= segment_cache_size:
+                    break
+
+                if opened.refs:
+                    continue
+
+                del self._opened[first_id]
+                await opened.db.async_close()
+
+    async def _create_database(self, first_id, is_head):
+        return await database.create_database(
+            path=self._dir / f'{first_id}.db',
+            disable_journal=self._disable_journal,
+            commit_delay=self._commit_delay if is_head else 0,
+            settings=self._settings,
+            read_pool_size=self._read_pool_size if is_head else 0,
+            fts_columns=self._fts_columns,
+            indexes=self._indexes,
+            query_stats=self._query_stats)
+
+    async def _close(self):
+        for opened in self._opened.values():
+            await opened.db.async_close()
+
+        if self._head:
+            await self._head.async_close()
+
+        mlog.debug('segmented database %s closed', self._path)
+
+
+class _OpenedSegment:
+
+    def __init__(self, db):
+        self.db = db
+        self.refs = 0
+
+
+def _ext_get_segments(segments_dir):
+    segments = []
+
+    if segments_dir.exists():
+        for i in segments_dir.glob('*.db'):
+            with contextlib.suppress(ValueError):
+                segments.append(int(i.stem))
+
+    return sorted(segments)
+
+
+def _ext_get_size(segments_dir, segments):
+    size = 0
+
+    for first_id in segments:
+        path = segments_dir / f'{first_id}.db'
+        for suffix in ['', '-journal', '-wal']:
+            with contextlib.suppress(FileNotFoundError):
+                size += path.with_name(path.name + suffix).stat().st_size
+
+    return size
+
+
+def _ext_remove_segment(segments_dir, first_id, archive_segment):
+    path = segments_dir / f'{first_id}.db'
+
+    if archive_segment:
+        return archive_segment(path)
+
+    path.unlink()
+
+    # journal files left by unclean shutdown
+    for suffix in ['-journal', '-wal', '-shm']:
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
@@ -2,9 +2,12 @@
 
 from pathlib import Path
 import asyncio.sslproto
+import collections
 import contextlib
+import enum
 import logging
 import ssl
+import time
 import typing
 import urllib.parse
 
@@ -12,61 +15,190 @@ from hat import aio
 
 from hat.syslog.server import common
 from hat.syslog.server import encoder
+from hat.syslog.server import ratelimit
 
 
 mlog: logging.Logger = logging.getLogger(__name__)
 """Module logger"""
 
+udp_receive_queue_size: int = 1024
+"""UDP receive queue size"""
+
+stats_log_interval: float = 60
+"""Statistics log interval in seconds (statistics are logged only if they
+changed since previous log)"""
+
 MsgCb = aio.AsyncCallable[[common.Msg], None]
 
+SyncCb = aio.AsyncCallable[[], None]
+"""Sync callback returns once all previously received messages are stored"""
+
 SyslogServer = typing.Union['TcpSyslogServer', 'UdpSyslogServer']
 
 
+class FramePolicy(enum.Enum):
+    """Policy applied to frames larger than maximum frame size"""
+    TRUNCATE = 'truncate'
+    """Frame is truncated to maximum frame size"""
+    REJECT = 'reject'
+    """Frame is dropped (TCP connection is closed)"""
+
+
+class Limits(typing.NamedTuple):
+    """Syslog server limits
+
+    Value ``0`` represents unlimited number of connections and disabled idle
+    timeout.
+
+    """
+    max_frame_size: int = 64 * 1024
+    """Maximum frame size in bytes"""
+    frame_policy: FramePolicy = FramePolicy.TRUNCATE
+    """Policy applied to frames larger than `max_frame_size`"""
+    max_connections: int = 0
+    """Maximum number of concurrent TCP connections"""
+    max_host_connections: int = 0
+    """Maximum number of concurrent TCP connections per source address"""
+    idle_timeout: float = 0
+    """TCP connection idle read timeout in seconds"""
+
+
+class Stats(typing.NamedTuple):
+    """Syslog server statistics"""
+    stall_time: float = 0
+    """Cumulative time (in seconds) during which reading was paused"""
+    dropped: int = 0
+    """Number of dropped messages"""
+    connections: int = 0
+    """Number of currently open TCP connections"""
+    rejected_connections: int = 0
+    """Number of TCP connections rejected due to connection limits"""
+    idle_timeouts: int = 0
+    """Number of TCP connections closed due to idle timeout"""
+    truncated_frames: int = 0
+    """Number of frames truncated to maximum frame size"""
+    rejected_frames: int = 0
+    """Number of frames rejected due to maximum frame size or invalid octet
+    count"""
+    rate_limited: int = 0
+    """Number of messages dropped by rate limiter"""
+
+
 async def create_syslog_server(addr: str,
                                msg_cb: MsgCb,
-                               pem_path: Path | None
+                               pem_path: Path | None,
+                               limits: Limits = Limits(),
+                               limiter: ratelimit.RateLimiter | None = None,
+                               sync_cb: SyncCb | None = None
                                ) -> SyslogServer:
-    """Create syslog server"""
+    """Create syslog server
+
+    Supported address schemes are ``tcp``, ``tls``, ``udp`` and ``relp``.
+
+    If `limiter` is provided, messages not allowed by rate limiter are
+    dropped.
+
+    In case of ``relp`` server, each received message is acknowledged once
+    `sync_cb` (called after message is passed to `msg_cb`) returns.
+    Single `sync_cb` call is used for acknowledging all messages received
+    in the meantime.
+
+    """
     addr = urllib.parse.urlparse(addr)
 
     if addr.scheme == 'tls':
         ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         ssl_ctx.load_cert_chain(pem_path)
         return await _create_tcp_syslog_server(addr.hostname, addr.port,
-                                               msg_cb, ssl_ctx)
+                                               msg_cb, limits, limiter,
+                                               False, None, ssl_ctx)
 
     if addr.scheme == 'tcp':
         return await _create_tcp_syslog_server(addr.hostname, addr.port,
-                                               msg_cb, None)
+                                               msg_cb, limits, limiter,
+                                               False, None, None)
+
+    if addr.scheme == 'relp':
+        return await _create_tcp_syslog_server(addr.hostname, addr.port,
+                                               msg_cb, limits, limiter,
+                                               True, sync_cb, None)
 
     if addr.scheme == 'udp':
         return await _create_udp_syslog_server(addr.hostname, addr.port,
-                                               msg_cb)
+                                               msg_cb, limits, limiter)
 
     raise ValueError('unsupported address')
 
 
-async def _create_tcp_syslog_server(host, port, msg_cb, ssl_ctx):
+async def _create_tcp_syslog_server(host, port, msg_cb, limits, limiter,
+                                    relp, sync_cb, ssl_ctx):
     server = TcpSyslogServer()
     server._msg_cb = msg_cb
+    server._limits = limits
+    server._limiter = limiter
+    server._relp = relp
+    server._sync_cb = sync_cb
     server._async_group = aio.Group()
+    server._flow = _FlowControl()
+    server._counters = collections.Counter()
+    server._transports = set()
+    server._host_connections = collections.Counter()
 
     server._srv = await asyncio.start_server(server._on_client, host, port,
-                                             ssl=ssl_ctx)
+                                             ssl=ssl_ctx,
+                                             limit=limits.max_frame_size)
     server.async_group.spawn(aio.call_on_cancel, server._on_close)
+    scheme = 'relp' if relp else 'tls' if ssl_ctx else 'tcp'
+    server.async_group.spawn(_stats_log_loop, server,
+                             f'{scheme} {host}:{port}')
 
     mlog.debug('listening for tcp syslog clients on %s:%s', host, port)
     return server
 
 
 class TcpSyslogServer(aio.Resource):
-    """TCP syslog server"""
+    """TCP syslog server (also used for RELP)"""
 
     @property
     def async_group(self) -> aio.Group:
         """Async group"""
         return self._async_group
 
+    @property
+    def is_paused(self) -> bool:
+        """Is reading paused"""
+        return self._flow.is_paused
+
+    @property
+    def stats(self) -> Stats:
+        """Statistics"""
+        return Stats(stall_time=self._flow.stall_time,
+                     connections=len(self._transports),
+                     **self._counters)
+
+    def pause_reading(self):
+        """Pause reading from all client connections"""
+        if not self._flow.pause():
+            return
+
+        for transport in self._transports:
+            with contextlib.suppress(Exception):
+                transport.pause_reading()
+
+        mlog.debug('tcp reading paused')
+
+    def resume_reading(self):
+        """Resume reading from all client connections"""
+        if not self._flow.resume():
+            return
+
+        for transport in self._transports:
+            with contextlib.suppress(Exception):
+                transport.resume_reading()
+
+        mlog.debug('tcp reading resumed (stall time: %s)',
+                   self._flow.stall_time)
+
     async def _on_close(self):
         with contextlib.suppress(Exception):
             self._srv.close()
@@ -81,33 +213,55 @@ class TcpSyslogServer(aio.Resource):
             writer.close()
 
     async def _client_loop(self, reader, writer):
-        try:
-            while True:
-                start = await reader.readexactly(1)
-
-                if start == b'<':
-                    buff_rest = await reader.readuntil(b'\n')
-
-                    buff = start + buff_rest[:-1]
+        transport = writer.transport
+        host = _get_peer_host(writer)
+
+        # connection is registered only once client loop is started (prior
+        # to first await), so that registration can not be leaked
+        if ((self._limits.max_connections and
+                len(self._transports) >= self._limits.max_connections) or
+                (self._limits.max_host_connections and
+                 self._host_connections[host] >=
+                 self._limits.max_host_connections)):
+            mlog.warning('rejecting tcp connection from %s: '
+                         'connection limit reached', host)
+            self._counters['rejected_connections'] += 1
+            writer.close()
+            return
 
-                else:
-                    size_rest = await reader.readuntil(b' ')
-                    size = int(start + size_rest[:-1])
+        self._transports.add(transport)
+        self._host_connections[host] += 1
 
-                    buff = await reader.readexactly(size)
+        try:
+            if self._flow.is_paused:
+                transport.pause_reading()
 
-                msg = encoder.msg_from_str(buff.decode())
-                mlog.debug("received new syslog message")
+            if self._relp:
+                await self._receive_relp(reader, writer, host)
 
-                await aio.call(self._msg_cb, msg)
+            else:
+                await self._receive_syslog(reader, transport, host)
 
         except asyncio.IncompleteReadError:
             pass
 
+        except asyncio.TimeoutError:
+            mlog.debug('closing idle tcp client connection')
+            self._counters['idle_timeouts'] += 1
+
+        except _FrameRejectedError as e:
+            mlog.warning('closing tcp client connection: %s', e)
+            self._counters['rejected_frames'] += 1
+
         except Exception as e:
             mlog.error('tcp client error: %s', e, exc_info=e)
 
         finally:
+            self._transports.discard(transport)
+            self._host_connections[host] -= 1
+            if not self._host_connections[host]:
+                del self._host_connections[host]
+
             with contextlib.suppress(Exception):
                 writer.close()
 
@@ -119,16 +273,266 @@ class TcpSyslogServer(aio.Resource):
                 await aio.uncancellable(asyncio.sleep(0.001))
 
             else:
-                await aio.uncancellable(writer.wait_closed())
+                with contextlib.suppress(ConnectionError):
+                    await aio.uncancellable(writer.wait_closed())
 
             mlog.debug('tcp client connection closed')
 
+    async def _receive_syslog(self, reader, transport, host):
+        while True:
+            buff, truncated = await self._read_frame(reader)
+
+            errors = 'ignore' if truncated else 'strict'
+
+            try:
+                msg = encoder.msg_from_str(buff.decode(errors=errors))
+
+            except Exception:
+                if not truncated:
+                    raise
+
+                mlog.debug("dropping unparsable truncated message")
+                self._counters['dropped'] += 1
+                continue
+
+            mlog.debug("received new syslog message")
+
+            if self._limiter and not self._limiter.check(host, msg):
+                self._counters['rate_limited'] += 1
+                continue
+
+            await aio.call(self._msg_cb, msg)
+
+            # stream reader can resume transport on its own
+            if self._flow.is_paused and transport.is_reading():
+                transport.pause_reading()
+
+    async def _receive_relp(self, reader, writer, host):
+        transport = writer.transport
+        responses = aio.Queue()
+        async_group = self.async_group.create_subgroup()
+
+        try:
+            send_future = async_group.spawn(self._relp_send_loop, writer,
+                                            responses)
+            is_open = False
+
+            while True:
+                txnr, command, data = await self._read_relp_frame(reader)
+
+                if command == b'open':
+                    is_open = True
+                    responses.put_nowait((txnr, False, _relp_open_rsp))
+                    continue
+
+                if not is_open:
+                    raise Exception('relp session not open')
+
+                if command == b'close':
+                    responses.put_nowait((txnr, False, b'200 OK'))
+                    break
+
+                if command != b'syslog':
+                    responses.put_nowait(
+                        (txnr, False, b'500 unsupported command'))
+                    continue
+
+                try:
+                    msg = encoder.msg_from_str(data.decode().rstrip('\n'))
+
+                except Exception as e:
+                    mlog.debug("dropping unparsable relp message: %s", e)
+                    self._counters['dropped'] += 1
+                    responses.put_nowait((txnr, False, b'500 invalid message'))
+                    continue
+
+                mlog.debug("received new relp message")
+
+                # rate limited messages are acknowledged to prevent
+                # retransmission
+                if self._limiter and not self._limiter.check(host, msg):
+                    self._counters['rate_limited'] += 1
+                    responses.put_nowait((txnr, False, b'200 OK'))
+                    continue
+
+                await aio.call(self._msg_cb, msg)
+                responses.put_nowait((txnr, True, b'200 OK'))
+
+                # stream reader can resume transport on its own
+                if self._flow.is_paused and transport.is_reading():
+                    transport.pause_reading()
+
+            responses.close()
+            await send_future
+
+        finally:
+            responses.close()
+            await aio.uncancellable(async_group.async_close())
+
+    async def _relp_send_loop(self, writer, responses):
+        try:
+            while True:
+                items = [await responses.get()]
+                while not responses.empty():
+                    items.append(responses.get_nowait())
+
+                if self._sync_cb and any(sync for _, sync, _ in items):
+                    await aio.call(self._sync_cb)
+
+                for txnr, _, data in items:
+                    writer.write(_encode_relp_frame(txnr, b'rsp', data))
+
+                await writer.drain()
+
+        except aio.QueueClosedError:
+            pass
+
+        except Exception as e:
+            mlog.debug('relp send loop error: %s', e, exc_info=e)
+            writer.close()
+
+    async def _read_relp_frame(self, reader):
+        txnr_bytes = await self._read(reader.readuntil(b' '))
+        txnr = int(txnr_bytes[:-1])
+
+        command_bytes = await self._read(reader.readuntil(b' '))
+        command = command_bytes[:-1]
+
+        datalen_bytes = b''
+        while True:
+            c = await self._read(reader.readexactly(1))
+            if c == b' ' or c == b'\n':
+                break
+
+            if len(datalen_bytes) >= 9:
+                raise Exception('invalid relp data length')
+
+            datalen_bytes += c
+
+        datalen = int(datalen_bytes)
+        if datalen > self._limits.max_frame_size:
+            raise _FrameRejectedError('frame size limit exceeded')
+
+        if c == b'\n':
+            if datalen:
+                raise Exception('missing relp data')
 
-async def _create_udp_syslog_server(host, port, msg_cb):
+            return txnr, command, b''
+
+        data = await self._read(reader.readexactly(datalen))
+
+        trailer = await self._read(reader.readexactly(1))
+        if trailer != b'\n':
+            raise Exception('invalid relp trailer')
+
+        return txnr, command, data
+
+    async def _read_frame(self, reader):
+        max_frame_size = self._limits.max_frame_size
+        truncate = self._limits.frame_policy == FramePolicy.TRUNCATE
+
+        start = await self._read(reader.readexactly(1))
+
+        if start == b'<':
+            try:
+                buff_rest = await self._read(reader.readuntil(b'\n'))
+                return start + buff_rest[:-1], False
+
+            except asyncio.LimitOverrunError:
+                if not truncate:
+                    raise _FrameRejectedError('frame size limit exceeded')
+
+            buff_rest = await self._read(
+                reader.readexactly(max_frame_size - 1))
+            await self._skip_line(reader)
+
+            self._counters['truncated_frames'] += 1
+            return start + buff_rest, True
+
+        size_rest = await self._read(reader.readuntil(b' '))
+        size_bytes = start + size_rest[:-1]
+
+        # frame with invalid octet count can not be truncated - remaining
+        # line is skipped and frame is dropped as unparsable
+        if not size_bytes.isdigit():
+            if not truncate:
+                raise _FrameRejectedError('invalid octet count')
+
+            await self._skip_line(reader)
+            return b'', True
+
+        size = int(size_bytes)
+        if size <= max_frame_size:
+            buff = await self._read(reader.readexactly(size))
+            return buff, False
+
+        if not truncate:
+            raise _FrameRejectedError('frame size limit exceeded')
+
+        buff = await self._read(reader.readexactly(max_frame_size))
+
+        rest_size = size - max_frame_size
+        while rest_size > 0:
+            rest = await self._read(
+                reader.read(min(rest_size, max_frame_size)))
+            if not rest:
+                raise asyncio.IncompleteReadError(b'', rest_size)
+
+            rest_size -= len(rest)
+
+        self._counters['truncated_frames'] += 1
+        return buff, True
+
+    async def _skip_line(self, reader):
+        while True:
+            try:
+                await self._read(reader.readuntil(b'\n'))
+                break
+
+            except asyncio.LimitOverrunError as e:
+                await self._read(reader.readexactly(e.consumed))
+
+    async def _read(self, coro):
+        if not self._limits.idle_timeout:
+            return await coro
+
+        # idle timeout is measured from read start or from last reading
+        # resume (client is not idle while reading is paused)
+        start = time.monotonic()
+        task = asyncio.ensure_future(coro)
+
+        try:
+            while not task.done():
+                if self._flow.is_paused:
+                    timeout = self._limits.idle_timeout
+
+                else:
+                    idle_since = max(start, self._flow.resume_time or start)
+                    timeout = (idle_since + self._limits.idle_timeout -
+                               time.monotonic())
+                    if timeout <= 0:
+                        raise asyncio.TimeoutError()
+
+                await asyncio.wait([task], timeout=timeout)
+
+            return task.result()
+
+        finally:
+            if not task.done():
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await aio.uncancellable(task)
+
+
+async def _create_udp_syslog_server(host, port, msg_cb, limits, limiter):
     server = UdpSyslogServer()
     server._msg_cb = msg_cb
-    server._receive_queue = aio.Queue()
+    server._limits = limits
+    server._limiter = limiter
+    server._receive_queue = aio.Queue(udp_receive_queue_size)
     server._async_group = aio.Group()
+    server._flow = _FlowControl()
+    server._counters = collections.Counter()
 
     class Protocol(asyncio.DatagramProtocol):
 
@@ -138,13 +542,23 @@ async def _create_udp_syslog_server(host, port, msg_cb):
         def datagram_received(self, data, addr):
             if server._receive_queue.is_closed:
                 return
-            server._receive_queue.put_nowait(data)
+
+            if server._flow.is_paused:
+                server._counters['dropped'] += 1
+                return
+
+            try:
+                server._receive_queue.put_nowait((data, addr[0]))
+
+            except aio.QueueFullError:
+                server._counters['dropped'] += 1
 
     loop = asyncio.get_running_loop()
     server._transport, server._protocol = \
         await loop.create_datagram_endpoint(Protocol, (host, port), None)
     server.async_group.spawn(aio.call_on_cancel, server._on_close)
     server.async_group.spawn(server._receive_loop)
+    server.async_group.spawn(_stats_log_loop, server, f'udp {host}:{port}')
 
     mlog.debug('listening for udp syslog messages on %s:%s', host, port)
     return server
@@ -158,20 +572,76 @@ class UdpSyslogServer(aio.Resource):
         """Async group"""
         return self._async_group
 
+    @property
+    def is_paused(self) -> bool:
+        """Is reading paused
+
+        While reading is paused, all received datagrams are dropped.
+
+        """
+        return self._flow.is_paused
+
+    @property
+    def stats(self) -> Stats:
+        """Statistics"""
+        return Stats(stall_time=self._flow.stall_time,
+                     **self._counters)
+
+    def pause_reading(self):
+        """Pause reading (drop all received datagrams)"""
+        if self._flow.pause():
+            mlog.debug('udp reading paused')
+
+    def resume_reading(self):
+        """Resume reading"""
+        if self._flow.resume():
+            mlog.debug('udp reading resumed (stall time: %s; dropped: %s)',
+                       self._flow.stall_time, self._counters['dropped'])
+
     def _on_close(self):
         with contextlib.suppress(Exception):
             self._transport.close()
 
     async def _receive_loop(self):
+        max_frame_size = self._limits.max_frame_size
+        truncate = self._limits.frame_policy == FramePolicy.TRUNCATE
+
         try:
             while True:
                 try:
-                    msg_bytes = await self._receive_queue.get()
-                    msg = encoder.msg_from_str(msg_bytes.decode())
+                    msg_bytes, host = await self._receive_queue.get()
+                    truncated = len(msg_bytes) > max_frame_size
+
+                    if truncated:
+                        if not truncate:
+                            mlog.debug('dropping datagram: '
+                                       'frame size limit exceeded')
+                            self._counters['rejected_frames'] += 1
+                            continue
+
+                        msg_bytes = msg_bytes[:max_frame_size]
+                        self._counters['truncated_frames'] += 1
+
+                    try:
+                        msg = encoder.msg_from_str(msg_bytes.decode(
+                            errors='ignore' if truncated else 'strict'))
+
+                    except Exception:
+                        self._counters['dropped'] += 1
+                        raise
+
                     mlog.debug("received new syslog message")
 
+                    if (self._limiter and
+                            not self._limiter.check(host, msg)):
+                        self._counters['rate_limited'] += 1
+                        continue
+
                     await aio.call(self._msg_cb, msg)
 
+                except aio.QueueClosedError:
+                    raise
+
                 except Exception as e:
                     mlog.error('udp client error: %s', e, exc_info=e)
 
@@ -181,3 +651,85 @@ class UdpSyslogServer(aio.Resource):
         finally:
             self.close()
             self._receive_queue.close()
+
+
+class _FrameRejectedError(Exception):
+    pass
+
+
+_relp_open_rsp = (b'200 OK\n'
+                  b'relp_version=0\n'
+                  b'relp_software=hat-syslog\n'
+                  b'commands=syslog')
+
+
+def _encode_relp_frame(txnr, command, data):
+    header = b'%d %s %d' % (txnr, command, len(data))
+    if not data:
+        return header + b'\n'
+
+    return header + b' ' + data + b'\n'
+
+
+class _FlowControl:
+
+    def __init__(self):
+        self._paused_since = None
+        self._resume_time = None
+        self._stall_time = 0
+
+    @property
+    def is_paused(self):
+        return self._paused_since is not None
+
+    @property
+    def resume_time(self):
+        return self._resume_time
+
+    @property
+    def stall_time(self):
+        if self._paused_since is None:
+            return self._stall_time
+
+        return self._stall_time + time.monotonic() - self._paused_since
+
+    def pause(self):
+        if self._paused_since is not None:
+            return False
+
+        self._paused_since = time.monotonic()
+        return True
+
+    def resume(self):
+        if self._paused_since is None:
+            return False
+
+        self._resume_time = time.monotonic()
+        self._stall_time += self._resume_time - self._paused_since
+        self._paused_since = None
+        return True
+
+
+async def _stats_log_loop(server, name):
+    prev_stats = Stats()
+
+    try:
+        while True:
+            await asyncio.sleep(stats_log_interval)
+
+            stats = server.stats
+            if stats == prev_stats:
+                continue
+
+            mlog.info('%s listener stats: %s', name,
+                      ', '.join(f'{k}={v:g}'
+                                for k, v in stats._asdict().items()))
+            prev_stats = stats
+
+    except Exception as e:
+        mlog.error('stats log loop error: %s', e, exc_info=e)
+
+
+def _get_peer_host(writer):
+    peername = writer.get_extra_info('peername')
+    return peername[0] if peername else None
@@ -16,6 +16,7 @@ from hat import juggler
 from hat.syslog.server import common
 from hat.syslog.server import encoder
 import hat.syslog.server.backend
+import hat.syslog.server.database
 
 
 mlog: logging.Logger = logging.getLogger(__name__)
@@ -30,15 +31,32 @@ autoflush_delay: float = 0.2
 default_filter = common.Filter(max_results=max_results_limit)
 """Default filter"""
 
+backup_chunk_size: int = 1024
+"""Number of entries fetched from backend at once during backup"""
+
 
 async def create_web_server(addr: str,
-                            backend: hat.syslog.server.backend.Backend
+                            backend: hat.syslog.server.backend.Backend,
+                            query_timeout: float = 0
                             ) -> 'WebServer':
-    """Create web server"""
+    """Create web server
+
+    Queries made on behalf of clients are limited to `query_timeout`
+    seconds (``0`` represents unlimited duration) - once query times out,
+    client receives partial result with ``query_timeout`` state flag set.
+    Query made for client's previous filter request, which is still running
+    once new filter request is received, is cancelled.
+
+    Database query statistics, aggregated by filter shape and ordered by
+    total query duration, are available as JSON at ``/admin/query-stats``.
+
+    """
     srv = WebServer()
     srv._backend = backend
+    srv._query_timeout = query_timeout if query_timeout > 0 else None
     srv._locks = {}
     srv._filters = {}
+    srv._filter_groups = {}
 
     exit_stack = contextlib.ExitStack()
     try:
@@ -46,7 +64,9 @@ async def create_web_server(addr: str,
             importlib.resources.as_file(
                 importlib.resources.files(__package__) / 'ui'))
 
-        additional_routes = [aiohttp.web.get('/backup', srv._backup_handler)]
+        additional_routes = [
+            aiohttp.web.get('/backup', srv._backup_handler),
+            aiohttp.web.get('/admin/query-stats', srv._query_stats_handler)]
 
         url = urllib.parse.urlparse(addr)
         srv._srv = await juggler.listen(host=url.hostname,
@@ -55,6 +75,7 @@ async def create_web_server(addr: str,
                                         request_cb=srv._on_request,
                                         static_dir=ui_path,
                                         autoflush_delay=autoflush_delay,
+                                        parallel_requests=True,
                                         additional_routes=additional_routes)
 
         try:
@@ -92,14 +113,13 @@ class WebServer(aio.Resource):
                     prev_filter = self._filters[conn]
                     prev_filter_json = encoder.filter_to_json(prev_filter)
 
-                    entries = await self._backend.query(prev_filter)
+                    entries, query_timeout = await self._query(prev_filter)
                     entries_json = [encoder.entry_to_json(entry)
                                     for entry in entries]
 
-                    conn.state.set([], {'filter': prev_filter_json,
-                                        'entries': entries_json,
-                                        'first_id': self._backend.first_id,
-                                        'last_id': self._backend.last_id})
+                    conn.state.set([], self._get_state(prev_filter_json,
+                                                       entries_json,
+                                                       query_timeout))
 
                 while True:
                     entries = await change_queue.get()
@@ -108,12 +128,14 @@ class WebServer(aio.Resource):
                         prev_filter = self._filters[conn]
                         prev_filter_json = conn.state.get('filter')
                         prev_entries_json = conn.state.get('entries')
+                        query_timeout = conn.state.get('query_timeout')
 
                         previous_id = (prev_entries_json[0]['id']
                                        if prev_entries_json else 0)
                         entries = (entry for entry in entries
                                    if entry.id > previous_id)
-                        entries = _filter_entries(prev_filter, entries)
+                        entries = _filter_entries(
+                            prev_filter, entries, self._backend.fts_columns)
                         entries_json = [encoder.entry_to_json(entry)
                                         for entry in entries]
 
@@ -127,10 +149,9 @@ class WebServer(aio.Resource):
                         else:
                             new_entries_json = prev_entries_json
 
-                        conn.state.set([], {'filter': prev_filter_json,
-                                            'entries': new_entries_json,
-                                            'first_id': self._backend.first_id,
-                                            'last_id': self._backend.last_id})
+                        conn.state.set([], self._get_state(
+                            prev_filter_json, new_entries_json,
+                            query_timeout))
 
         except Exception as e:
             mlog.error("connection error: %s", e, exc_info=e)
@@ -140,6 +161,7 @@ class WebServer(aio.Resource):
             conn.close()
             self._locks.pop(conn)
             self._filters.pop(conn)
+            self._filter_groups.pop(conn, None)
 
     async def _on_request(self, conn, name, data):
         if name != 'filter':
@@ -148,6 +170,30 @@ class WebServer(aio.Resource):
         new_filter = encoder.filter_from_json(data)
         new_filter = _sanitize_filter(new_filter)
 
+        # query of superseded filter request is cancelled
+        prev_group = self._filter_groups.get(conn)
+        if prev_group:
+            prev_group.close()
+
+        group = conn.async_group.create_subgroup()
+        self._filter_groups[conn] = group
+
+        try:
+            task = group.spawn(self._set_filter, conn, new_filter)
+            await asyncio.wait([task])
+
+        finally:
+            group.close()
+            if self._filter_groups.get(conn) is group:
+                del self._filter_groups[conn]
+
+        # superseded request is completed without changing state
+        if task.cancelled():
+            return
+
+        task.result()
+
+    async def _set_filter(self, conn, new_filter):
         async with self._locks[conn]:
             prev_filter = self._filters[conn]
             if new_filter == prev_filter:
@@ -156,43 +202,71 @@ class WebServer(aio.Resource):
             mlog.debug('setting new filter: %s', new_filter)
             new_filter_json = encoder.filter_to_json(new_filter)
 
-            entries = await self._backend.query(new_filter)
+            entries, query_timeout = await self._query(new_filter)
             entries_json = [encoder.entry_to_json(entry) for entry in entries]
 
             self._filters[conn] = new_filter
-            conn.state.set([], {'filter': new_filter_json,
-                                'entries': entries_json,
-                                'first_id': self._backend.first_id,
-                                'last_id': self._backend.last_id})
+            conn.state.set([], self._get_state(new_filter_json,
+                                               entries_json,
+                                               query_timeout))
+
+    async def _query(self, filter):
+        try:
+            entries = await self._backend.query(filter, self._query_timeout)
+            return entries, False
+
+        except hat.syslog.server.database.QueryTimeoutError as e:
+            mlog.warning("query timeout (filter: %s)", filter)
+            return e.entries, True
+
+    def _get_state(self, filter_json, entries_json, query_timeout):
+        return {'filter': filter_json,
+                'entries': entries_json,
+                'first_id': self._backend.first_id,
+                'last_id': self._backend.last_id,
+                'cleanup_running': self._backend.is_cleanup_running,
+                'query_timeout': query_timeout}
 
     async def _backup_handler(self, request):
         response = aiohttp.web.StreamResponse()
         response.content_type = 'application/octet-stream'
         await response.prepare(request)
 
-        max_results = 256
-        last_id = None
+        async for entry in self._backend.iter_query(common.Filter(),
+                                                    backup_chunk_size):
+            entry_json = encoder.entry_to_json(entry)
+            entry_str = json.encode(entry_json)
+            entry_bytes = entry_str.encode('utf-8')
 
-        while True:
-            entries = await self._backend.query(
-                common.Filter(max_results=max_results,
-                              last_id=last_id))
-            if not entries:
-                break
+            await response.write(entry_bytes + b'\n')
+            await asyncio.sleep(0)
 
-            for entry in entries:
-                entry_json = encoder.entry_to_json(entry)
-                entry_str = json.encode(entry_json)
-                entry_bytes = entry_str.encode('utf-8')
+        await response.write_eof()
 
-                await response.write(entry_bytes + b'\n')
+        return response
 
-                last_id = entry.id - 1
-                await asyncio.sleep(0)
+    async def _query_stats_handler(self, request):
+        query_stats = sorted(self._backend.query_stats.items(),
+                             key=lambda i: i[1].total_duration,
+                             reverse=True)
+        query_stats_json = [_query_stats_to_json(shape, stats)
+                            for shape, stats in query_stats]
 
-        await response.write_eof()
+        return aiohttp.web.Response(text=json.encode(query_stats_json),
+                                    content_type='application/json')
 
-        return response
+
+def _query_stats_to_json(shape, stats):
+    return {'shape': list(shape),
+            'count': stats.count,
+            'slow_count': stats.slow_count,
+            'timeout_count': stats.timeout_count,
+            'total_duration': stats.total_duration,
+            'avg_duration': stats.total_duration / stats.count,
+            'max_duration': stats.max_duration,
+            'total_steps': stats.total_steps,
+            'total_rows': stats.total_rows,
+            'plan': stats.plan}
 
 
 def _sanitize_filter(f):
@@ -202,7 +276,7 @@ def _sanitize_filter(f):
     return f
 
 
-def _filter_entries(f, entries):
+def _filter_entries(f, entries, fts_columns):
     for i in entries:
         if f.last_id is not None and i.id > f.last_id:
             continue
@@ -221,23 +295,25 @@ def _filter_entries(f, entries):
         if f.severity is not None and i.msg.severity != f.severity:
             continue
 
-        if not _match_str_filter(f.hostname, i.msg.hostname):
+        if not _match_str_filter(f, i.msg, 'hostname', fts_columns):
             continue
 
-        if not _match_str_filter(f.app_name, i.msg.app_name):
+        if not _match_str_filter(f, i.msg, 'app_name', fts_columns):
             continue
 
-        if not _match_str_filter(f.procid, i.msg.procid):
+        if not _match_str_filter(f, i.msg, 'procid', fts_columns):
             continue
 
-        if not _match_str_filter(f.msgid, i.msg.msgid):
+        if not _match_str_filter(f, i.msg, 'msgid', fts_columns):
             continue
 
-        if not _match_str_filter(f.msg, i.msg.msg):
+        if not _match_str_filter(f, i.msg, 'msg', fts_columns):
             continue
 
         yield i
 
 
-def _match_str_filter(f, value):
-    return not f or f in value
+def _match_str_filter(f, msg, name, fts_columns):
+    return hat.syslog.server.database.match_str_filter(
+        getattr(f, name), getattr(msg, name), f.match_type,
+        name in fts_columns)
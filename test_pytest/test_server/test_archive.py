@@ -0,0 +1,425 @@
+import datetime
+import sqlite3
+
+import pytest
+
+from hat.syslog.server import common
+import hat.syslog.server.archive
+import hat.syslog.server.database
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / 'syslog.db'
+
+
+@pytest.fixture
+def timestamp():
+    dt = datetime.datetime.now(tz=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+@pytest.fixture
+def create_msg(timestamp):
+    counter = 0
+
+    def create_msg():
+        nonlocal counter
+        counter += 1
+        return common.Msg(facility=common.Facility.USER,
+                          severity=common.Severity.ERROR,
+                          version=1,
+                          timestamp=timestamp,
+                          hostname='hostname',
+                          app_name='app_name',
+                          procid='procid',
+                          msgid='test_syslog.archive',
+                          data="",
+                          msg=f'message no {counter}')
+
+    return create_msg
+
+
+def create_legacy_archive(path, entries):
+    # archive created prior to interned column values
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript("""
+            CREATE TABLE log (
+                entry_timestamp REAL, facility INTEGER, severity INTEGER,
+                version INTEGER, msg_timestamp REAL, hostname TEXT,
+                app_name TEXT, procid TEXT, msgid TEXT, data TEXT, msg TEXT);
+            CREATE INDEX log_entry_timestamp_index ON log (
+                entry_timestamp DESC);
+            CREATE INDEX log_severity_index ON log (severity);
+            """)
+        for entry in entries:
+            msg = entry.msg
+            conn.execute(
+                "INSERT INTO log (rowid, entry_timestamp, facility, "
+                "severity, version, msg_timestamp, hostname, app_name, "
+                "procid, msgid, data, msg) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry.id, entry.timestamp, msg.facility.value,
+                 msg.severity.value, msg.version, msg.timestamp,
+                 msg.hostname, msg.app_name, msg.procid, msg.msgid,
+                 msg.data, msg.msg))
+        conn.commit()
+
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("compression, suffix", [
+    (hat.syslog.server.archive.Compression.NONE, ''),
+    (hat.syslog.server.archive.Compression.GZIP, '.gz'),
+    (hat.syslog.server.archive.Compression.LZMA, '.xz'),
+])
+async def test_compress(db_path, timestamp, create_msg, compression, suffix):
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    entries = await db.add_msgs([(timestamp, create_msg())
+                                 for _ in range(1000)])
+    await db.async_close()
+
+    size = db_path.stat().st_size
+
+    path = hat.syslog.server.archive.compress_file(db_path, compression)
+    assert path.name == db_path.name + suffix
+    assert path.exists()
+    assert db_path.exists() == (compression ==
+                                hat.syslog.server.archive.Compression.NONE)
+    assert hat.syslog.server.archive.get_compression(path) == compression
+    assert (hat.syslog.server.archive.get_uncompressed_name(path) ==
+            db_path.name)
+
+    if compression != hat.syslog.server.archive.Compression.NONE:
+        assert path.stat().st_size < size
+
+    async with hat.syslog.server.archive.open_archive(path) as archive:
+        result = await archive.query(common.Filter())
+        assert result == list(reversed(entries))
+
+    assert {i.name for i in db_path.parent.iterdir()} == {path.name}
+
+
+async def test_open_archive(db_path, timestamp, create_msg):
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, fts_columns=['msg'], indexes=['hostname'])
+    entries = [common.Entry(id=i + 1,
+                            timestamp=timestamp + i,
+                            msg=create_msg())
+               for i in range(3000)]
+    await db.add_entries(entries)
+    await db.async_close()
+
+    # archive created prior to sparse timestamp index
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("DROP TABLE log_time_block")
+        conn.commit()
+
+    finally:
+        conn.close()
+
+    data = db_path.read_bytes()
+
+    async with hat.syslog.server.archive.open_archive(db_path) as archive:
+        filter = common.Filter(hostname='hostname',
+                               match_type=common.MatchType.EXACT)
+        plan = await archive.explain_query(filter)
+        assert 'log_hostname_index' in plan[0]
+
+        filter = common.Filter(msg='"message no 1500"',
+                               match_type=common.MatchType.FULLTEXT)
+        result = await archive.query(filter)
+        assert result == [entries[1499]]
+
+        filter = common.Filter(entry_timestamp_from=timestamp + 100,
+                               entry_timestamp_to=timestamp + 199)
+        result = await archive.query(filter)
+        assert result == list(reversed(entries[100:200]))
+
+        plan = await archive.explain_query(filter)
+        assert 'rowid>? AND rowid<?' in plan[0]
+
+    assert db_path.read_bytes() == data
+    assert {i.name for i in db_path.parent.iterdir()} == {db_path.name}
+
+
+async def test_archive_cache(monkeypatch, db_path, timestamp, create_msg):
+    paths = [db_path.with_name(f'{db_path.name}.{i}') for i in [1, 2, 3]]
+    entries = {}
+
+    for path in paths:
+        db = await hat.syslog.server.database.create_database(path, False)
+        entries[path] = await db.add_msgs([(timestamp, create_msg())
+                                           for _ in range(100)])
+        await db.async_close()
+
+    size = paths[0].stat().st_size
+    paths = [hat.syslog.server.archive.compress_file(
+                path, hat.syslog.server.archive.Compression.GZIP)
+             for path in paths]
+    entries = {path: entries[path.with_suffix('')] for path in paths}
+
+    decompressed = []
+    decompress_file = hat.syslog.server.archive.decompress_file
+
+    def decompress(path, dst_path):
+        decompressed.append(path)
+        decompress_file(path, dst_path)
+
+    monkeypatch.setattr(hat.syslog.server.archive, 'decompress_file',
+                        decompress)
+
+    cache = hat.syslog.server.archive.create_archive_cache(size * 2)
+
+    for path in [paths[0], paths[1], paths[0], paths[2], paths[0],
+                 paths[1]]:
+        async with hat.syslog.server.archive.open_archive(path,
+                                                          cache) as archive:
+            result = await archive.query(common.Filter())
+            assert result == list(reversed(entries[path]))
+
+        assert cache.size <= size * 2
+
+    assert decompressed == [paths[0], paths[1], paths[2], paths[1]]
+
+    # nested usage of archives exceeding cache size
+    async with hat.syslog.server.archive.open_archive(paths[0], cache):
+        async with hat.syslog.server.archive.open_archive(paths[1], cache):
+            async with hat.syslog.server.archive.open_archive(paths[2],
+                                                              cache):
+                assert cache.size == size * 3
+
+    assert cache.size <= size * 2
+
+    await cache.async_close()
+
+    assert {i.name for i in db_path.parent.iterdir()} == {
+        path.name for path in paths}
+
+
+async def test_catalog(db_path, timestamp, create_msg):
+    catalog_path = hat.syslog.server.archive.get_catalog_path(db_path)
+
+    catalog = hat.syslog.server.archive.update_catalog(db_path)
+    assert catalog == []
+    assert catalog_path.exists()
+
+    paths = [db_path.with_name(f'{db_path.name}.{i}') for i in [1, 2, 10]]
+    for i, path in enumerate(paths):
+        db = await hat.syslog.server.database.create_database(path, False)
+        await db.add_entries([
+            common.Entry(id=i * 10 + j + 1,
+                         timestamp=timestamp + i * 10 + j,
+                         msg=create_msg())
+            for j in range(10)])
+        await db.async_close()
+
+    paths[1] = hat.syslog.server.archive.compress_file(
+        paths[1], hat.syslog.server.archive.Compression.GZIP)
+    db_path.with_name(f'{db_path.name}.x').touch()
+
+    assert hat.syslog.server.archive.get_archive_paths(db_path) == paths
+
+    catalog = hat.syslog.server.archive.update_catalog(db_path)
+    assert catalog == [
+        hat.syslog.server.archive.CatalogEntry(
+            name=path.name,
+            first_id=i * 10 + 1,
+            last_id=i * 10 + 10,
+            first_timestamp=timestamp + i * 10,
+            last_timestamp=timestamp + i * 10 + 9,
+            size=path.stat().st_size)
+        for i, path in enumerate(paths)]
+
+    paths[0].unlink()
+
+    catalog = hat.syslog.server.archive.update_catalog(db_path)
+    assert [i.name for i in catalog] == [i.name for i in paths[1:]]
+
+
+def test_merge_groups():
+    catalog = [hat.syslog.server.archive.CatalogEntry(name=str(first_id),
+                                                      first_id=first_id,
+                                                      last_id=last_id,
+                                                      first_timestamp=0,
+                                                      last_timestamp=0,
+                                                      size=0)
+               for first_id, last_id in [(1, 10), (11, 20), (21, 50),
+                                         (51, 55), (56, 60), (61, 65)]]
+
+    groups = hat.syslog.server.archive.get_merge_groups(catalog, 20)
+    assert groups == [catalog[:2], catalog[3:]]
+
+    groups = hat.syslog.server.archive.get_merge_groups(catalog, 10)
+    assert groups == [catalog[3:5]]
+
+    groups = hat.syslog.server.archive.get_merge_groups(catalog, 100)
+    assert groups == [catalog]
+
+    groups = hat.syslog.server.archive.get_merge_groups(catalog[:1], 100)
+    assert groups == []
+
+
+@pytest.mark.parametrize("compression", list(
+    hat.syslog.server.archive.Compression))
+@pytest.mark.parametrize("vacuum", [False, True])
+async def test_merge_archives(db_path, timestamp, create_msg, compression,
+                              vacuum):
+    paths = [db_path.with_name(f'{db_path.name}.{i}') for i in [1, 2, 3]]
+    entries = []
+
+    for i, path in enumerate(paths):
+        db = await hat.syslog.server.database.create_database(path, False)
+        archive_entries = [
+            common.Entry(id=i * 10 + j + 1,
+                         timestamp=timestamp + i * 10 + j,
+                         msg=create_msg()._replace(hostname=f'host{i}'))
+            for j in range(10)]
+        await db.add_entries(archive_entries)
+        await db.async_close()
+        entries.extend(archive_entries)
+
+    paths[1] = hat.syslog.server.archive.compress_file(
+        paths[1], hat.syslog.server.archive.Compression.GZIP)
+
+    catalog = hat.syslog.server.archive.update_catalog(db_path)
+    groups = hat.syslog.server.archive.get_merge_groups(catalog, 20)
+    assert groups == [catalog[:2]]
+
+    path = await hat.syslog.server.archive.merge_archives(
+        db_path, paths[:2], compression, ['hostname'], vacuum)
+    assert path.name == (paths[0].name +
+                         hat.syslog.server.archive.compression_suffixes[
+                             compression])
+    assert hat.syslog.server.archive.get_archive_paths(db_path) == [path,
+                                                                    paths[2]]
+
+    catalog = hat.syslog.server.archive.update_catalog(db_path)
+    assert [(i.name, i.first_id, i.last_id) for i in catalog] == [
+        (path.name, 1, 20),
+        (paths[2].name, 21, 30)]
+
+    async with hat.syslog.server.archive.open_archive(path) as archive:
+        result = await archive.query(common.Filter())
+        assert result == list(reversed(entries[:20]))
+
+        result = await archive.query(common.Filter(hostname='host1'))
+        assert result == list(reversed(entries[10:20]))
+
+        plan = await archive.explain_query(common.Filter(
+            hostname='host1', match_type=common.MatchType.EXACT))
+        assert 'log_hostname_index' in plan[0]
+
+    assert {i.name for i in db_path.parent.iterdir()} == {
+        path.name, paths[2].name,
+        hat.syslog.server.archive.get_catalog_path(db_path).name}
+
+
+@pytest.mark.parametrize("install_error", [False, True])
+async def test_merge_archives_sources(monkeypatch, db_path, timestamp,
+                                      create_msg, install_error):
+    paths = [db_path.with_name(f'{db_path.name}.{i}') for i in [1, 2, 3]]
+    entries = [common.Entry(id=i + 1,
+                            timestamp=timestamp + i,
+                            msg=create_msg()._replace(hostname=f'host{i}'))
+               for i in range(30)]
+
+    create_legacy_archive(paths[0], entries[:10])
+
+    for path, archive_entries in [(paths[1], entries[10:20]),
+                                  (paths[2], entries[20:])]:
+        db = await hat.syslog.server.database.create_database(
+            path, False, indexes=['severity'])
+        await db.add_entries(archive_entries)
+        await db.async_close()
+
+    # archive created prior to sparse timestamp index
+    conn = sqlite3.connect(paths[2])
+    try:
+        conn.execute("DROP TABLE log_time_block")
+        conn.commit()
+
+    finally:
+        conn.close()
+
+    data = {path: path.read_bytes() for path in paths}
+
+    if install_error:
+        def install_archive(path, archive_path, compression):
+            raise Exception('install error')
+
+        monkeypatch.setattr(hat.syslog.server.archive, 'install_archive',
+                            install_archive)
+
+        with pytest.raises(Exception, match='install error'):
+            await hat.syslog.server.archive.merge_archives(
+                db_path, paths, indexes=['hostname'])
+
+        assert {path: path.read_bytes() for path in paths} == data
+        assert {i.name for i in db_path.parent.iterdir()} == {
+            path.name for path in paths}
+        return
+
+    for i, path in enumerate(paths):
+        async with hat.syslog.server.archive.open_archive(path) as archive:
+            result = await archive.query(common.Filter())
+            assert result == list(reversed(entries[i * 10:(i + 1) * 10]))
+
+    assert {path: path.read_bytes() for path in paths} == data
+
+    path = await hat.syslog.server.archive.merge_archives(
+        db_path, paths, indexes=['hostname'])
+    assert path == paths[0]
+
+    async with hat.syslog.server.archive.open_archive(path) as archive:
+        result = await archive.query(common.Filter())
+        assert result == list(reversed(entries))
+
+    assert hat.syslog.server.database.get_indexes(path) == ([],
+                                                            ['hostname'])
+
+
+async def test_archive_cache_migration(monkeypatch, db_path, timestamp,
+                                       create_msg):
+    entries = [common.Entry(id=i + 1,
+                            timestamp=timestamp + i,
+                            msg=create_msg())
+               for i in range(10)]
+    path = db_path.with_name(f'{db_path.name}.1')
+    create_legacy_archive(path, entries)
+    data = path.read_bytes()
+
+    migrated = []
+    create_database = hat.syslog.server.database.create_database
+
+    async def create_migrated_database(path, *args, **kwargs):
+        if not kwargs.get('read_only'):
+            migrated.append(path)
+        return await create_database(path, *args, **kwargs)
+
+    monkeypatch.setattr(hat.syslog.server.database, 'create_database',
+                        create_migrated_database)
+
+    cache = hat.syslog.server.archive.create_archive_cache(
+        path.stat().st_size * 10)
+
+    for _ in range(3):
+        async with hat.syslog.server.archive.open_archive(path,
+                                                          cache) as archive:
+            result = await archive.query(common.Filter())
+            assert result == list(reversed(entries))
+
+            plan = await archive.explain_query(common.Filter(
+                severity=common.Severity.ERROR))
+            assert 'log_severity_index' in plan[0]
+
+    assert len(migrated) == 1
+    assert migrated[0] != path
+    assert path.read_bytes() == data
+
+    await cache.async_close()
+
+    assert {i.name for i in db_path.parent.iterdir()} == {path.name}
@@ -4,27 +4,30 @@ import datetime
 import socket
 import os
 import itertools
+import sqlite3
 
 from hat import aio
 from hat import util
 from hat.syslog.server import common
+import hat.syslog.server.archive
 import hat.syslog.server.backend
+import hat.syslog.server.database
+import hat.syslog.server.segments
 
 
 @pytest.fixture
-def short_register_delay(monkeypatch):
-    monkeypatch.setattr(hat.syslog.server.backend, "register_delay", 0.0)
+def register_conf():
+    return hat.syslog.server.backend.RegisterConf(max_delay=0.0)
 
 
-@pytest.fixture(params=["delay", "queue_treshold"])
-def force_delay_or_queue_threshold(monkeypatch, request):
+@pytest.fixture(params=["delay", "max_batch_size"])
+def force_delay_or_max_batch_size(request):
     if request.param == "delay":
-        monkeypatch.setattr(hat.syslog.server.backend,
-                            "register_queue_treshold", 100)
-        monkeypatch.setattr(hat.syslog.server.backend, "register_delay", 0.01)
-    elif request.param == "queue_treshold":
-        monkeypatch.setattr(hat.syslog.server.backend,
-                            "register_delay", 1)
+        return hat.syslog.server.backend.RegisterConf(max_delay=0.01,
+                                                      max_batch_size=1000)
+    elif request.param == "max_batch_size":
+        return hat.syslog.server.backend.RegisterConf(max_delay=1,
+                                                      max_batch_size=10)
 
 
 @pytest.fixture
@@ -42,19 +45,32 @@ def timestamp():
 
 
 @pytest.fixture
-def create_backend(db_path, short_register_delay):
+def create_backend(db_path, register_conf):
 
     async def create_backend(path=db_path,
                              low_size=50,
                              high_size=100,
                              enable_archive=False,
-                             disable_journal=False):
+                             disable_journal=False,
+                             register_conf=register_conf,
+                             db_segments=None,
+                             retention_conf=None,
+                             archive_compression=None,
+                             query_archives=False):
         return await hat.syslog.server.backend.create_backend(
             path=path,
             low_size=low_size,
             high_size=high_size,
             enable_archive=enable_archive,
-            disable_journal=disable_journal)
+            disable_journal=disable_journal,
+            register_conf=register_conf,
+            db_segments=db_segments,
+            retention_conf=(retention_conf or
+                            hat.syslog.server.backend.RetentionConf()),
+            archive_compression=(
+                archive_compression or
+                hat.syslog.server.archive.Compression.NONE),
+            query_archives=query_archives)
 
     return create_backend
 
@@ -108,9 +124,10 @@ async def test_register(create_backend, create_msg, timestamp):
 
 
 async def test_register_with_delay(create_backend, create_msg, timestamp,
-                                   force_delay_or_queue_threshold):
+                                   force_delay_or_max_batch_size):
     entry_queue = aio.Queue()
-    backend = await create_backend()
+    backend = await create_backend(
+        register_conf=force_delay_or_max_batch_size)
     backend.register_change_cb(lambda e: entry_queue.put_nowait(e))
 
     size = 100
@@ -125,6 +142,177 @@ async def test_register_with_delay(create_backend, create_msg, timestamp,
     await backend.async_close()
 
 
+async def test_max_batch_size(monkeypatch, create_backend, create_msg,
+                              timestamp):
+    add_msgs_event = asyncio.Event()
+    add_msgs = hat.syslog.server.database.Database.add_msgs
+    batch_sizes = []
+
+    async def blocking_add_msgs(self, msgs):
+        batch_sizes.append(len(msgs))
+        await add_msgs_event.wait()
+        return await add_msgs(self, msgs)
+
+    monkeypatch.setattr(hat.syslog.server.database.Database, "add_msgs",
+                        blocking_add_msgs)
+
+    entry_queue = aio.Queue()
+    backend = await create_backend(
+        register_conf=hat.syslog.server.backend.RegisterConf(
+            max_delay=1, max_batch_size=10))
+    backend.register_change_cb(entry_queue.put_nowait)
+
+    # first message is taken by backend loop which waits for batch delay
+    # (maximum delay is used prior to first commit)
+    await backend.register(timestamp, create_msg())
+    await asyncio.sleep(0.01)
+    assert batch_sizes == []
+
+    for _ in range(4):
+        await backend.register(timestamp, create_msg())
+        await asyncio.sleep(0.01)
+    assert batch_sizes == []
+
+    # batch is closed once queue reaches max batch size and contains at
+    # most max batch size messages
+    for _ in range(20):
+        await backend.register(timestamp, create_msg())
+    await asyncio.sleep(0.01)
+    assert batch_sizes == [10]
+
+    for _ in range(30):
+        await backend.register(timestamp, create_msg())
+
+    add_msgs_event.set()
+
+    entries = []
+    while len(entries) < 55:
+        entries += await entry_queue.get()
+
+    assert batch_sizes == [10, 10, 10, 10, 10, 5]
+
+    await backend.async_close()
+
+
+async def test_congestion(monkeypatch, create_backend, create_msg,
+                          timestamp):
+    add_msgs_event = asyncio.Event()
+    add_msgs = hat.syslog.server.database.Database.add_msgs
+
+    async def blocking_add_msgs(self, msgs):
+        await add_msgs_event.wait()
+        return await add_msgs(self, msgs)
+
+    monkeypatch.setattr(hat.syslog.server.database.Database, "add_msgs",
+                        blocking_add_msgs)
+
+    congestion_queue = aio.Queue()
+    entry_queue = aio.Queue()
+    backend = await create_backend(
+        register_conf=hat.syslog.server.backend.RegisterConf(max_delay=0,
+                                                             queue_size=10))
+    backend.register_congestion_cb(congestion_queue.put_nowait)
+    backend.register_change_cb(entry_queue.put_nowait)
+
+    assert not backend.is_congested
+
+    # first message is taken by backend loop which blocks on add_msgs
+    await backend.register(timestamp, create_msg())
+    await asyncio.sleep(0.01)
+
+    for _ in range(7):
+        await backend.register(timestamp, create_msg())
+        assert not backend.is_congested
+    assert congestion_queue.empty()
+
+    await backend.register(timestamp, create_msg())
+    assert backend.is_congested
+    assert await congestion_queue.get() is True
+
+    add_msgs_event.set()
+
+    entries = []
+    while len(entries) < 9:
+        entries += await entry_queue.get()
+
+    assert await congestion_queue.get() is False
+    assert not backend.is_congested
+
+    await backend.async_close()
+
+
+async def test_sync(monkeypatch, create_backend, create_msg, timestamp):
+    add_msgs_event = asyncio.Event()
+    add_msgs = hat.syslog.server.database.Database.add_msgs
+
+    async def blocking_add_msgs(self, msgs):
+        await add_msgs_event.wait()
+        return await add_msgs(self, msgs)
+
+    monkeypatch.setattr(hat.syslog.server.database.Database, "add_msgs",
+                        blocking_add_msgs)
+
+    backend = await create_backend()
+
+    await backend.sync()
+
+    await backend.register(timestamp, create_msg())
+    sync_task = asyncio.create_task(backend.sync())
+
+    await asyncio.sleep(0.01)
+    assert not sync_task.done()
+
+    add_msgs_event.set()
+    await sync_task
+
+    entries = await backend.query(common.Filter())
+    assert len(entries) == 1
+
+    add_msgs_event.clear()
+    await backend.register(timestamp, create_msg())
+    sync_task = asyncio.create_task(backend.sync())
+
+    await backend.async_close()
+
+    with pytest.raises(ConnectionError):
+        await sync_task
+
+
+async def test_notify_committed(db_path, create_backend, create_msg,
+                                timestamp):
+
+    def get_committed_count():
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM log").fetchone()[0]
+
+        finally:
+            conn.close()
+
+    entry_queue = aio.Queue()
+    backend = await create_backend(
+        register_conf=hat.syslog.server.backend.RegisterConf(
+            max_delay=0, commit_delay=0.1))
+    backend.register_change_cb(entry_queue.put_nowait)
+
+    entries = []
+    for _ in range(10):
+        await backend.register(timestamp, create_msg())
+        await asyncio.sleep(0.001)
+
+        while not entry_queue.empty():
+            entries.extend(entry_queue.get_nowait())
+            assert get_committed_count() >= len(entries)
+
+    while len(entries) < 10:
+        entries.extend(await entry_queue.get())
+        assert get_committed_count() >= len(entries)
+
+    assert sorted(entry.id for entry in entries) == list(range(1, 11))
+
+    await backend.async_close()
+
+
 async def test_query(create_backend, create_msg, timestamp):
     change_queue = aio.Queue()
     backend = await create_backend()
@@ -238,7 +426,7 @@ async def test_query_on_timestamp(create_backend, create_msg, timestamp,
 @pytest.mark.skip("WIP - remove asyncio.sleep")
 @pytest.mark.parametrize("enable_archive", [False, True])
 async def test_archive(create_backend, create_msg, timestamp, db_path,
-                       short_register_delay, enable_archive):
+                       enable_archive):
     low_size = 50
     high_size = 100
 
@@ -295,6 +483,302 @@ async def test_archive(create_backend, create_msg, timestamp, db_path,
         assert backend.is_closed
 
 
+async def test_cleanup_chunks(monkeypatch, create_backend, create_msg,
+                              timestamp):
+    monkeypatch.setattr(hat.syslog.server.backend, 'cleanup_chunk_size', 3)
+
+    states = []
+    backend = await create_backend(low_size=5, high_size=15)
+    backend.register_change_cb(lambda _: states.append(
+        (backend.first_id, backend.is_cleanup_running)))
+
+    for _ in range(15):
+        await backend.register(timestamp, create_msg())
+    await backend.sync()
+    assert not backend.is_cleanup_running
+
+    states.clear()
+    await backend.register(timestamp, create_msg())
+    await backend.sync()
+
+    while backend.is_cleanup_running:
+        await asyncio.sleep(0.01)
+
+    assert backend.first_id == 12
+    assert backend.last_id == 16
+    assert states == [(1, False),
+                      (1, True),
+                      (4, True),
+                      (7, True),
+                      (10, True),
+                      (12, True),
+                      (12, False)]
+
+    result = await backend.query(common.Filter())
+    assert [entry.id for entry in result] == list(range(16, 11, -1))
+
+    await backend.async_close()
+
+
+@pytest.mark.parametrize("enable_archive", [False, True])
+async def test_segments_cleanup(create_backend, create_msg, timestamp,
+                                db_path, enable_archive):
+    db_segments = hat.syslog.server.segments.parse_segment_conf('10')
+    backend = await create_backend(low_size=15,
+                                   high_size=30,
+                                   enable_archive=enable_archive,
+                                   db_segments=db_segments)
+
+    for _ in range(30):
+        await backend.register(timestamp, create_msg())
+    await backend.sync()
+
+    assert backend.first_id == 1
+    assert backend.last_id == 30
+
+    await backend.register(timestamp, create_msg())
+    await backend.sync()
+
+    while backend.is_cleanup_running:
+        await asyncio.sleep(0.01)
+
+    # segment 11-20 contains entries which should be kept
+    assert backend.first_id == 11
+    assert backend.last_id == 31
+
+    result = await backend.query(common.Filter())
+    assert [entry.id for entry in result] == list(range(31, 10, -1))
+
+    archive_path = db_path.with_name(f'{db_path.name}.1')
+    assert archive_path.exists() == enable_archive
+
+    await backend.async_close()
+
+    backend = await create_backend(db_segments=db_segments)
+    assert backend.first_id == 11
+    assert backend.last_id == 31
+    await backend.async_close()
+
+    if enable_archive:
+        backend = await create_backend(path=archive_path)
+        result = await backend.query(common.Filter())
+        assert [entry.id for entry in result] == list(range(10, 0, -1))
+        await backend.async_close()
+
+
+async def test_retention_max_age(monkeypatch, create_backend, create_msg,
+                                 timestamp):
+    monkeypatch.setattr(hat.syslog.server.backend, 'retention_check_period',
+                        0.01)
+
+    retention_conf = hat.syslog.server.backend.RetentionConf(max_age=3600)
+    backend = await create_backend(low_size=0,
+                                   high_size=0,
+                                   retention_conf=retention_conf)
+
+    for i in range(10):
+        await backend.register(timestamp - 7200 + i, create_msg())
+    for i in range(5):
+        await backend.register(timestamp - 60 + i, create_msg())
+    await backend.sync()
+
+    await asyncio.sleep(0.1)
+    while backend.is_cleanup_running:
+        await asyncio.sleep(0.01)
+
+    assert backend.first_id == 11
+    assert backend.last_id == 15
+
+    result = await backend.query(common.Filter())
+    assert [entry.id for entry in result] == list(range(15, 10, -1))
+
+    await backend.async_close()
+
+
+async def test_retention_max_size(monkeypatch, create_backend, create_msg,
+                                  timestamp, db_path):
+    monkeypatch.setattr(hat.syslog.server.backend, 'retention_check_period',
+                        0.01)
+
+    backend = await create_backend(low_size=0, high_size=0)
+    for _ in range(1000):
+        await backend.register(timestamp, create_msg())
+    await backend.sync()
+    await backend.async_close()
+
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    size = await db.get_size()
+    await db.async_close()
+
+    retention_conf = hat.syslog.server.backend.RetentionConf(
+        max_size=size // 2)
+    backend = await create_backend(low_size=0,
+                                   high_size=0,
+                                   retention_conf=retention_conf)
+
+    await asyncio.sleep(0.1)
+    while backend.is_cleanup_running:
+        await asyncio.sleep(0.01)
+
+    assert 1 < backend.first_id < 1000
+    assert backend.last_id == 1000
+
+    result = await backend.query(common.Filter())
+    assert len(result) <= 1000 * 0.45 + 1
+
+    await backend.async_close()
+
+
+async def test_incremental_vacuum(monkeypatch, create_backend,
+                                  create_msg, timestamp):
+    monkeypatch.setattr(hat.syslog.server.backend, 'vacuum_check_period',
+                        0.01)
+    monkeypatch.setattr(hat.syslog.server.backend, 'vacuum_chunk_pages', 2)
+
+    backend = await create_backend(low_size=10, high_size=1000)
+    for _ in range(1001):
+        await backend.register(timestamp, create_msg())
+    await backend.sync()
+
+    await asyncio.sleep(0.01)
+    while backend.is_cleanup_running:
+        await asyncio.sleep(0.01)
+
+    stats = await backend.get_page_stats()
+    while stats.freelist_count:
+        await asyncio.sleep(0.01)
+        stats = await backend.get_page_stats()
+
+    result = await backend.query(common.Filter())
+    assert len(result) == 10
+
+    await backend.async_close()
+
+
+async def test_retention_severity_max_age(monkeypatch, create_backend,
+                                          create_msg, timestamp):
+    monkeypatch.setattr(hat.syslog.server.backend, 'retention_check_period',
+                        0.01)
+
+    retention_conf = hat.syslog.server.backend.RetentionConf(
+        severity_max_ages={common.Severity.DEBUG: 3600},
+        summarize=True)
+    backend = await create_backend(low_size=0,
+                                   high_size=0,
+                                   retention_conf=retention_conf)
+
+    for i in range(10):
+        severity = (common.Severity.DEBUG if i % 2
+                    else common.Severity.ERROR)
+        await backend.register(timestamp - 7200, create_msg(severity=severity))
+    for i in range(10):
+        await backend.register(timestamp,
+                               create_msg(severity=common.Severity.DEBUG))
+    await backend.sync()
+
+    await asyncio.sleep(0.1)
+    while backend.is_cleanup_running:
+        await asyncio.sleep(0.01)
+
+    assert backend.first_id == 1
+    assert backend.last_id == 20
+
+    result = await backend.query(common.Filter())
+    assert [entry.id for entry in result] == [*range(20, 10, -1),
+                                              9, 7, 5, 3, 1]
+
+    summaries = await backend.query_summaries()
+    assert sum(summary.count for summary in summaries) == 5
+    assert all(summary.severity == common.Severity.DEBUG
+               for summary in summaries)
+
+    await backend.async_close()
+
+
+@pytest.mark.parametrize("segments", [False, True])
+async def test_compressed_archive(create_backend, create_msg, timestamp,
+                                  db_path, segments):
+    backend = await create_backend(
+        low_size=10,
+        high_size=20,
+        enable_archive=True,
+        db_segments=(hat.syslog.server.segments.parse_segment_conf('5')
+                     if segments else None),
+        archive_compression=hat.syslog.server.archive.Compression.GZIP)
+
+    entries = []
+    backend.register_change_cb(lambda e: entries.extend(e))
+
+    for _ in range(21):
+        await backend.register(timestamp, create_msg())
+    await backend.sync()
+
+    while backend.is_cleanup_running:
+        await asyncio.sleep(0.01)
+
+    await backend.async_close()
+
+    archive_paths = sorted(db_path.parent.glob(f'{db_path.name}.*.gz'))
+    assert len(archive_paths) == (2 if segments else 1)
+    assert not list(db_path.parent.glob(f'{db_path.name}.[0-9]'))
+
+    archived = []
+    for archive_path in archive_paths:
+        async with hat.syslog.server.archive.open_archive(
+                archive_path) as archive:
+            archived = await archive.query(common.Filter()) + archived
+
+    entries = sorted(entries, key=lambda i: i.id)
+    assert archived == list(reversed(entries[:len(archived)]))
+    assert len(archived) == (10 if segments else 11)
+
+
+async def test_query_archives(create_backend, create_msg, timestamp,
+                              db_path):
+    backend = await create_backend(low_size=10,
+                                   high_size=20,
+                                   enable_archive=True,
+                                   query_archives=True)
+
+    for i in range(42):
+        await backend.register(timestamp + i, create_msg())
+        await backend.sync()
+
+        while backend.is_cleanup_running:
+            await asyncio.sleep(0.01)
+
+    assert backend.first_id == 23
+    assert [(i.first_id, i.last_id) for i in backend.catalog] == [(1, 11),
+                                                                  (12, 22)]
+
+    result = await backend.query(common.Filter())
+    assert [i.id for i in result] == list(range(42, 0, -1))
+
+    result = await backend.query(common.Filter(max_results=25))
+    assert [i.id for i in result] == list(range(42, 17, -1))
+
+    result = await backend.query(common.Filter(last_id=20, max_results=15))
+    assert [i.id for i in result] == list(range(20, 5, -1))
+
+    result = await backend.query(common.Filter(
+        entry_timestamp_from=timestamp + 2,
+        entry_timestamp_to=timestamp + 5))
+    assert [i.id for i in result] == [6, 5, 4, 3]
+
+    result = [i async for i in backend.iter_query(common.Filter(), 7)]
+    assert [i.id for i in result] == list(range(42, 0, -1))
+
+    await backend.async_close()
+
+    catalog_path = hat.syslog.server.archive.get_catalog_path(db_path)
+    catalog_path.unlink()
+
+    backend = await create_backend(query_archives=True)
+    assert len(backend.catalog) == 2
+    assert catalog_path.exists()
+    await backend.async_close()
+
+
 async def test_persistence(create_backend, create_msg, timestamp):
     backend = await create_backend()
     size = 100
@@ -314,8 +798,7 @@ async def test_persistence(create_backend, create_msg, timestamp):
     await backend.async_close()
 
 
-async def test_entry_id_unique(create_backend, create_msg, timestamp,
-                               short_register_delay):
+async def test_entry_id_unique(create_backend, create_msg, timestamp):
     entry_queue = aio.Queue()
     backend = await create_backend()
     backend.register_change_cb(entry_queue.put_nowait)
@@ -336,7 +819,7 @@ async def test_entry_id_unique(create_backend, create_msg, timestamp,
 @pytest.mark.skip("WIP")
 @pytest.mark.parametrize("disable_journal", [False, True])
 async def test_disable_journal(create_backend, create_msg, timestamp, db_path,
-                               short_register_delay, disable_journal):
+                               disable_journal):
     backend = await create_backend(disable_journal=disable_journal)
     await backend.register(timestamp, create_msg())
 
@@ -349,7 +832,7 @@ async def test_disable_journal(create_backend, create_msg, timestamp, db_path,
 
 
 async def test_create_unique_archive(create_backend, create_msg, timestamp,
-                                     db_path, short_register_delay):
+                                     db_path):
     low_size = 1
     high_size = 2
 
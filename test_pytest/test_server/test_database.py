@@ -1,6 +1,8 @@
+import asyncio
 import datetime
 import os
 import socket
+import sqlite3
 
 import pytest
 
@@ -132,3 +134,945 @@ async def test_delete(db_path, timestamp, create_msg):
     assert last_id == entries[-1].id
 
     await db.async_close()
+
+
+async def test_last_id_before(db_path, timestamp, create_msg):
+    db = await hat.syslog.server.database.create_database(db_path, False)
+
+    last_id = await db.get_last_id_before(timestamp)
+    assert last_id is None
+
+    entries = await db.add_msgs([(timestamp + i, create_msg())
+                                 for i in range(10)])
+
+    last_id = await db.get_last_id_before(timestamp)
+    assert last_id is None
+
+    last_id = await db.get_last_id_before(timestamp + 5)
+    assert last_id == entries[4].id
+
+    last_id = await db.get_last_id_before(timestamp + 100)
+    assert last_id == entries[-1].id
+
+    entries = await db.add_msgs([(timestamp + 100, create_msg())
+                                 for i in range(3)])
+
+    last_id = await db.get_last_id_before(timestamp + 101)
+    assert last_id == entries[-1].id
+
+    await db.async_close()
+
+
+async def test_size(db_path, timestamp, create_msg):
+    db = await hat.syslog.server.database.create_database(db_path, False)
+
+    empty_size = await db.get_size()
+    assert empty_size > 0
+
+    entries = await db.add_msgs([(timestamp, create_msg())
+                                 for i in range(1000)])
+
+    size = await db.get_size()
+    assert size > empty_size
+    assert size <= db_path.stat().st_size
+
+    await db.delete(entries[-1].id + 1)
+
+    assert await db.get_size() < size
+    assert db_path.stat().st_size == size
+
+    await db.async_close()
+
+
+@pytest.mark.parametrize("summarize", [False, True])
+async def test_delete_severity(db_path, timestamp, create_msg, summarize):
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    minute = (timestamp // 60) * 60
+
+    entries = await db.add_msgs([
+        (minute + i, create_msg(severity=severity, hostname=hostname))
+        for i in range(5)
+        for severity in [common.Severity.DEBUG, common.Severity.ERROR]
+        for hostname in ['a', None]])
+
+    count = await db.delete_severity(common.Severity.DEBUG,
+                                     entries[0].id, entries[10].id,
+                                     summarize)
+    assert count == 6
+
+    count = await db.delete_severity(common.Severity.DEBUG,
+                                     entries[10].id, entries[-1].id + 1,
+                                     summarize)
+    assert count == 4
+
+    result = await db.query(common.Filter())
+    assert result == [entry for entry in reversed(entries)
+                      if entry.msg.severity == common.Severity.ERROR]
+
+    summaries = await db.query_summaries()
+    if summarize:
+        assert set(summaries) == {
+            common.Summary(timestamp=minute,
+                           severity=common.Severity.DEBUG,
+                           hostname=hostname,
+                           app_name=pytest.__file__,
+                           count=5)
+            for hostname in ['a', None]}
+
+    else:
+        assert summaries == []
+
+    summaries = await db.query_summaries(minute + 60)
+    assert summaries == []
+
+    await db.async_close()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+async def test_merge(tmp_path, db_path, timestamp, create_msg, chunk_size):
+    src_paths = [tmp_path / 'src1.db', tmp_path / 'src2.db']
+    entries = []
+
+    for i, src_path in enumerate(src_paths):
+        src_db = await hat.syslog.server.database.create_database(src_path,
+                                                                  False)
+        src_entries = [
+            common.Entry(id=i * 10 + j + 1,
+                         timestamp=timestamp + i * 10 + j,
+                         msg=create_msg(hostname=f'host{(i + j) % 3}',
+                                        severity=common.Severity.DEBUG))
+            for j in range(10)]
+        await src_db.add_entries(src_entries)
+        await src_db.delete_severity(common.Severity.DEBUG,
+                                     src_entries[0].id, src_entries[1].id,
+                                     True)
+        await src_db.async_close()
+        entries.extend(src_entries[1:])
+
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    await db.add_msgs([(timestamp, create_msg(hostname='host2'))])
+    await db.delete(await db.get_last_id() + 1)
+
+    for src_path in src_paths:
+        count = await db.merge(src_path, chunk_size)
+        assert count == 9
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+
+    result = await db.query(common.Filter(hostname='host1'))
+    assert result == [entry for entry in reversed(entries)
+                      if entry.msg.hostname == 'host1']
+
+    summaries = await db.query_summaries()
+    assert sum(summary.count for summary in summaries) == 2
+
+    await db.async_close()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 10, 100])
+@pytest.mark.parametrize("max_results", [None, 0, 4, 7])
+async def test_iter_query(db_path, timestamp, create_msg, chunk_size,
+                          max_results):
+    db = await hat.syslog.server.database.create_database(db_path, False)
+
+    msgs = [create_msg(severity=(common.Severity.ERROR if i % 2
+                                 else common.Severity.DEBUG))
+            for i in range(20)]
+    entries = await db.add_msgs([(timestamp, msg) for msg in msgs])
+    entries = list(reversed(entries))
+
+    filter = common.Filter(max_results=max_results,
+                           last_id=entries[2].id,
+                           severity=common.Severity.ERROR)
+    result = [entry async for entry in db.iter_query(filter, chunk_size)]
+    assert result == await db.query(filter)
+    assert result == [entry for entry in entries[2:]
+                      if entry.msg.severity == common.Severity.ERROR
+                      ][:max_results]
+
+    await db.async_close()
+
+
+@pytest.mark.parametrize("commit_delay", [0, 0.1])
+@pytest.mark.parametrize("chunk_size", [1, 4, 100])
+async def test_archive(tmp_path, db_path, timestamp, create_msg, commit_delay,
+                       chunk_size):
+    archive_path = tmp_path / 'archive.db'
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, commit_delay=commit_delay)
+
+    msgs = [create_msg(hostname=f'host{i % 3}') for i in range(10)]
+    entries = await db.add_msgs([(timestamp, msg) for msg in msgs])
+
+    await db.archive(archive_path, entries[5].id, chunk_size)
+
+    entries.extend(await db.add_msgs([(timestamp, create_msg())]))
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+
+    await db.async_close()
+
+    archive = await hat.syslog.server.database.create_database(archive_path,
+                                                               False)
+    result = await archive.query(common.Filter())
+    assert result == list(reversed(entries[:6]))
+    await archive.async_close()
+
+
+async def test_group_commit(db_path, timestamp, create_msg):
+
+    def get_committed_count():
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM log").fetchone()[0]
+        finally:
+            conn.close()
+
+    db = await hat.syslog.server.database.create_database(db_path, False,
+                                                          commit_delay=0.1)
+    await db.wait_committed()
+
+    msgs = [create_msg() for i in range(10)]
+    entries1 = await db.add_msgs([(timestamp, msg) for msg in msgs[:5]])
+    entries2 = await db.add_msgs([(timestamp, msg) for msg in msgs[5:]])
+    assert [entry.id for entry in entries1 + entries2] == list(range(1, 11))
+    assert all(isinstance(entry.id, int) for entry in entries1 + entries2)
+
+    assert get_committed_count() == 0
+
+    await db.wait_committed()
+    assert get_committed_count() == 10
+
+    entries = await db.add_msgs([(timestamp, create_msg())])
+    assert entries[0].id == 11
+
+    await db.async_close()
+    assert get_committed_count() == 11
+
+
+async def test_archive_group_commit(tmp_path, db_path, timestamp,
+                                    create_msg):
+
+    def get_committed_count():
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM log").fetchone()[0]
+        finally:
+            conn.close()
+
+    db = await hat.syslog.server.database.create_database(db_path, False,
+                                                          commit_delay=10)
+
+    entries = await db.add_msgs([(timestamp, create_msg())
+                                 for _ in range(10)])
+    committed = asyncio.create_task(db.wait_committed())
+    await asyncio.sleep(0.01)
+
+    assert not committed.done()
+    assert get_committed_count() == 0
+
+    # group transaction is committed (and commit is signaled) prior to
+    # attaching archive database
+    await db.archive(tmp_path / 'archive.db', entries[4].id)
+
+    await asyncio.wait_for(committed, 1)
+    assert get_committed_count() == 10
+
+    entries.extend(await db.add_msgs([(timestamp, create_msg())]))
+    assert get_committed_count() == 10
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+
+    await db.async_close()
+    assert get_committed_count() == 11
+
+
+async def test_settings(db_path, timestamp, create_msg):
+    settings = hat.syslog.server.database.Settings(
+        page_size=8192,
+        journal_mode=hat.syslog.server.database.JournalMode.WAL,
+        synchronous=hat.syslog.server.database.Synchronous.NORMAL,
+        cache_size=-1024,
+        mmap_size=1024 * 1024,
+        temp_store=hat.syslog.server.database.TempStore.MEMORY,
+        wal_autocheckpoint=100)
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, commit_delay=0.1, settings=settings)
+
+    entries = await db.add_msgs([(timestamp, create_msg())])
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert conn.execute("PRAGMA page_size").fetchone()[0] == 8192
+
+        # reader is not blocked by pending write transaction
+        assert conn.execute("SELECT COUNT(*) FROM log").fetchone()[0] == 0
+
+        await db.wait_committed()
+        assert conn.execute("SELECT COUNT(*) FROM log").fetchone()[0] == 1
+
+    finally:
+        conn.close()
+
+    await db.async_close()
+
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    assert await db.get_last_id() == entries[0].id
+    await db.async_close()
+
+
+async def test_timestamp_query(db_path, timestamp, create_msg):
+
+    def get_timestamp(entry_id):
+        # system clock set back for entries 2001 - 2100
+        if 2000 < entry_id <= 2100:
+            return timestamp + entry_id - 1000
+        return timestamp + entry_id
+
+    def filter_entries(entries, timestamp_from, timestamp_to):
+        return [entry for entry in reversed(entries)
+                if ((timestamp_from is None or
+                     entry.timestamp >= timestamp_from) and
+                    (timestamp_to is None or
+                     entry.timestamp <= timestamp_to))]
+
+    ranges = [(timestamp + 1050, timestamp + 1060),
+              (timestamp + 2500, timestamp + 2600),
+              (timestamp + 2990, None),
+              (None, timestamp + 10),
+              (timestamp + 5000, None),
+              (None, timestamp)]
+
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    entries = [common.Entry(id=entry_id,
+                            timestamp=get_timestamp(entry_id),
+                            msg=create_msg())
+               for entry_id in range(1, 3001)]
+    await db.add_entries(entries)
+
+    for timestamp_from, timestamp_to in ranges:
+        filter = common.Filter(entry_timestamp_from=timestamp_from,
+                               entry_timestamp_to=timestamp_to)
+        result = await db.query(filter)
+        assert result == filter_entries(entries, timestamp_from,
+                                        timestamp_to)
+
+        plan = await db.explain_query(filter)
+        assert any('INTEGER PRIMARY KEY' in i for i in plan)
+        assert not any('TEMP B-TREE' in i for i in plan)
+
+    await db.delete(1500)
+    entries = entries[1499:]
+    await db.async_close()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT MIN(block) FROM log_time_block"
+                            ).fetchone()[0] == 1
+        conn.execute("DELETE FROM log_time_block")
+        conn.commit()
+
+    finally:
+        conn.close()
+
+    db = await hat.syslog.server.database.create_database(db_path, False)
+
+    for timestamp_from, timestamp_to in ranges:
+        filter = common.Filter(entry_timestamp_from=timestamp_from,
+                               entry_timestamp_to=timestamp_to)
+        result = await db.query(filter)
+        assert result == filter_entries(entries, timestamp_from,
+                                        timestamp_to)
+
+    await db.async_close()
+
+
+async def test_incremental_vacuum(db_path, timestamp, create_msg):
+    db = await hat.syslog.server.database.create_database(db_path, False)
+
+    entries = await db.add_msgs([(timestamp, create_msg())
+                                 for _ in range(1000)])
+    stats = await db.get_page_stats()
+    assert stats.freelist_count == 0
+    assert db_path.stat().st_size == stats.page_count * stats.page_size
+
+    await db.delete(entries[-1].id)
+    deleted_stats = await db.get_page_stats()
+    assert deleted_stats.page_count == stats.page_count
+    assert deleted_stats.freelist_count > 10
+
+    page_count = await db.incremental_vacuum(10)
+    assert page_count == 10
+
+    page_count = await db.incremental_vacuum(deleted_stats.freelist_count)
+    assert page_count == deleted_stats.freelist_count - 10
+
+    vacuumed_stats = await db.get_page_stats()
+    assert vacuumed_stats.freelist_count == 0
+    assert vacuumed_stats.page_count < stats.page_count
+    assert db_path.stat().st_size == (vacuumed_stats.page_count *
+                                      vacuumed_stats.page_size)
+
+    result = await db.query(common.Filter())
+    assert result == entries[-1:]
+
+    await db.async_close()
+
+
+@pytest.mark.parametrize('journal_mode', list(
+    hat.syslog.server.database.JournalMode))
+@pytest.mark.parametrize('auto_vacuum', [
+    None, hat.syslog.server.database.AutoVacuum.INCREMENTAL])
+async def test_auto_vacuum_journal_mode(db_path, timestamp, create_msg,
+                                        journal_mode, auto_vacuum):
+    settings = hat.syslog.server.database.Settings(
+        page_size=8192,
+        journal_mode=journal_mode,
+        auto_vacuum=auto_vacuum)
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, settings=settings)
+    entries = await db.add_msgs([(timestamp, create_msg())
+                                 for _ in range(1000)])
+    await db.delete(entries[-1].id)
+    assert await db.incremental_vacuum(10) > 0
+    await db.async_close()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        assert conn.execute("PRAGMA page_size").fetchone()[0] == 8192
+
+    finally:
+        conn.close()
+
+
+async def test_auto_vacuum_migration(db_path, timestamp, create_msg):
+
+    def get_auto_vacuum():
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+        finally:
+            conn.close()
+
+    settings = hat.syslog.server.database.Settings(
+        auto_vacuum=hat.syslog.server.database.AutoVacuum.NONE)
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, settings=settings)
+    entries = await db.add_msgs([(timestamp, create_msg())
+                                 for _ in range(100)])
+    await db.delete(entries[-1].id)
+    assert await db.incremental_vacuum(10) == 0
+    await db.async_close()
+    assert get_auto_vacuum() == 0
+
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    await db.async_close()
+    assert get_auto_vacuum() == 0
+
+    settings = hat.syslog.server.database.Settings(
+        auto_vacuum=hat.syslog.server.database.AutoVacuum.INCREMENTAL)
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, settings=settings)
+    stats = await db.get_page_stats()
+    assert stats.freelist_count == 0
+    result = await db.query(common.Filter())
+    assert result == entries[-1:]
+    await db.async_close()
+    assert get_auto_vacuum() == 2
+
+
+@pytest.mark.parametrize("wal_configured", [True, False])
+async def test_read_pool(db_path, timestamp, create_msg, wal_configured):
+    settings = hat.syslog.server.database.Settings(
+        journal_mode=hat.syslog.server.database.JournalMode.WAL)
+
+    # WAL journal mode is retained by database file
+    if not wal_configured:
+        db = await hat.syslog.server.database.create_database(
+            db_path, False, settings=settings)
+        await db.async_close()
+
+        settings = hat.syslog.server.database.Settings()
+
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, commit_delay=0.1, settings=settings, read_pool_size=2)
+
+    entries = await db.add_msgs([(timestamp, create_msg())])
+
+    results = await asyncio.gather(*(db.query(common.Filter())
+                                     for _ in range(5)))
+    assert results == [[]] * 5
+
+    await db.wait_committed()
+
+    results = await asyncio.gather(*(db.query(common.Filter())
+                                     for _ in range(5)))
+    assert results == [entries] * 5
+
+    await db.async_close()
+
+
+@pytest.mark.parametrize("fts_columns", [[], ['msg', 'hostname']])
+async def test_fulltext_query(db_path, timestamp, create_msg, fts_columns):
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, fts_columns=fts_columns)
+
+    msgs = [create_msg()._replace(msg='connection refused by peer'),
+            create_msg()._replace(msg='Connection established'),
+            create_msg()._replace(msg='disconnected'),
+            create_msg()._replace(hostname='server1', msg=None)]
+    entries = await db.add_msgs([(timestamp, msg) for msg in msgs])
+    entries = list(reversed(entries))
+
+    async def query(**kwargs):
+        return await db.query(common.Filter(
+            match_type=common.MatchType.FULLTEXT, **kwargs))
+
+    assert await query(msg='connection') == entries[2:]
+    assert await query(msg='refused connection') == entries[3:]
+    assert await query(msg='established') == entries[2:3]
+    assert await query(hostname='server1') == entries[:1]
+
+    if fts_columns:
+        assert await query(msg='conn') == []
+        assert await query(msg='conn*') == entries[2:]
+
+    else:
+        assert await query(msg='conn') == entries[1:]
+        assert await query(msg='conn*') == entries[1:]
+
+    await db.delete(entries[2].id + 1)
+    assert await query(msg='connection') == []
+
+    await db.async_close()
+
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, fts_columns=['msg'])
+    assert await db.query(common.Filter(
+        msg='disconnected',
+        match_type=common.MatchType.FULLTEXT)) == entries[1:2]
+    await db.async_close()
+
+
+@pytest.mark.parametrize("indexes", [[], ['severity', 'hostname']])
+async def test_exact_and_prefix_query(db_path, timestamp, create_msg,
+                                      indexes):
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, indexes=indexes)
+
+    msgs = [create_msg(hostname='host'),
+            create_msg(hostname='host1'),
+            create_msg(hostname='Host2'),
+            create_msg(hostname='other host'),
+            create_msg(hostname='hos\U0010ffff')]
+    entries = await db.add_msgs([(timestamp, msg) for msg in msgs])
+    entries = list(reversed(entries))
+
+    async def query(match_type, **kwargs):
+        return await db.query(common.Filter(match_type=match_type, **kwargs))
+
+    result = await query(common.MatchType.EXACT, hostname='host')
+    assert result == entries[4:]
+
+    result = await query(common.MatchType.EXACT, hostname='hos')
+    assert result == []
+
+    result = await query(common.MatchType.PREFIX, hostname='host')
+    assert result == entries[3:]
+
+    result = await query(common.MatchType.PREFIX, hostname='hos')
+    assert result == [entries[0], *entries[3:]]
+
+    result = await query(common.MatchType.PREFIX, hostname='hos\U0010ffff')
+    assert result == entries[:1]
+
+    result = await query(common.MatchType.CONTAINS, hostname='host')
+    assert result == entries[1:]
+
+    await db.async_close()
+
+
+@pytest.mark.parametrize("indexes, filter, plan", [
+    ([],
+     common.Filter(severity=common.Severity.ERROR),
+     ['SCAN log']),
+    (['severity'],
+     common.Filter(severity=common.Severity.ERROR),
+     ['SEARCH log USING INDEX log_severity_index (severity=?)']),
+    (['severity', 'hostname'],
+     common.Filter(severity=common.Severity.ERROR,
+                   hostname='host',
+                   match_type=common.MatchType.EXACT),
+     ['SEARCH log USING INDEX log_hostname_index (hostname_id=?)',
+      'SCALAR SUBQUERY 1',
+      'SEARCH log_hostname USING COVERING INDEX '
+      'sqlite_autoindex_log_hostname_1 (value=?)']),
+    (['severity', 'hostname'],
+     common.Filter(severity=common.Severity.ERROR,
+                   hostname='host',
+                   match_type=common.MatchType.CONTAINS),
+     ['SEARCH log USING INDEX log_severity_index (severity=?)',
+      'LIST SUBQUERY 1',
+      'SCAN log_hostname']),
+    (['severity', 'hostname'],
+     common.Filter(hostname='host',
+                   match_type=common.MatchType.PREFIX),
+     ['SEARCH log USING INDEX log_hostname_index (hostname_id=?)',
+      'LIST SUBQUERY 1',
+      'SEARCH log_hostname USING COVERING INDEX '
+      'sqlite_autoindex_log_hostname_1 (value>? AND value<?)',
+      'USE TEMP B-TREE FOR ORDER BY']),
+    (['severity', 'hostname', 'app_name'],
+     common.Filter(severity=common.Severity.ERROR,
+                   hostname='host',
+                   app_name='app',
+                   match_type=common.MatchType.PREFIX),
+     ['SEARCH log USING INDEX log_severity_index (severity=?)',
+      'LIST SUBQUERY 1',
+      'SEARCH log_hostname USING COVERING INDEX '
+      'sqlite_autoindex_log_hostname_1 (value>? AND value<?)',
+      'LIST SUBQUERY 2',
+      'SEARCH log_app_name USING COVERING INDEX '
+      'sqlite_autoindex_log_app_name_1 (value>? AND value<?)']),
+    (['app_name'],
+     common.Filter(app_name='app',
+                   last_id=100,
+                   match_type=common.MatchType.EXACT),
+     ['SEARCH log USING INDEX log_app_name_index '
+      '(app_name_id=? AND rowid<?)',
+      'SCALAR SUBQUERY 1',
+      'SEARCH log_app_name USING COVERING INDEX '
+      'sqlite_autoindex_log_app_name_1 (value=?)']),
+])
+async def test_query_plan(db_path, indexes, filter, plan):
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, indexes=indexes)
+
+    result = await db.explain_query(filter)
+    assert result == plan
+
+    await db.async_close()
+
+
+async def test_query_stats(monkeypatch, caplog, db_path, timestamp,
+                           create_msg):
+    monkeypatch.setattr(hat.syslog.server.database, 'query_interrupt_steps',
+                        100)
+
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, indexes=['severity'])
+    msgs = [create_msg(hostname=f'host{i % 2}') for i in range(100)]
+    await db.add_msgs([(timestamp, msg) for msg in msgs])
+
+    assert db.query_stats.get() == {}
+
+    hostname_filter = common.Filter(hostname='host1',
+                                    match_type=common.MatchType.EXACT)
+    hostname_shape = ('hostname:EXACT', )
+    severity_filter = common.Filter(severity=common.Severity.ERROR,
+                                    max_results=10)
+    severity_shape = ('severity', )
+
+    for _ in range(2):
+        result = await db.query(hostname_filter)
+        assert len(result) == 50
+
+    result = await db.query(severity_filter)
+    assert len(result) == 10
+
+    stats = db.query_stats.get()
+    assert stats.keys() == {hostname_shape, severity_shape}
+
+    assert stats[hostname_shape].count == 2
+    assert stats[hostname_shape].timeout_count == 0
+    assert stats[hostname_shape].total_rows == 100
+    assert stats[hostname_shape].total_steps > 0
+    assert stats[hostname_shape].total_duration >= \
+        stats[hostname_shape].max_duration > 0
+    assert stats[hostname_shape].plan == await db.explain_query(
+        hostname_filter)
+
+    assert stats[severity_shape].count == 1
+    assert stats[severity_shape].total_rows == 10
+    assert stats[severity_shape].plan == await db.explain_query(
+        severity_filter)
+
+    assert not any('slow query' in i.message for i in caplog.records)
+    monkeypatch.setattr(hat.syslog.server.database, 'slow_query_duration',
+                        0)
+
+    await db.query(severity_filter)
+
+    stats = db.query_stats.get()
+    assert stats[severity_shape].count == 2
+    assert stats[severity_shape].slow_count == 1
+    assert any('slow query' in i.message for i in caplog.records)
+
+    await db.async_close()
+
+
+@pytest.mark.parametrize("filter, shape", [
+    (common.Filter(),
+     ()),
+    (common.Filter(max_results=10,
+                   match_type=common.MatchType.PREFIX),
+     ()),
+    (common.Filter(last_id=10,
+                   entry_timestamp_from=0,
+                   facility=common.Facility.USER,
+                   app_name='app',
+                   msg='abc'),
+     ('last_id', 'entry_timestamp_from', 'facility', 'app_name:CONTAINS',
+      'msg:CONTAINS')),
+    (common.Filter(hostname='',
+                   procid='1',
+                   match_type=common.MatchType.FULLTEXT),
+     ('procid:FULLTEXT', )),
+])
+def test_filter_shape(filter, shape):
+    result = hat.syslog.server.database.get_filter_shape(filter)
+    assert result == shape
+
+
+async def test_indexes(db_path):
+
+    def get_indexes():
+        conn = sqlite3.connect(db_path)
+        try:
+            c = conn.execute("SELECT name FROM sqlite_master "
+                             "WHERE type = 'index' AND tbl_name = 'log'")
+            return {row[0] for row in c.fetchall()}
+        finally:
+            conn.close()
+
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, indexes=['severity', 'hostname'])
+    await db.async_close()
+
+    assert get_indexes() == {'log_entry_timestamp_index',
+                             'log_severity_index',
+                             'log_hostname_index'}
+
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, indexes=['hostname', 'msgid'])
+    await db.async_close()
+
+    assert get_indexes() == {'log_entry_timestamp_index',
+                             'log_hostname_index',
+                             'log_msgid_index'}
+
+
+async def test_dictionary(db_path, timestamp, create_msg):
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    msgs = [create_msg(hostname=f'host{i % 2}') for i in range(10)]
+    entries = await db.add_msgs([(timestamp, msg) for msg in msgs])
+    await db.async_close()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        c = conn.execute("SELECT value FROM log_hostname ORDER BY id")
+        assert [row[0] for row in c.fetchall()] == ['host0', 'host1']
+
+        c = conn.execute("SELECT DISTINCT hostname_id FROM log")
+        assert {row[0] for row in c.fetchall()} == {1, 2}
+
+    finally:
+        conn.close()
+
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+
+    result = await db.query(common.Filter(hostname='host1'))
+    assert result == list(reversed(entries[1::2]))
+    await db.async_close()
+
+
+async def test_dictionary_cache_size(monkeypatch, db_path, timestamp,
+                                     create_msg):
+    monkeypatch.setattr(hat.syslog.server.database, 'dictionary_cache_size',
+                        2)
+
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    msgs = [create_msg(procid=i) for i in range(10)]
+    entries = await db.add_msgs([(timestamp, msg) for msg in msgs])
+    entries.extend(await db.add_msgs([(timestamp, msg) for msg in msgs]))
+
+    assert len(db._dictionary._ids) == 2
+    assert len(db._dictionary._values) == 0
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+    assert len(db._dictionary._values) == 2
+
+    conn = sqlite3.connect(db_path)
+    try:
+        c = conn.execute("SELECT COUNT(*) FROM log_procid")
+        assert c.fetchone()[0] == 10
+
+    finally:
+        conn.close()
+
+    await db.async_close()
+
+
+async def test_delete_unused_indexed_values(monkeypatch, db_path,
+                                            timestamp, create_msg):
+    scan_ids = []
+    get_used_values = hat.syslog.server.database._ext_get_used_values
+
+    def ext_get_used_values(conn, used, start_id, end_id):
+        scan_ids.append(start_id)
+        get_used_values(conn, used, start_id, end_id)
+
+    monkeypatch.setattr(hat.syslog.server.database, '_ext_get_used_values',
+                        ext_get_used_values)
+
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, indexes=['hostname'])
+    msgs = [create_msg(procid=i,
+                       hostname=f'host{i}',
+                       severity=(common.Severity.DEBUG if i == 4
+                                 else common.Severity.ERROR))
+            for i in range(10)]
+    entries = await db.add_msgs([(timestamp, msg) for msg in msgs])
+
+    count = await db.delete_unused_values()
+    assert count == 0
+
+    # host4 is referenced by summary, host0 by remaining entry
+    await db.delete(entries[3].id)
+    await db.delete_severity(common.Severity.DEBUG, 0, entries[5].id, True)
+    msgs.append(create_msg(procid=0, hostname='host0'))
+    entries.append((await db.add_msgs([(timestamp, msgs[-1])]))[0])
+
+    count = await db.delete_unused_values()
+    assert count == 2
+    assert scan_ids == []
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed([*entries[3:4], *entries[5:]]))
+
+    summaries = await db.query_summaries()
+    assert [i.hostname for i in summaries] == ['host4']
+
+    entry = (await db.add_msgs([(timestamp, create_msg(procid=1,
+                                                       hostname='host1'))]))[0]
+    result = await db.query(common.Filter(hostname='host1'))
+    assert result == [entry]
+
+    await db.async_close()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        c = conn.execute("SELECT value FROM log_hostname ORDER BY id")
+        assert [row[0] for row in c.fetchall()] == [
+            'host0', *(f'host{i}' for i in range(3, 10)), 'host1']
+
+        # procid is not indexed
+        c = conn.execute("SELECT COUNT(*) FROM log_procid")
+        assert c.fetchone()[0] == 10
+
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 100])
+async def test_delete_unused_values(db_path, timestamp, create_msg,
+                                    chunk_size):
+    db = await hat.syslog.server.database.create_database(db_path, False)
+    msgs = [create_msg(procid=i,
+                       hostname=f'host{i}',
+                       severity=(common.Severity.DEBUG if i < 5
+                                 else common.Severity.ERROR))
+            for i in range(10)]
+    entries = await db.add_msgs([(timestamp, msg) for msg in msgs])
+
+    # entries are scanned only once number of deleted entries reaches
+    # number of remaining entries
+    await db.delete_severity(common.Severity.DEBUG, 0, entries[2].id, True)
+    await db.delete(entries[3].id)
+    count = await db.delete_unused_values(chunk_size)
+    assert count == 0
+
+    msgs.append(create_msg(procid=4, hostname='host4'))
+    entries.append((await db.add_msgs([(timestamp, msgs[-1])]))[0])
+    await db.delete(entries[6].id)
+
+    # procid 0 - 3, 5 and hostname 2 - 3, 5 are not referenced
+    count = await db.delete_unused_values(chunk_size)
+    assert count == 8
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries[6:]))
+
+    summaries = await db.query_summaries()
+    assert {i.hostname for i in summaries} == {'host0', 'host1'}
+
+    entry = (await db.add_msgs([(timestamp, create_msg(procid=0))]))[0]
+    result = await db.query(common.Filter(procid='0'))
+    assert result == [entry]
+
+    await db.async_close()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        c = conn.execute("SELECT value FROM log_procid ORDER BY id")
+        assert [row[0] for row in c.fetchall()] == [
+            '4', '6', '7', '8', '9', '0']
+
+    finally:
+        conn.close()
+
+
+async def test_migration(db_path, timestamp, create_msg):
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript("""
+            CREATE TABLE log (
+                entry_timestamp REAL, facility INTEGER, severity INTEGER,
+                version INTEGER, msg_timestamp REAL, hostname TEXT,
+                app_name TEXT, procid TEXT, msgid TEXT, data TEXT, msg TEXT);
+            CREATE INDEX log_entry_timestamp_index ON log (
+                entry_timestamp DESC)
+            """)
+        entries = []
+        for i in range(10):
+            msg = create_msg(procid=i % 3)._replace(msgid=None)
+            c = conn.execute(
+                "INSERT INTO log VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "RETURNING CAST(rowid AS INTEGER)",
+                (timestamp, msg.facility.value, msg.severity.value,
+                 msg.version, msg.timestamp, msg.hostname, msg.app_name,
+                 msg.procid, msg.msgid, msg.data, msg.msg))
+            entries.append(common.Entry(id=c.fetchone()[0],
+                                        timestamp=timestamp,
+                                        msg=msg))
+        conn.commit()
+
+    finally:
+        conn.close()
+
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, fts_columns=['msg', 'hostname'],
+        indexes=['hostname'])
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+
+    result = await db.query(common.Filter(procid='1'))
+    assert result == list(reversed(entries[1::3]))
+
+    result = await db.query(common.Filter(
+        hostname=entries[0].msg.hostname,
+        msg='no 3',
+        match_type=common.MatchType.FULLTEXT))
+    assert result == [entries[2]]
+
+    await db.async_close()
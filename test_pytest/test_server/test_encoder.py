@@ -30,7 +30,10 @@ filters = [
         app_name=None,
         procid=None,
         msgid=None,
-        msg=None)]
+        msg=None),
+    common.Filter(
+        msg='this is message',
+        match_type=common.MatchType.FULLTEXT)]
 
 entries = [
     common.Entry(
@@ -0,0 +1,174 @@
+import pytest
+
+from hat import aio
+from hat import json
+
+from hat.syslog.server import common
+import hat.syslog.server.ratelimit
+
+
+@pytest.fixture
+def create_msg():
+
+    def create_msg(hostname='host', app_name='app'):
+        return common.Msg(facility=common.Facility.USER,
+                          severity=common.Severity.ERROR,
+                          version=1,
+                          timestamp=None,
+                          hostname=hostname,
+                          app_name=app_name,
+                          procid=None,
+                          msgid=None,
+                          data=None,
+                          msg='abc')
+
+    return create_msg
+
+
+@pytest.mark.parametrize("limit_str, limit", [
+    ('10', (10, 10)),
+    ('10:100', (10, 100)),
+    ('0.5', (0.5, 1)),
+    ('0.5:3', (0.5, 3)),
+])
+def test_parse_limit(limit_str, limit):
+    result = hat.syslog.server.ratelimit.parse_limit(limit_str)
+    assert result == limit
+
+
+@pytest.mark.parametrize("limit_str", ['0', '-1', '1:0', 'abc'])
+def test_parse_invalid_limit(limit_str):
+    with pytest.raises(ValueError):
+        hat.syslog.server.ratelimit.parse_limit(limit_str)
+
+
+async def test_default_limit(create_msg):
+    limit = hat.syslog.server.ratelimit.Limit(rate=1e-3, burst=3)
+    limiter = await hat.syslog.server.ratelimit.create_rate_limiter(
+        limit, {}, lambda _: None)
+
+    for _ in range(3):
+        assert limiter.check('1.2.3.4', create_msg())
+    assert not limiter.check('1.2.3.4', create_msg())
+
+    for _ in range(3):
+        assert limiter.check('4.3.2.1', create_msg(app_name='other'))
+    assert not limiter.check('4.3.2.1', create_msg(app_name='other'))
+
+    assert not limiter.check('5.6.7.8', create_msg())
+    assert limiter.check('5.6.7.8', create_msg(hostname='other'))
+
+    await limiter.async_close()
+
+
+async def test_overrides(create_msg):
+    Limit = hat.syslog.server.ratelimit.Limit
+    OverrideKind = hat.syslog.server.ratelimit.OverrideKind
+    limit = Limit(rate=1e-3, burst=1)
+    limiter = await hat.syslog.server.ratelimit.create_rate_limiter(
+        limit, {(OverrideKind.ADDR, '1.2.3.4'): Limit(1e-3, 5),
+                (OverrideKind.APP_NAME, 'app'): Limit(1e-3, 10),
+                (OverrideKind.HOSTNAME, '1.2.3.4'): Limit(1e-3, 20)},
+        lambda _: None)
+
+    for _ in range(5):
+        assert limiter.check('1.2.3.4', create_msg())
+    assert not limiter.check('1.2.3.4', create_msg())
+
+    assert limiter.check('4.3.2.1', create_msg())
+    assert not limiter.check('4.3.2.1', create_msg())
+
+    for i in range(4):
+        assert limiter.check(f'5.5.5.{i}', create_msg())
+    assert not limiter.check('6.6.6.6', create_msg())
+
+    await limiter.async_close()
+
+
+@pytest.mark.parametrize('override_str, key, limit', [
+    ('addr:1.2.3.4=2', ('ADDR', '1.2.3.4'), (2, 2)),
+    ('addr:::1=2:5', ('ADDR', '::1'), (2, 5)),
+    ('hostname:a=b=1', ('HOSTNAME', 'a=b'), (1, 1)),
+    ('app_name:app=0.5', ('APP_NAME', 'app'), (0.5, 1)),
+])
+def test_parse_override(override_str, key, limit):
+    result = hat.syslog.server.ratelimit.parse_override(override_str)
+    kind, value = key
+    assert result == ((hat.syslog.server.ratelimit.OverrideKind[kind], value),
+                      limit)
+
+
+@pytest.mark.parametrize('override_str', [
+    '1.2.3.4=2',
+    'addr:=2',
+    'abc:1.2.3.4=2',
+    'addr:1.2.3.4',
+])
+def test_parse_invalid_override(override_str):
+    with pytest.raises(ValueError):
+        hat.syslog.server.ratelimit.parse_override(override_str)
+
+
+async def test_max_buckets(monkeypatch, create_msg):
+    monkeypatch.setattr(hat.syslog.server.ratelimit, 'max_buckets', 4)
+
+    limit = hat.syslog.server.ratelimit.Limit(rate=1e-3, burst=1)
+    limiter = await hat.syslog.server.ratelimit.create_rate_limiter(
+        limit, {}, lambda _: None)
+
+    assert limiter.check('1.2.3.4', create_msg())
+    assert not limiter.check('1.2.3.4', create_msg())
+
+    for i in range(4):
+        assert limiter.check(f'5.5.5.{i}', create_msg(app_name=str(i)))
+    assert len(limiter._buckets) == 4
+
+    # least recently used bucket is removed
+    assert limiter.check('1.2.3.4', create_msg())
+
+    await limiter.async_close()
+
+
+async def test_summary(monkeypatch, create_msg):
+    monkeypatch.setattr(hat.syslog.server.ratelimit, 'summary_interval',
+                        0.01)
+
+    msg_queue = aio.Queue()
+    limit = hat.syslog.server.ratelimit.Limit(rate=1e-3, burst=1)
+    limiter = await hat.syslog.server.ratelimit.create_rate_limiter(
+        limit, {}, msg_queue.put_nowait)
+
+    for _ in range(4):
+        limiter.check('1.2.3.4', create_msg())
+
+    msg = await msg_queue.get()
+    assert msg.facility == common.Facility.INTERNAL
+    assert msg.severity == common.Severity.WARNING
+    assert json.decode(msg.data) == {
+        'ratelimit@hat': {'addr:1.2.3.4': '3'}}
+
+    await limiter.async_close()
+
+
+async def test_summary_max_sources(monkeypatch, create_msg):
+    monkeypatch.setattr(hat.syslog.server.ratelimit, 'summary_interval',
+                        0.01)
+    monkeypatch.setattr(hat.syslog.server.ratelimit, 'summary_max_sources',
+                        2)
+
+    msg_queue = aio.Queue()
+    limit = hat.syslog.server.ratelimit.Limit(rate=1e-3, burst=1)
+    limiter = await hat.syslog.server.ratelimit.create_rate_limiter(
+        limit, {}, msg_queue.put_nowait)
+
+    for i in range(4):
+        for _ in range(2):
+            limiter.check(f'1.2.3.{i}', create_msg(app_name=str(i)))
+
+    msg = await msg_queue.get()
+    assert json.decode(msg.data) == {
+        'ratelimit@hat': {'addr:1.2.3.0': '1',
+                          'addr:1.2.3.1': '1',
+                          'other': '2'}}
+
+    await limiter.async_close()
@@ -0,0 +1,107 @@
+from pathlib import Path
+
+import pytest
+
+from hat import json
+
+from hat.syslog.server import common
+from hat.syslog.server import rules
+
+
+def create_msg(facility=common.Facility.USER,
+               severity=common.Severity.ERROR,
+               hostname='host',
+               app_name='app',
+               msgid='msgid',
+               msg='message'):
+    return common.Msg(facility=facility,
+                      severity=severity,
+                      version=1,
+                      timestamp=None,
+                      hostname=hostname,
+                      app_name=app_name,
+                      procid=None,
+                      msgid=msgid,
+                      data=None,
+                      msg=msg)
+
+
+def test_empty_conf():
+    conf = rules.parse_conf({})
+    assert conf == rules.Conf(databases={}, rules=[])
+
+    route = rules.compile_rules(conf.rules)
+    assert route(create_msg()) == rules.main_database
+
+
+def test_load_conf(tmp_path):
+    path = tmp_path / 'rules.yaml'
+    json.encode_file({'databases': {'debug': {'path': 'debug.db',
+                                              'high_size': 10}},
+                      'rules': [{'severity': 'DEBUG',
+                                 'action': 'route',
+                                 'database': 'debug'}]}, path)
+
+    conf = rules.load_conf(path)
+    assert conf.databases == {
+        'debug': rules.DatabaseConf(path=Path('debug.db'),
+                                    high_size=10)}
+    assert conf.rules == [
+        rules.Rule(action=rules.Action.ROUTE,
+                   database='debug',
+                   severities=frozenset([common.Severity.DEBUG]))]
+
+
+@pytest.mark.parametrize("data", [
+    [],
+    {'databases': {'main': {'path': 'x.db'}}},
+    {'databases': {'x': {}}},
+    {'databases': {'x': {'path': 1}}},
+    {'rules': [{}]},
+    {'rules': [{'action': 'abc'}]},
+    {'rules': [{'action': 'route'}]},
+    {'rules': [{'action': 'route', 'database': 'x'}]},
+    {'databases': {'x': {'path': 'x.db'}},
+     'rules': [{'action': 'drop', 'database': 'x'}]},
+    {'rules': [{'action': 'drop', 'severity': 'abc'}]},
+    {'rules': [{'action': 'drop', 'hostname': 1}]},
+])
+def test_invalid_conf(data):
+    with pytest.raises(ValueError):
+        rules.parse_conf(data)
+
+
+def test_route():
+    conf = rules.parse_conf({
+        'databases': {'debug': {'path': 'debug.db'}},
+        'rules': [{'app_name': 'important',
+                   'action': 'keep'},
+                  {'severity': ['DEBUG', 'INFORMATIONAL'],
+                   'app_name': 'noisy',
+                   'action': 'drop'},
+                  {'severity': 'DEBUG',
+                   'action': 'route',
+                   'database': 'debug'},
+                  {'facility': 'KERNEL',
+                   'msg': 'xyz',
+                   'action': 'drop'}]})
+    route = rules.compile_rules(conf.rules)
+
+    assert route(create_msg()) == 'main'
+    assert route(create_msg(severity=common.Severity.DEBUG)) == 'debug'
+    assert route(create_msg(severity=common.Severity.DEBUG,
+                            app_name='very important')) == 'main'
+    assert route(create_msg(severity=common.Severity.DEBUG,
+                            app_name='noisy app')) is None
+    assert route(create_msg(severity=common.Severity.INFORMATIONAL,
+                            app_name='noisy app')) is None
+    assert route(create_msg(severity=common.Severity.ERROR,
+                            app_name='noisy app')) == 'main'
+    assert route(create_msg(facility=common.Facility.KERNEL)) == 'main'
+    assert route(create_msg(facility=common.Facility.KERNEL,
+                            msg='abc xyz')) is None
+    assert route(create_msg(facility=common.Facility.KERNEL,
+                            app_name=None,
+                            msg='abc xyz')) is None
+    assert route(create_msg(facility=common.Facility.KERNEL,
+                            msg=None)) == 'main'
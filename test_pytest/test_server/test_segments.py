@@ -0,0 +1,271 @@
+import datetime
+import sqlite3
+
+import pytest
+
+from hat.syslog.server import common
+import hat.syslog.server.database
+import hat.syslog.server.segments
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / 'syslog.db'
+
+
+@pytest.fixture
+def timestamp():
+    dt = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+@pytest.fixture
+def create_msg(timestamp):
+    counter = 0
+
+    def create_msg():
+        nonlocal counter
+        counter += 1
+        return common.Msg(facility=common.Facility.USER,
+                          severity=common.Severity.ERROR,
+                          version=1,
+                          timestamp=timestamp,
+                          hostname='hostname',
+                          app_name='app_name',
+                          procid='procid',
+                          msgid='test_syslog.segments',
+                          data="",
+                          msg=f'message no {counter}')
+
+    return create_msg
+
+
+@pytest.mark.parametrize("conf_str, conf", [
+    ('hour',
+     hat.syslog.server.segments.SegmentConf(
+        period=hat.syslog.server.segments.SegmentPeriod.HOUR)),
+    ('day',
+     hat.syslog.server.segments.SegmentConf(
+        period=hat.syslog.server.segments.SegmentPeriod.DAY)),
+    ('123',
+     hat.syslog.server.segments.SegmentConf(
+        period=hat.syslog.server.segments.SegmentPeriod.SIZE,
+        size=123)),
+])
+def test_parse_segment_conf(conf_str, conf):
+    result = hat.syslog.server.segments.parse_segment_conf(conf_str)
+    assert result == conf
+
+
+@pytest.mark.parametrize("conf_str", ['week', '0', '-1'])
+def test_parse_invalid_segment_conf(conf_str):
+    with pytest.raises(ValueError):
+        hat.syslog.server.segments.parse_segment_conf(conf_str)
+
+
+async def test_size_segments(db_path, timestamp, create_msg):
+    conf = hat.syslog.server.segments.parse_segment_conf('3')
+    db = await hat.syslog.server.segments.create_segmented_database(
+        db_path, conf, False)
+    assert db.segment_count == 0
+    assert await db.get_first_id() is None
+    assert await db.get_last_id() is None
+
+    entries = await db.add_msgs([(timestamp, create_msg())
+                                 for _ in range(7)])
+    assert [entry.id for entry in entries] == list(range(1, 8))
+    assert db.segment_count == 3
+    assert await db.get_first_id() == 1
+    assert await db.get_last_id() == 7
+
+    segments_dir = hat.syslog.server.segments.get_segments_dir(db_path)
+    assert {i.name for i in segments_dir.glob('*.db')} == {'1.db', '4.db',
+                                                           '7.db'}
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+
+    result = await db.query(common.Filter(max_results=4))
+    assert result == list(reversed(entries))[:4]
+
+    result = await db.query(common.Filter(last_id=5, max_results=3))
+    assert result == list(reversed(entries[:5]))[:3]
+
+    await db.async_close()
+
+    db = await hat.syslog.server.segments.create_segmented_database(
+        db_path, conf, False)
+    assert db.segment_count == 3
+    assert await db.get_last_id() == 7
+
+    entries += await db.add_msgs([(timestamp, create_msg())
+                                  for _ in range(3)])
+    assert [entry.id for entry in entries] == list(range(1, 11))
+    assert db.segment_count == 4
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+
+    await db.async_close()
+
+
+async def test_group_commit(db_path, timestamp, create_msg):
+    segments_dir = hat.syslog.server.segments.get_segments_dir(db_path)
+
+    def get_committed_count(first_id):
+        conn = sqlite3.connect(segments_dir / f'{first_id}.db')
+        try:
+            return conn.execute("SELECT COUNT(*) FROM log").fetchone()[0]
+        finally:
+            conn.close()
+
+    conf = hat.syslog.server.segments.parse_segment_conf('5')
+    db = await hat.syslog.server.segments.create_segmented_database(
+        db_path, conf, False, commit_delay=0.1)
+
+    entries = await db.add_msgs([(timestamp, create_msg())
+                                 for _ in range(3)])
+    assert get_committed_count(1) == 0
+
+    await db.wait_committed()
+    assert get_committed_count(1) == 3
+
+    # previous head is committed once new head is created
+    entries += await db.add_msgs([(timestamp, create_msg())
+                                  for _ in range(4)])
+    assert get_committed_count(1) == 5
+    assert get_committed_count(6) == 0
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+
+    await db.wait_committed()
+    assert get_committed_count(6) == 2
+
+    await db.async_close()
+
+
+async def test_time_segments(db_path, timestamp, create_msg):
+    conf = hat.syslog.server.segments.parse_segment_conf('hour')
+    db = await hat.syslog.server.segments.create_segmented_database(
+        db_path, conf, False)
+
+    entries = await db.add_msgs([(timestamp, create_msg()),
+                                 (timestamp + 60, create_msg()),
+                                 (timestamp + 3600, create_msg()),
+                                 (timestamp + 3 * 3600, create_msg())])
+    assert db.segment_count == 3
+
+    entries += await db.add_msgs([(timestamp + 3 * 3600 + 1, create_msg())])
+    assert db.segment_count == 3
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+
+    await db.async_close()
+
+
+async def test_segment_cache(monkeypatch, db_path, timestamp, create_msg):
+    monkeypatch.setattr(hat.syslog.server.segments, 'segment_cache_size', 3)
+
+    opened = []
+    create_database = hat.syslog.server.database.create_database
+
+    async def create_database_mock(path, *args, **kwargs):
+        opened.append(path.name)
+        return await create_database(path, *args, **kwargs)
+
+    monkeypatch.setattr(hat.syslog.server.database, 'create_database',
+                        create_database_mock)
+
+    conf = hat.syslog.server.segments.parse_segment_conf('hour')
+    db = await hat.syslog.server.segments.create_segmented_database(
+        db_path, conf, False)
+
+    entries = await db.add_msgs([(timestamp + i * 3600, create_msg())
+                                 for i in range(5)])
+    assert db.segment_count == 5
+    assert opened == ['1.db', '2.db', '3.db', '4.db', '5.db']
+
+    # timestamp ranges of segments which were head segments are known
+    opened.clear()
+    result = await db.query(common.Filter(
+        entry_timestamp_from=timestamp + 3600,
+        entry_timestamp_to=timestamp + 2 * 3600))
+    assert result == list(reversed(entries[1:3]))
+    assert opened == ['3.db', '2.db']
+
+    opened.clear()
+    for _ in range(3):
+        result = await db.query(common.Filter(
+            entry_timestamp_to=timestamp + 2 * 3600))
+        assert result == list(reversed(entries[:3]))
+    assert opened == ['1.db']
+
+    await db.async_close()
+
+    # timestamp ranges of segments are known once segments are opened
+    opened.clear()
+    db = await hat.syslog.server.segments.create_segmented_database(
+        db_path, conf, False)
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries))
+    assert opened == ['5.db', '4.db', '3.db', '2.db', '1.db']
+
+    opened.clear()
+    result = await db.query(common.Filter(
+        entry_timestamp_from=timestamp + 3 * 3600))
+    assert result == list(reversed(entries[3:]))
+    assert opened == ['4.db']
+
+    await db.async_close()
+
+
+@pytest.mark.parametrize("archive", [False, True])
+async def test_remove_segments(tmp_path, db_path, timestamp, create_msg,
+                               archive):
+    conf = hat.syslog.server.segments.parse_segment_conf('3')
+    db = await hat.syslog.server.segments.create_segmented_database(
+        db_path, conf, False)
+
+    entries = await db.add_msgs([(timestamp, create_msg())
+                                 for _ in range(8)])
+    assert db.segment_count == 3
+
+    archive_paths = iter(tmp_path / f'archive{i}.db' for i in range(10))
+
+    def move_segment(path):
+        archive_path = next(archive_paths)
+        path.rename(archive_path)
+        return archive_path
+
+    archive_segment = move_segment if archive else None
+
+    count = await db.remove_segments(3, archive_segment)
+    assert count == 0
+
+    count = await db.remove_segments(6, archive_segment)
+    assert count == 1
+    assert db.segment_count == 2
+    assert await db.get_first_id() == 4
+
+    result = await db.query(common.Filter())
+    assert result == list(reversed(entries[3:]))
+
+    count = await db.remove_segments(9, archive_segment)
+    assert count == 2
+    assert db.segment_count == 0
+    assert await db.get_first_id() is None
+
+    result = await db.query(common.Filter())
+    assert result == []
+
+    assert (tmp_path / 'archive0.db').exists() == archive
+    assert (tmp_path / 'archive2.db').exists() == archive
+
+    entries = await db.add_msgs([(timestamp, create_msg())])
+    assert entries[0].id == 9
+    assert await db.get_first_id() == 9
+
+    await db.async_close()
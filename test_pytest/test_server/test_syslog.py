@@ -1,3 +1,4 @@
+import asyncio
 import inspect
 import logging.config
 import os
@@ -14,7 +15,9 @@ from hat import json
 from hat import util
 
 from hat.syslog.server import common
+from hat.syslog.server import encoder
 import hat.syslog.handler
+import hat.syslog.server.ratelimit
 import hat.syslog.server.syslog
 
 
@@ -23,7 +26,7 @@ def syslog_port():
     return util.get_unused_tcp_port()
 
 
-@pytest.fixture(params=['tcp', 'tls', 'udp'])
+@pytest.fixture(params=['tcp', 'tls', 'udp', 'relp'])
 def comm_type(request):
     return request.param
 
@@ -124,3 +127,322 @@ async def test_exc_info(message_queue, logger):
     msg_data = json.decode(msg.data)
     assert msg_data['hat@1']['exc_info'] == exc_info_exp
     assert msg.msg == 'an exception occured: Exception!'
+
+
+async def test_pause_reading(create_syslog_server, logger, comm_type):
+    queue = aio.Queue()
+    server = await create_syslog_server(queue.put_nowait)
+
+    logger.info('first')
+    msg = await queue.get()
+    assert msg.msg == 'first'
+
+    assert not server.is_paused
+    assert server.stats.stall_time == 0
+    assert server.stats.dropped == 0
+
+    server.pause_reading()
+    assert server.is_paused
+
+    logger.info('second')
+
+    if comm_type == 'udp':
+        while not server.stats.dropped:
+            await asyncio.sleep(0.01)
+        assert server.stats.dropped == 1
+
+    else:
+        await asyncio.sleep(0.05)
+        assert server.stats.dropped == 0
+
+    assert queue.empty()
+
+    server.resume_reading()
+    assert not server.is_paused
+    assert server.stats.stall_time > 0
+
+    logger.info('third')
+
+    if comm_type != 'udp':
+        msg = await queue.get()
+        assert msg.msg == 'second'
+
+    msg = await queue.get()
+    assert msg.msg == 'third'
+
+    await server.async_close()
+
+
+def create_msg_bytes(text):
+    msg = common.Msg(facility=common.Facility.USER,
+                     severity=common.Severity.INFORMATIONAL,
+                     version=1,
+                     timestamp=None,
+                     hostname=None,
+                     app_name=None,
+                     procid=None,
+                     msgid=None,
+                     data=None,
+                     msg=text)
+    msg_bytes = encoder.msg_to_str(msg).encode()
+    return f'{len(msg_bytes)} '.encode() + msg_bytes
+
+
+@pytest.mark.parametrize('frame_policy', list(
+    hat.syslog.server.syslog.FramePolicy))
+async def test_max_frame_size(syslog_port, frame_policy):
+    limits = hat.syslog.server.syslog.Limits(max_frame_size=100,
+                                             frame_policy=frame_policy)
+    queue = aio.Queue()
+    server = await hat.syslog.server.syslog.create_syslog_server(
+        f'tcp://127.0.0.1:{syslog_port}', queue.put_nowait, None, limits)
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', syslog_port)
+    writer.write(create_msg_bytes('abc'))
+    writer.write(create_msg_bytes('x' * 1000))
+    writer.write(create_msg_bytes('def'))
+
+    msg = await queue.get()
+    assert msg.msg == 'abc'
+
+    if frame_policy == hat.syslog.server.syslog.FramePolicy.TRUNCATE:
+        msg = await queue.get()
+        assert 0 < len(msg.msg) < 100
+        assert set(msg.msg) == {'x'}
+
+        msg = await queue.get()
+        assert msg.msg == 'def'
+
+        assert server.stats.truncated_frames == 1
+        assert server.stats.rejected_frames == 0
+
+    else:
+        await reader.read()
+        assert queue.empty()
+
+        assert server.stats.truncated_frames == 0
+        assert server.stats.rejected_frames == 1
+
+    writer.close()
+    await server.async_close()
+
+
+async def test_stats_log(monkeypatch, caplog, syslog_port):
+    monkeypatch.setattr(hat.syslog.server.syslog, 'stats_log_interval',
+                        0.01)
+
+    queue = aio.Queue()
+    server = await hat.syslog.server.syslog.create_syslog_server(
+        f'udp://127.0.0.1:{syslog_port}', queue.put_nowait, None)
+
+    with caplog.at_level(logging.INFO, logger='hat.syslog.server.syslog'):
+        server.pause_reading()
+        await asyncio.sleep(0.05)
+        server.resume_reading()
+        await asyncio.sleep(0.05)
+
+    records = [i.getMessage() for i in caplog.records
+               if 'listener stats' in i.getMessage()]
+    assert records
+    assert all(i.startswith(f'udp 127.0.0.1:{syslog_port} listener stats: '
+                            f'stall_time=')
+               for i in records)
+
+    # stats are not logged while they are unchanged
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger='hat.syslog.server.syslog'):
+        await asyncio.sleep(0.05)
+    assert not any('listener stats' in i.getMessage()
+                   for i in caplog.records)
+
+    await server.async_close()
+
+
+@pytest.mark.parametrize('frame_policy', list(
+    hat.syslog.server.syslog.FramePolicy))
+@pytest.mark.parametrize('size', [b'-5', b'5x'])
+async def test_invalid_octet_count(syslog_port, frame_policy, size):
+    limits = hat.syslog.server.syslog.Limits(frame_policy=frame_policy)
+    queue = aio.Queue()
+    server = await hat.syslog.server.syslog.create_syslog_server(
+        f'tcp://127.0.0.1:{syslog_port}', queue.put_nowait, None, limits)
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', syslog_port)
+    writer.write(create_msg_bytes('abc'))
+    writer.write(size + b' abc\n')
+    writer.write(create_msg_bytes('def'))
+
+    msg = await queue.get()
+    assert msg.msg == 'abc'
+
+    if frame_policy == hat.syslog.server.syslog.FramePolicy.TRUNCATE:
+        msg = await queue.get()
+        assert msg.msg == 'def'
+
+        assert server.stats.dropped == 1
+        assert server.stats.rejected_frames == 0
+
+    else:
+        await reader.read()
+        assert queue.empty()
+
+        assert server.stats.rejected_frames == 1
+
+    assert server.stats.connections == 1 - int(
+        frame_policy == hat.syslog.server.syslog.FramePolicy.REJECT)
+
+    writer.close()
+    await server.async_close()
+
+
+async def test_max_connections(syslog_port):
+    limits = hat.syslog.server.syslog.Limits(max_connections=2)
+    queue = aio.Queue()
+    server = await hat.syslog.server.syslog.create_syslog_server(
+        f'tcp://127.0.0.1:{syslog_port}', queue.put_nowait, None, limits)
+
+    conns = []
+    for i in range(3):
+        conn = await asyncio.open_connection('127.0.0.1', syslog_port)
+        conns.append(conn)
+
+    reader, _ = conns[-1]
+    assert await reader.read() == b''
+
+    assert server.stats.connections == 2
+    assert server.stats.rejected_connections == 1
+
+    for i, (_, writer) in enumerate(conns[:2]):
+        writer.write(create_msg_bytes(str(i)))
+        msg = await queue.get()
+        assert msg.msg == str(i)
+
+    for _, writer in conns:
+        writer.close()
+    await server.async_close()
+
+
+async def test_idle_timeout(syslog_port):
+    limits = hat.syslog.server.syslog.Limits(idle_timeout=0.05)
+    queue = aio.Queue()
+    server = await hat.syslog.server.syslog.create_syslog_server(
+        f'tcp://127.0.0.1:{syslog_port}', queue.put_nowait, None, limits)
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', syslog_port)
+    writer.write(create_msg_bytes('abc'))
+
+    msg = await queue.get()
+    assert msg.msg == 'abc'
+
+    assert await reader.read() == b''
+    assert server.stats.idle_timeouts == 1
+    assert server.stats.connections == 0
+
+    writer.close()
+    await server.async_close()
+
+
+async def test_idle_timeout_paused(syslog_port):
+    limits = hat.syslog.server.syslog.Limits(idle_timeout=0.05)
+    queue = aio.Queue()
+    server = await hat.syslog.server.syslog.create_syslog_server(
+        f'tcp://127.0.0.1:{syslog_port}', queue.put_nowait, None, limits)
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', syslog_port)
+    writer.write(create_msg_bytes('abc'))
+
+    msg = await queue.get()
+    assert msg.msg == 'abc'
+
+    server.pause_reading()
+    for i in range(5):
+        writer.write(create_msg_bytes(str(i)))
+        await asyncio.sleep(0.03)
+
+    assert server.stats.idle_timeouts == 0
+    assert server.stats.connections == 1
+
+    server.resume_reading()
+    for i in range(5):
+        msg = await queue.get()
+        assert msg.msg == str(i)
+
+    assert await reader.read() == b''
+    assert server.stats.idle_timeouts == 1
+    assert server.stats.connections == 0
+
+    writer.close()
+    await server.async_close()
+
+
+async def test_rate_limit(syslog_port):
+    limiter = await hat.syslog.server.ratelimit.create_rate_limiter(
+        hat.syslog.server.ratelimit.Limit(rate=1e-3, burst=1), {},
+        lambda _: None)
+    queue = aio.Queue()
+    server = await hat.syslog.server.syslog.create_syslog_server(
+        f'tcp://127.0.0.1:{syslog_port}', queue.put_nowait, None,
+        hat.syslog.server.syslog.Limits(), limiter)
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', syslog_port)
+    for i in range(3):
+        writer.write(create_msg_bytes(str(i)))
+
+    msg = await queue.get()
+    assert msg.msg == '0'
+
+    while server.stats.rate_limited < 2:
+        await asyncio.sleep(0.01)
+    assert queue.empty()
+
+    writer.close()
+    await server.async_close()
+    await limiter.async_close()
+
+
+async def test_relp_ack(syslog_port):
+    msg_queue = aio.Queue()
+    sync_queue = aio.Queue()
+    sync_future = asyncio.get_running_loop().create_future()
+
+    async def on_sync():
+        sync_queue.put_nowait(None)
+        await sync_future
+
+    server = await hat.syslog.server.syslog.create_syslog_server(
+        f'relp://127.0.0.1:{syslog_port}', msg_queue.put_nowait, None,
+        sync_cb=on_sync)
+    reader, writer = await asyncio.open_connection('127.0.0.1', syslog_port)
+
+    open_data = b'relp_version=0\ncommands=syslog'
+    writer.write(b'1 open %d %s\n' % (len(open_data), open_data))
+    rsp = await reader.readuntil(b' ')
+    assert rsp == b'1 '
+    rsp = await reader.readuntil(b' ')
+    assert rsp == b'rsp '
+    rsp = await reader.readuntil(b' ')
+    rsp = await reader.readexactly(int(rsp) + 1)
+    assert rsp.startswith(b'200 OK\n')
+
+    msg_bytes = create_msg_bytes('abc').split(b' ', 1)[1]
+    writer.write(b'2 syslog %d %s\n' % (len(msg_bytes), msg_bytes))
+
+    msg = await msg_queue.get()
+    assert msg.msg == 'abc'
+
+    await sync_queue.get()
+    await asyncio.sleep(0.01)
+    assert not reader.at_eof()
+    assert len(reader._buffer) == 0
+
+    sync_future.set_result(None)
+    rsp = await reader.readuntil(b'\n')
+    assert rsp == b'2 rsp 6 200 OK\n'
+
+    writer.write(b'3 close 0\n')
+    rsp = await reader.readuntil(b'\n')
+    assert rsp == b'3 rsp 6 200 OK\n'
+
+    writer.close()
+    await writer.wait_closed()
+    await server.async_close()
@@ -2,6 +2,7 @@ import asyncio
 import itertools
 import datetime
 
+import aiohttp
 import pytest
 
 from hat import aio
@@ -11,6 +12,7 @@ from hat import util
 from hat.syslog.server import common
 from hat.syslog.server import encoder
 import hat.syslog.server.backend
+import hat.syslog.server.database
 import hat.syslog.server.ui
 
 
@@ -29,18 +31,23 @@ def db_path(tmp_path):
 
 
 @pytest.fixture
-async def backend(monkeypatch, db_path):
-    monkeypatch.setattr(hat.syslog.server.backend, "register_delay", 0)
-    monkeypatch.setattr(hat.syslog.server.backend, "register_queue_treshold",
-                        1)
-    monkeypatch.setattr(hat.syslog.server.backend, "register_queue_size", 1)
+def fts_columns():
+    return []
 
+
+@pytest.fixture
+async def backend(db_path, fts_columns):
     backend = await hat.syslog.server.backend.create_backend(
         path=db_path,
         low_size=1000,
         high_size=0,
         enable_archive=False,
-        disable_journal=False)
+        disable_journal=False,
+        db_fts_columns=fts_columns,
+        register_conf=hat.syslog.server.backend.RegisterConf(
+            max_delay=0,
+            queue_size=1,
+            max_batch_size=1))
 
     try:
         yield backend
@@ -141,7 +148,9 @@ async def test_initial_state(create_server, create_client):
     assert client.state.data == {'filter': default_filter_json,
                                  'entries': [],
                                  'first_id': None,
-                                 'last_id': None}
+                                 'last_id': None,
+                                 'cleanup_running': False,
+                                 'query_timeout': False}
 
     await client.async_close()
     await server.async_close()
@@ -161,7 +170,9 @@ async def test_register_entry(create_server, create_client, create_msg,
     assert client.state.data == {'filter': default_filter_json,
                                  'entries': [],
                                  'first_id': None,
-                                 'last_id': None}
+                                 'last_id': None,
+                                 'cleanup_running': False,
+                                 'query_timeout': False}
 
     for i in range(10):
         msg = create_msg()
@@ -224,7 +235,9 @@ async def test_change_filter(create_server, create_client):
     assert client.state.data == {'filter': default_filter_json,
                                  'entries': [],
                                  'first_id': None,
-                                 'last_id': None}
+                                 'last_id': None,
+                                 'cleanup_running': False,
+                                 'query_timeout': False}
 
     new_filter = common.Filter(
         max_results=hat.syslog.server.ui.max_results_limit * 2,
@@ -241,10 +254,226 @@ async def test_change_filter(create_server, create_client):
                        max_results=hat.syslog.server.ui.max_results_limit),
         'entries': [],
         'first_id': None,
-        'last_id': None}
+        'last_id': None,
+        'cleanup_running': False,
+        'query_timeout': False}
+
+    await client.async_close()
+    await server.async_close()
+
+
+async def test_superseded_filter(monkeypatch, create_server,
+                                 create_client, backend):
+    queries = aio.Queue()
+    backend_query = backend.query
+
+    async def query(filter, timeout=None):
+        if filter.hostname != 'abc':
+            return await backend_query(filter, timeout)
+
+        future = asyncio.get_running_loop().create_future()
+        queries.put_nowait(future)
+        await future
+
+    monkeypatch.setattr(backend, 'query', query)
+
+    server = await create_server()
+    client = await create_client()
+
+    change_queue = aio.Queue()
+    client.state.register_change_cb(change_queue.put_nowait)
+
+    while not client.state.data:
+        await change_queue.get()
+
+    filter_json = encoder.filter_to_json(
+        common.Filter(max_results=10, hostname='abc'))
+    task = asyncio.create_task(client.send('filter', filter_json))
+
+    future = await queries.get()
+
+    new_filter_json = encoder.filter_to_json(
+        common.Filter(max_results=10, hostname='xyz'))
+    await client.send('filter', new_filter_json)
+
+    assert future.cancelled()
+
+    await task
+
+    state = await change_queue.get()
+    assert state['filter'] == new_filter_json
+    assert client.state.data['filter'] == new_filter_json
 
     await client.async_close()
     await server.async_close()
 
 
+async def test_query_timeout(monkeypatch, port, backend, create_client,
+                             create_msg, register_entry):
+    timeouts = []
+    backend_query = backend.query
+
+    async def query(filter, timeout=None):
+        timeouts.append(timeout)
+        entries = await backend_query(filter, timeout)
+        if filter.max_results != 10:
+            return entries
+
+        raise hat.syslog.server.database.QueryTimeoutError(entries[:2])
+
+    monkeypatch.setattr(hat.syslog.server.ui, "autoflush_delay", 0)
+    monkeypatch.setattr(backend, 'query', query)
+
+    for _ in range(5):
+        await register_entry(create_msg())
+    await backend.sync()
+
+    server = await hat.syslog.server.ui.create_web_server(
+        f'http://127.0.0.1:{port}', backend, 5)
+    client = await create_client()
+
+    change_queue = aio.Queue()
+    client.state.register_change_cb(change_queue.put_nowait)
+
+    while not client.state.data:
+        await change_queue.get()
+
+    assert len(client.state.data['entries']) == 5
+    assert client.state.data['query_timeout'] is False
+
+    filter_json = encoder.filter_to_json(common.Filter(max_results=10))
+    await client.send('filter', filter_json)
+
+    state = await change_queue.get()
+    assert state['filter'] == filter_json
+    assert [i['id'] for i in state['entries']] == [5, 4]
+    assert state['query_timeout'] is True
+    assert timeouts == [5, 5]
+
+    await client.async_close()
+    await server.async_close()
+
+
+async def test_query_stats(port, create_server, create_client):
+    server = await create_server()
+    client = await create_client()
+
+    change_queue = aio.Queue()
+    client.state.register_change_cb(change_queue.put_nowait)
+
+    while not client.state.data:
+        await change_queue.get()
+
+    new_filter_json = encoder.filter_to_json(
+        common.Filter(max_results=10,
+                      hostname='abc',
+                      match_type=common.MatchType.EXACT))
+    await client.send('filter', new_filter_json)
+
+    for _ in range(2):
+        await client.send('filter', default_filter_json)
+        await client.send('filter', new_filter_json)
+
+    async with aiohttp.ClientSession() as session:
+        url = f'http://127.0.0.1:{port}/admin/query-stats'
+        async with session.get(url) as res:
+            assert res.status == 200
+            query_stats = await res.json()
+
+    query_stats = {tuple(i['shape']): i for i in query_stats}
+    assert query_stats.keys() == {(), ('hostname:EXACT', )}
+
+    assert query_stats[()]['count'] == 3
+    assert query_stats[('hostname:EXACT', )]['count'] == 3
+
+    for i in query_stats.values():
+        assert i['total_rows'] == 0
+        assert i['timeout_count'] == 0
+        assert i['avg_duration'] == i['total_duration'] / i['count']
+        assert i['plan']
+
+    await client.async_close()
+    await server.async_close()
+
+
+@pytest.mark.parametrize('fts_columns, indexes', [
+    ([], [3, 1, 0]),
+    (['msg'], [3, 0])])
+async def test_fulltext_filter(create_server, create_client, create_msg,
+                               register_entry, indexes):
+    server = await create_server()
+    client = await create_client()
+
+    change_queue = aio.Queue()
+    client.state.register_change_cb(change_queue.put_nowait)
+
+    while not client.state.data:
+        await change_queue.get()
+
+    new_filter = common.Filter(max_results=10,
+                               msg='mess* No',
+                               match_type=common.MatchType.FULLTEXT)
+    new_filter_json = encoder.filter_to_json(new_filter)
+
+    await client.send('filter', new_filter_json)
+
+    state = await change_queue.get()
+    assert state['filter'] == new_filter_json
+
+    msgs = [create_msg(),
+            create_msg()._replace(msg='xmessage no 1'),
+            create_msg()._replace(msg='message number 1'),
+            create_msg()]
+    for msg in msgs:
+        await register_entry(msg)
+
+    while len(client.state.data['entries']) < len(indexes):
+        await change_queue.get()
+
+    assert [i['msg'] for i in client.state.data['entries']] == [
+        encoder.msg_to_json(msgs[i]) for i in indexes]
+
+    await client.async_close()
+    await server.async_close()
+
+
+@pytest.mark.parametrize('fts_columns', [
+    [],
+    ['msg', 'app_name', 'hostname']])
+@pytest.mark.parametrize('match_type', list(common.MatchType))
+async def test_filter_entries_query(db_path, create_msg, fts_columns,
+                                    match_type):
+    values = ['srv1 host', 'foo_bar baz', 'foo bar', 'Éclair CAFÉ', 'a---b',
+              'x.y', 'message no 1', 'xmessage number 1', '100%', 'Straße',
+              '', None]
+    filter_values = ['srv', 'foo', 'FOO', 'foo_ba*', 'bar baz', 'o_b',
+                     'cafe', 'éclair', 'ÉCLAIR', 'x.y', 'a_b', '---', '*',
+                     'mess* no', '%', 'straße', 'STRASSE', 'foo bar']
+
+    db = await hat.syslog.server.database.create_database(
+        db_path, False, fts_columns=fts_columns)
+
+    msgs = [create_msg()._replace(hostname=value,
+                                  app_name=value,
+                                  procid=value,
+                                  msgid=value,
+                                  msg=value)
+            for value in values]
+    entries = await db.add_msgs([(now(), msg) for msg in msgs])
+
+    for name in ['hostname', 'app_name', 'procid', 'msgid', 'msg']:
+        for filter_value in filter_values:
+            f = common.Filter(match_type=match_type,
+                              **{name: filter_value})
+
+            result = await db.query(f)
+            filtered = hat.syslog.server.ui._filter_entries(
+                f, entries, db.fts_columns)
+
+            assert ({i.id for i in filtered} ==
+                    {i.id for i in result}), (name, filter_value)
+
+    await db.async_close()
+
+
 # TODO test filter